@@ -0,0 +1,57 @@
+"""
+Compara vazão/latência de resgates concorrentes entre o app síncrono (Flask)
+e o modo asyncio (async_app.py), com a mesma carga do loadtest.py via HTTP.
+
+Suba os dois serviços contra o mesmo Postgres, por exemplo:
+    flask --app app run --port 5000 --with-threads
+    hypercorn async_app:app --bind 0.0.0.0:5001
+
+Uso:
+    python benchmarks/bench_async_vs_sync.py --workers 32 --duracao 15
+"""
+import argparse
+import contextlib
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+from loadtest import rodar  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sync-url", default="http://localhost:5000")
+    parser.add_argument("--async-url", default="http://localhost:5001")
+    parser.add_argument("--workers", type=int, default=32)
+    parser.add_argument("--duracao", type=float, default=10.0)
+    parser.add_argument("--mix", default="0:1:0", help="pesos emitir:resgatar:duplo (padrão: só resgates)")
+    parser.add_argument("--aquecimento", type=int, default=5000, help="tokens emitidos antes de cada rodada")
+    parser.add_argument("--user-id", default="22222222-2222-2222-2222-222222222222")
+    args = parser.parse_args()
+
+    rodadas = {}
+    for nome, url in (("sync", args.sync_url), ("async", args.async_url)):
+        config = argparse.Namespace(alvo="http", url=url, workers=args.workers, duracao=args.duracao,
+                                    operacoes=None, mix=args.mix, qtd_emissao=10,
+                                    aquecimento=args.aquecimento, user_id=args.user_id)
+        with contextlib.redirect_stdout(sys.stderr):
+            rodadas[nome] = rodar(config)
+
+    resumo = {}
+    for nome, r in rodadas.items():
+        resgates = r["operations"]["resgatar"]
+        resumo[nome] = {
+            "redeem_ok_per_s": round(resgates["ok"] / r["elapsed_s"], 1),
+            "redeem_latency_ms": resgates["latency_ms"],
+            "redeem_outcomes": resgates["outcomes"],
+            "transactions": r["transactions"],
+        }
+    sync_ok, async_ok = resumo["sync"]["redeem_ok_per_s"], resumo["async"]["redeem_ok_per_s"]
+    resumo["async_vs_sync"] = round(async_ok / sync_ok, 2) if sync_ok else None
+    print(json.dumps({"summary": resumo, "runs": rodadas}, indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""
+Benchmark de emissão em lote: tokens/s para qtd = 1, 100, 10k e 100k.
+
+Mede separadamente a assinatura (CPU) e a assinatura + gravação no Postgres.
+A gravação é desfeita com ROLLBACK ao final de cada rodada para não poluir o banco.
+
+Uso:
+    python benchmarks/bench_issue_tokens.py            # assinatura + banco
+    python benchmarks/bench_issue_tokens.py --sem-db   # apenas assinatura
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "wallet_service"))
+
+import psycopg2  # noqa: E402
+from issue_tokens import assinar_tokens, gravar_tokens  # noqa: E402
+
+QTDS = [1, 100, 10_000, 100_000]
+
+
+def conectar():
+    return psycopg2.connect(
+        dbname=os.getenv("DB_NAME", "offlinepay"),
+        user=os.getenv("DB_USER", "admin"),
+        password=os.getenv("DB_PASS", "admin123"),
+        host=os.getenv("DB_HOST", "localhost"),
+        port=os.getenv("DB_PORT", "5432"),
+    )
+
+
+def rodada(qtd, conn):
+    t0 = time.perf_counter()
+    linhas, _ = assinar_tokens(qtd)
+    t_assinatura = time.perf_counter() - t0
+
+    t_gravacao = None
+    if conn is not None:
+        cur = conn.cursor()
+        t1 = time.perf_counter()
+        gravar_tokens(cur, linhas)
+        t_gravacao = time.perf_counter() - t1
+        conn.rollback()
+        cur.close()
+
+    total = t_assinatura + (t_gravacao or 0)
+    return {
+        "qtd": qtd,
+        "sign_s": round(t_assinatura, 4),
+        "insert_s": round(t_gravacao, 4) if t_gravacao is not None else None,
+        "tokens_per_s": round(qtd / total, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sem-db", action="store_true", help="mede apenas a assinatura")
+    parser.add_argument("--qtd", type=int, nargs="*", default=QTDS)
+    args = parser.parse_args()
+
+    conn = None if args.sem_db else conectar()
+    resultados = [rodada(qtd, conn) for qtd in args.qtd]
+    if conn is not None:
+        conn.close()
+
+    for r in resultados:
+        print(f"qtd={r['qtd']:>7}  {r['tokens_per_s']:>10} tokens/s  "
+              f"(assinatura {r['sign_s']}s, banco {r['insert_s']}s)", file=sys.stderr)
+    print(json.dumps(resultados))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""
+Benchmark da emissão com árvore de Merkle (merkle.py, ISSUE_SIGNING=merkle)
+contra uma assinatura Ed25519 por token.
+
+Mede, em tokens/s:
+  - assinatura (issue_tokens.assinar_payloads: canonical_bytes + sha256 + assinatura/árvore)
+  - verificação no resgate (token_verify.verificar_lote), com o cache de raízes
+    vazio (fria: uma Ed25519 por árvore) e cheio (quente: só hashes)
+e o tamanho do token binário (token_wire) com a prova. Confere que todo token
+verifica e que um payload adulterado é recusado.
+
+Uso:
+    python benchmarks/bench_merkle.py --qtd 10000 --folhas 64,256,1024
+"""
+import argparse
+import base64
+import json
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "wallet_service"))
+
+import issue_tokens  # noqa: E402
+import merkle  # noqa: E402
+import token_verify  # noqa: E402
+import token_wire  # noqa: E402
+
+
+def por_segundo(funcao, n):
+    inicio = time.perf_counter()
+    saida = funcao()
+    return saida, round(n / (time.perf_counter() - inicio), 1)
+
+
+def itens(emitidos):
+    return [(t["payload"]["token_id"], t["payload"], t["signature_b64"], t.get("merkle_proof_b64"))
+            for t in emitidos]
+
+
+def verificar(emitidos):
+    _, erros, _ = token_verify.verificar_lote(itens(emitidos))
+    assert not erros, f"{len(erros)} token(s) recusado(s): {next(iter(erros.values()))}"
+
+
+def adulterado_recusado(emitidos):
+    token = dict(emitidos[len(emitidos) // 2])
+    token["payload"] = dict(token["payload"], denom_cents=token["payload"]["denom_cents"] * 100)
+    _, erros, _ = token_verify.verificar_lote(itens([token]))
+    return bool(erros)
+
+
+def medir(payloads, modo):
+    n = len(payloads)
+    (_, emitidos), assinatura = por_segundo(lambda: issue_tokens.assinar_payloads(payloads, modo), n)
+    merkle.raiz_assinada.cache_clear()
+    _, fria = por_segundo(lambda: verificar(emitidos), n)
+    _, quente = por_segundo(lambda: verificar(emitidos), n)
+    assert adulterado_recusado(emitidos)
+    binarios = [token_wire.codificar(t) for t in emitidos]
+    provas = [len(base64.b64decode(t["merkle_proof_b64"])) for t in emitidos if "merkle_proof_b64" in t]
+    return {
+        "sign_tokens_per_s": assinatura,
+        "verify_cold_tokens_per_s": fria,
+        "verify_warm_tokens_per_s": quente,
+        "ed25519_signatures": len({t["signature_b64"] for t in emitidos}),
+        "binary_token_bytes_mean": round(statistics.mean(map(len, binarios)), 1),
+        "proof_bytes_mean": round(statistics.mean(provas), 1) if provas else 0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--qtd", type=int, default=10_000)
+    parser.add_argument("--folhas", default="8,16,64", help="tamanhos máximos de árvore (ISSUE_MERKLE_LEAVES, até 64)")
+    args = parser.parse_args()
+
+    payloads = issue_tokens.novos_payloads(args.qtd)
+    resultado = {"tokens": args.qtd, "per_token": medir(payloads, "token"), "merkle": {}}
+    for folhas in map(int, args.folhas.split(",")):
+        issue_tokens.MERKLE_LEAVES = folhas
+        resultado["merkle"][folhas] = medir(payloads, "merkle")
+    print(json.dumps(resultado, indent=2))
+
+
+if __name__ == "__main__":
+    main()
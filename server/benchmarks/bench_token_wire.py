@@ -0,0 +1,94 @@
+"""
+Benchmark do formato binário (token_wire.py) contra o JSON atual.
+
+Mede, por token:
+  - tamanho do token (JSON do /tokens/issue vs binário)
+  - tamanho do envelope P2P cifrado (JSON + base64 do client_wallet antigo vs binário)
+  - tempo de codificação/decodificação
+e confere que todo token decodificado reproduz exatamente canonical_bytes e a assinatura.
+
+Uso:
+    python benchmarks/bench_token_wire.py --qtd 10000
+"""
+import argparse
+import base64
+import json
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "wallet_service"))
+
+from nacl.secret import SecretBox  # noqa: E402
+from nacl.utils import random  # noqa: E402
+
+import token_wire  # noqa: E402
+from issue_tokens import SERVER_PK_B64, assinar_mix, canonical_bytes  # noqa: E402
+
+
+def envelope_json(token):
+    """Transferência P2P como era no client_wallet: JSON cifrado dentro de JSON com base64."""
+    chave, nonce = random(SecretBox.KEY_SIZE), random(SecretBox.NONCE_SIZE)
+    cifrado = SecretBox(chave).encrypt(json.dumps(token).encode(), nonce).ciphertext
+    return json.dumps({
+        "encrypted_token_b64": base64.b64encode(cifrado).decode(),
+        "transfer_key_b64": base64.b64encode(chave).decode(),
+        "nonce_b64": base64.b64encode(nonce).decode(),
+    }).encode()
+
+
+def envelope_binario(token):
+    chave = random(SecretBox.KEY_SIZE)
+    return chave + bytes(SecretBox(chave).encrypt(token_wire.codificar(token)))
+
+
+def cronometrar(funcao, itens):
+    inicio = time.perf_counter()
+    saida = [funcao(i) for i in itens]
+    return saida, (time.perf_counter() - inicio) * 1e6 / len(itens)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--qtd", type=int, default=10_000)
+    parser.add_argument("--mix", default="100:1,500:1,1000:1,5000:1,10000:1",
+                        help="pesos por denominação, ex. 100:1,10000:1")
+    args = parser.parse_args()
+
+    pesos = dict(tuple(map(int, p.split(":"))) for p in args.mix.split(","))
+    total = sum(pesos.values())
+    mix = {d: max(1, args.qtd * p // total) for d, p in pesos.items()}
+    _, tokens = assinar_mix(mix)
+    chaves = token_wire.indice_de_chaves([SERVER_PK_B64])
+
+    jsons, json_enc = cronometrar(lambda t: json.dumps(t).encode(), tokens)
+    _, json_dec = cronometrar(json.loads, jsons)
+    binarios, bin_enc = cronometrar(token_wire.codificar, tokens)
+    decodificados, bin_dec = cronometrar(lambda b: token_wire.decodificar(b, chaves)[0], binarios)
+
+    for original, volta in zip(tokens, decodificados):
+        assert canonical_bytes(volta["payload"]) == canonical_bytes(original["payload"])
+        assert volta["signature_b64"] == original["signature_b64"]
+
+    amostra = tokens[:1000]
+    print(json.dumps({
+        "tokens": len(tokens),
+        "round_trip_exact": True,
+        "size_bytes": {
+            "json_mean": round(statistics.mean(map(len, jsons)), 1),
+            "binary_mean": round(statistics.mean(map(len, binarios)), 1),
+            "p2p_envelope_json_mean": round(statistics.mean(len(envelope_json(t)) for t in amostra), 1),
+            "p2p_envelope_binary_mean": round(statistics.mean(len(envelope_binario(t)) for t in amostra), 1),
+        },
+        "us_per_token": {
+            "json_encode": round(json_enc, 2),
+            "json_decode": round(json_dec, 2),
+            "binary_encode": round(bin_enc, 2),
+            "binary_decode": round(bin_dec, 2),
+        },
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,381 @@
+"""
+Teste de carga concorrente do wallet-service: emissão, resgate e duplo gasto.
+
+Cada worker sorteia operações segundo o mix (--mix emitir:resgatar:duplo):
+  - emitir: POST /tokens/issue com --qtd-emissao tokens, que entram no estoque
+  - resgatar: retira um token do estoque e o resgata com a prova (espera 200)
+  - duplo: outro usuário (--gastador-id) reapresenta um token já resgatado
+    (espera 409; 200 é duplo gasto aceito!). Pelo mesmo usuário seria só uma
+    retentativa idempotente, que o serviço responde com 200/duplicate.
+Sem estoque para resgatar, o worker emite.
+
+Alvos:
+  --alvo app   app Flask em processo (test_client), mesmo pool/retentativas do serviço
+  --alvo http  serviço rodando em --url (requests.Session por worker)
+  --alvo db    camada de banco direto (emitir_tokens / resgatar_lote), sem HTTP
+
+Saída: JSON com vazão, p50/p95/p99 por operação, retentativas de serialização
+e distribuição de resultados, para comparar rodadas entre mudanças.
+
+Uso:
+    python benchmarks/loadtest.py --alvo app --workers 8 --duracao 20
+    python benchmarks/loadtest.py --alvo http --url http://localhost:5000 --saida run.json
+"""
+import argparse
+import contextlib
+import json
+import math
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+from collections import Counter, defaultdict, deque
+from datetime import datetime, timezone
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "wallet_service"))
+
+USER_ID = "22222222-2222-2222-2222-222222222222"
+GASTADOR_ID = "11111111-1111-1111-1111-111111111111"
+OPERACOES = ("emitir", "resgatar", "duplo")
+EVENTOS_TX = ("retries", "serialization_failures", "deadlocks", "giveups", "budget_exhausted")
+
+
+def item_de(token):
+    return {"token_id": token["payload"]["token_id"], "token_payload": token["payload"],
+            "token_signature_b64": token["signature_b64"], "token_merkle_proof_b64": token.get("merkle_proof_b64")}
+
+
+# ===============================================================
+# Alvos
+# ===============================================================
+class AlvoApp:
+    """App Flask em processo; um test_client por worker."""
+
+    def __init__(self, args):
+        import app as wallet_app
+        import tx
+        self._app = wallet_app.app
+        self._tx = tx
+
+    def cliente(self):
+        return ClienteFlask(self._app.test_client())
+
+    def eventos_tx(self):
+        return self._tx.tx_stats()["by_name"]
+
+
+class ClienteFlask:
+    def __init__(self, client):
+        self.client = client
+
+    def emitir(self, qtd):
+        r = self.client.post("/tokens/issue", json={"qtd": qtd})
+        return r.status_code, (r.get_json() or {}).get("tokens", [])
+
+    def resgatar(self, user_id, token):
+        return self.client.post("/redeem", json=dict(item_de(token), user_id=user_id)).status_code
+
+    def fechar(self):
+        pass
+
+
+class AlvoHttp:
+    """Serviço já rodando; retentativas lidas de GET /stats."""
+
+    def __init__(self, args):
+        import requests
+        self._requests = requests
+        self.url = args.url.rstrip("/")
+
+    def cliente(self):
+        return ClienteHttp(self._requests.Session(), self.url)
+
+    def eventos_tx(self):
+        return self._requests.get(f"{self.url}/stats", timeout=10).json()["transactions"]["by_name"]
+
+
+class ClienteHttp:
+    def __init__(self, session, url):
+        self.session, self.url = session, url
+
+    def emitir(self, qtd):
+        r = self.session.post(f"{self.url}/tokens/issue", json={"qtd": qtd}, timeout=30)
+        return r.status_code, r.json().get("tokens", []) if r.ok else []
+
+    def resgatar(self, user_id, token):
+        r = self.session.post(f"{self.url}/redeem", json=dict(item_de(token), user_id=user_id), timeout=30)
+        return r.status_code
+
+    def fechar(self):
+        self.session.close()
+
+
+class AlvoDb:
+    """Camada de banco direto: uma conexão do pool por worker."""
+
+    def __init__(self, args):
+        import tx
+        from db import get_pool
+        self._tx = tx
+        self._pool = get_pool()
+
+    def cliente(self):
+        return ClienteDb(self._pool)
+
+    def eventos_tx(self):
+        return self._tx.tx_stats()["by_name"]
+
+
+class ClienteDb:
+    # resultado do item -> status equivalente do POST /redeem
+    STATUS_POR_RESULTADO = {"applied": 200, "duplicate": 200, "already_redeemed": 409,
+                            "not_found": 404, "expired": 410, "invalid_signature": 422}
+
+    def __init__(self, pool):
+        import tx
+        from issue_tokens import emitir_tokens
+        from redeem_batch import resgatar_lote
+        self._emitir, self._resgatar, self._esgotada = emitir_tokens, resgatar_lote, tx.TransacaoEsgotada
+        self.pool = pool
+        self.conn = pool.getconn()
+
+    def emitir(self, qtd):
+        return 201, self._emitir(qtd, db=self.conn)
+
+    def resgatar(self, user_id, token):
+        try:
+            corpo, status, _ = self._resgatar(lambda: self.conn, user_id, [item_de(token)])
+        except self._esgotada:
+            return 503
+        if status != 200:
+            return status
+        return self.STATUS_POR_RESULTADO.get(corpo["results"][0]["result"], 500)
+
+    def fechar(self):
+        self.pool.putconn(self.conn)
+
+
+ALVOS = {"app": AlvoApp, "http": AlvoHttp, "db": AlvoDb}
+
+
+# ===============================================================
+# Carga
+# ===============================================================
+class Estoque:
+    """Tokens emitidos aguardando resgate e tokens já resgatados (para duplo gasto)."""
+
+    def __init__(self):
+        self.livres = deque()
+        self.resgatados = []
+        self._lock = threading.Lock()
+
+    def guardar(self, tokens):
+        self.livres.extend(tokens)
+
+    def retirar(self):
+        try:
+            return self.livres.popleft()
+        except IndexError:
+            return None
+
+    def marcar_resgatado(self, token):
+        with self._lock:
+            self.resgatados.append(token)
+
+    def algum_resgatado(self):
+        with self._lock:
+            return random.choice(self.resgatados) if self.resgatados else None
+
+
+def classificar(operacao, status):
+    """'ok' quando o serviço respondeu o esperado; senão o motivo."""
+    if operacao == "emitir":
+        return "ok" if status == 201 else f"http_{status}"
+    if operacao == "resgatar":
+        return {200: "ok", 409: "conflict", 503: "retries_exhausted"}.get(status, f"http_{status}")
+    return {409: "ok", 200: "double_spend_accepted"}.get(status, f"http_{status}")
+
+
+def worker(alvo, args, estoque, fim, pesos, resultados):
+    latencias = defaultdict(list)
+    desfechos = defaultdict(Counter)
+    cliente = alvo.cliente()
+    try:
+        while time.perf_counter() < fim.prazo and not fim.parar.is_set():
+            operacao = random.choices(OPERACOES, weights=pesos)[0]
+            token = None
+            if operacao == "resgatar":
+                token = estoque.retirar()
+            elif operacao == "duplo":
+                token = estoque.algum_resgatado()
+            if token is None and operacao != "emitir":
+                operacao = "emitir"
+
+            inicio = time.perf_counter()
+            try:
+                if operacao == "emitir":
+                    status, tokens = cliente.emitir(args.qtd_emissao)
+                    estoque.guardar(tokens)
+                else:
+                    status = cliente.resgatar(args.user_id if operacao == "resgatar" else args.gastador_id, token)
+                    if operacao == "resgatar" and status == 200:
+                        estoque.marcar_resgatado(token)
+                desfecho = classificar(operacao, status)
+            except Exception as e:
+                desfecho = f"exception_{type(e).__name__}"
+            latencias[operacao].append(time.perf_counter() - inicio)
+            desfechos[operacao][desfecho] += 1
+
+            if fim.contar():
+                break
+    finally:
+        cliente.fechar()
+    resultados.append((latencias, desfechos))
+
+
+class Fim:
+    """Encerra por tempo (--duracao) ou por número total de operações (--operacoes)."""
+
+    def __init__(self, duracao, operacoes):
+        self.prazo = time.perf_counter() + duracao if duracao else math.inf
+        self.restantes = operacoes
+        self.parar = threading.Event()
+        self._lock = threading.Lock()
+
+    def contar(self):
+        if self.restantes is None:
+            return False
+        with self._lock:
+            self.restantes -= 1
+            if self.restantes <= 0:
+                self.parar.set()
+            return self.parar.is_set()
+
+
+def percentil(ordenados, p):
+    if not ordenados:
+        return None
+    return ordenados[max(0, math.ceil(p / 100 * len(ordenados)) - 1)]
+
+
+def somar_eventos(por_nome):
+    total = Counter()
+    for contadores in por_nome.values():
+        for evento in EVENTOS_TX:
+            total[evento] += contadores.get(evento, 0)
+    return total
+
+
+def git_rev():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(__file__), timeout=5).stdout.strip() or None
+    except Exception:
+        return None
+
+
+def rodar(args):
+    pesos = [float(p) for p in args.mix.split(":")]
+    if len(pesos) != len(OPERACOES):
+        sys.exit("--mix deve ter três pesos: emitir:resgatar:duplo")
+
+    alvo = ALVOS[args.alvo](args)
+    estoque = Estoque()
+
+    # estoque inicial fora da medição
+    cliente = alvo.cliente()
+    try:
+        restantes = args.aquecimento
+        while restantes > 0:
+            status, tokens = cliente.emitir(min(restantes, 500))
+            if status != 201:
+                sys.exit(f"Falha ao emitir o estoque inicial (HTTP {status})")
+            if not tokens:
+                sys.exit("Falha ao emitir o estoque inicial (emissão devolveu 0 tokens)")
+            estoque.guardar(tokens)
+            restantes -= len(tokens)
+    finally:
+        cliente.fechar()
+
+    antes = somar_eventos(alvo.eventos_tx())
+    fim = Fim(args.duracao if args.operacoes is None else None, args.operacoes)
+    resultados = []
+    threads = [threading.Thread(target=worker, args=(alvo, args, estoque, fim, pesos, resultados))
+               for _ in range(args.workers)]
+    inicio = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    decorrido = time.perf_counter() - inicio
+    depois = somar_eventos(alvo.eventos_tx())
+
+    latencias = defaultdict(list)
+    desfechos = defaultdict(Counter)
+    for lat, des in resultados:
+        for op, valores in lat.items():
+            latencias[op] += valores
+        for op, contagem in des.items():
+            desfechos[op].update(contagem)
+
+    por_operacao = {}
+    for op in OPERACOES:
+        ordenados = sorted(latencias[op])
+        por_operacao[op] = {
+            "count": len(ordenados),
+            "ok": desfechos[op]["ok"],
+            "ops_per_s": round(len(ordenados) / decorrido, 1) if decorrido else 0.0,
+            "latency_ms": {
+                nome: round(v * 1000, 3) if v is not None else None
+                for nome, v in (("p50", percentil(ordenados, 50)), ("p95", percentil(ordenados, 95)),
+                                ("p99", percentil(ordenados, 99)),
+                                ("max", ordenados[-1] if ordenados else None))
+            },
+            "outcomes": dict(desfechos[op]),
+        }
+
+    total = sum(len(v) for v in latencias.values())
+    return {
+        "started_at": datetime.now(timezone.utc).isoformat(),
+        "git_rev": git_rev(),
+        "config": {"alvo": args.alvo, "url": args.url if args.alvo == "http" else None,
+                   "workers": args.workers, "mix": args.mix, "qtd_emissao": args.qtd_emissao,
+                   "duracao_s": args.duracao, "operacoes": args.operacoes, "aquecimento": args.aquecimento},
+        "elapsed_s": round(decorrido, 3),
+        "total_ops": total,
+        "throughput_ops_per_s": round(total / decorrido, 1) if decorrido else 0.0,
+        "operations": por_operacao,
+        "transactions": {evento: depois[evento] - antes[evento] for evento in EVENTOS_TX},
+        "errors": {op: {k: v for k, v in desfechos[op].items() if k != "ok"} for op in OPERACOES},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--alvo", choices=sorted(ALVOS), default="app")
+    parser.add_argument("--url", default="http://localhost:5000")
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--duracao", type=float, default=10.0, help="segundos de medição")
+    parser.add_argument("--operacoes", type=int, help="encerra após N operações (ignora --duracao)")
+    parser.add_argument("--mix", default="1:8:1", help="pesos emitir:resgatar:duplo")
+    parser.add_argument("--qtd-emissao", type=int, default=10, help="tokens por emissão")
+    parser.add_argument("--aquecimento", type=int, default=500, help="tokens emitidos antes da medição")
+    parser.add_argument("--user-id", default=USER_ID)
+    parser.add_argument("--gastador-id", default=GASTADOR_ID, help="usuário que tenta o duplo gasto")
+    parser.add_argument("--saida", help="grava o JSON neste arquivo (além do stdout)")
+    args = parser.parse_args()
+
+    # os prints do serviço vão para stderr; stdout fica só com o JSON
+    with contextlib.redirect_stdout(sys.stderr):
+        relatorio = rodar(args)
+    texto = json.dumps(relatorio, indent=2, ensure_ascii=False)
+    print(texto)
+    if args.saida:
+        with open(args.saida, "w") as f:
+            f.write(texto + "\n")
+
+
+if __name__ == "__main__":
+    main()
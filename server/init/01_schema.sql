@@ -35,7 +35,7 @@ CREATE TABLE tokens (
   denom_cents     BIGINT NOT NULL CHECK (denom_cents > 0),
   issuer_pubkey   BYTEA NOT NULL,             -- pubkey do emissor (server) para auditoria
   issued_at       TIMESTAMPTZ NOT NULL,
-  exp_at          TIMESTAMPTZ,                -- opcional
+  exp_at          TIMESTAMPTZ,                -- opcional; igual ao exp_at do payload assinado (ver token_expiry.py)
   state           token_state NOT NULL DEFAULT 'ISSUED',
   -- O "owner_hint" é opcional (privacidade). Não é canônico; titularidade muda no cliente.
   owner_hint      UUID,                        -- último recebedor conhecido (será confirmado no resgate)
@@ -63,28 +63,146 @@ CREATE TABLE redemption_items (
   UNIQUE (token_id)
 );
 
--- 6. Razão contábil (partidas dobradas)
+-- 6. Razão contábil (partidas dobradas), particionado por mês em created_at.
+--    Partições futuras: ledger_ensure_partitions(); partições fechadas são
+--    destacadas/arquivadas por wallet_service/ledger_partitions.py, que grava o
+--    saldo acumulado de cada conta em ledger_checkpoints antes de destacar.
+--    A partição DEFAULT só recebe lançamentos se o mês ainda não tiver partição
+--    (serviço sem manutenção por mais de LEDGER_PARTITIONS_AHEAD meses): o
+--    lançamento não falha, ledger_ensure_partitions() move essas linhas para a
+--    partição do mês quando a cria, e o serviço alerta enquanto ela não estiver vazia.
 CREATE TABLE ledger_entries (
-  entry_id        BIGSERIAL PRIMARY KEY,
+  entry_id        BIGSERIAL,
   tx_id           UUID NOT NULL,                 -- ID lógico da transação (redenção)
   created_at      TIMESTAMPTZ NOT NULL DEFAULT now(),
   account_id      UUID NOT NULL REFERENCES accounts(account_id),
   side            entry_side NOT NULL,           -- DEBIT/CREDIT
   amount_cents    BIGINT NOT NULL CHECK (amount_cents >= 0),
   currency        TEXT NOT NULL,
-  description     TEXT
+  description     TEXT,
+  PRIMARY KEY (entry_id, created_at)
+) PARTITION BY RANGE (created_at);
+
+CREATE TABLE ledger_entries_default PARTITION OF ledger_entries DEFAULT;
+
+CREATE SCHEMA archive;                           -- destino das partições arquivadas
+
+-- Saldo acumulado por conta até period_end (exclusivo), levado adiante a cada arquivamento
+CREATE TABLE ledger_checkpoints (
+  account_id      UUID NOT NULL REFERENCES accounts(account_id),
+  currency        TEXT NOT NULL,
+  period_end      TIMESTAMPTZ NOT NULL,
+  balance_cents   BIGINT NOT NULL,
+  PRIMARY KEY (period_end, account_id, currency)
 );
 
+-- Partições já destacadas do razão (em ordem; a última define o checkpoint vigente)
+CREATE TABLE ledger_archive (
+  period_end      TIMESTAMPTZ PRIMARY KEY,
+  partition_name  TEXT NOT NULL,
+  archived_at     TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+
+CREATE FUNCTION ledger_ensure_partitions(meses_a_frente INT DEFAULT 3) RETURNS INT AS $$
+DECLARE
+  inicio  DATE;
+  fim     DATE;
+  nome    TEXT;
+  criadas INT := 0;
+BEGIN
+  -- vários processos do serviço chamam na subida e periodicamente
+  PERFORM pg_advisory_xact_lock(hashtext('ledger_ensure_partitions'));
+  FOR i IN 0..meses_a_frente LOOP
+    inicio := (date_trunc('month', now()) + make_interval(months => i))::date;
+    fim := (inicio + interval '1 month')::date;
+    nome := format('ledger_entries_%s', to_char(inicio, 'YYYY_MM'));
+    IF to_regclass(nome) IS NULL THEN
+      IF EXISTS (SELECT 1 FROM ledger_entries_default WHERE created_at >= inicio AND created_at < fim) THEN
+        -- o mês já recebeu lançamentos na DEFAULT: cria a partição vazia, move as linhas e anexa
+        EXECUTE format('CREATE TABLE %I (LIKE ledger_entries INCLUDING DEFAULTS INCLUDING CONSTRAINTS)', nome);
+        EXECUTE format('WITH movidas AS (DELETE FROM ledger_entries_default
+                                         WHERE created_at >= %L AND created_at < %L RETURNING *)
+                        INSERT INTO %I SELECT * FROM movidas', inicio, fim, nome);
+        EXECUTE format('ALTER TABLE ledger_entries ATTACH PARTITION %I FOR VALUES FROM (%L) TO (%L)',
+                       nome, inicio, fim);
+      ELSE
+        EXECUTE format('CREATE TABLE %I PARTITION OF ledger_entries FOR VALUES FROM (%L) TO (%L)',
+                       nome, inicio, fim);
+      END IF;
+      criadas := criadas + 1;
+    END IF;
+  END LOOP;
+  RETURN criadas;
+END
+$$ LANGUAGE plpgsql;
+
+SELECT ledger_ensure_partitions(3);
+
 -- 7. Índices e garantias
-CREATE INDEX idx_tokens_state ON tokens(state);
+-- também serve a varredura de expiração: WHERE state='ISSUED' AND exp_at < now() ORDER BY exp_at
+CREATE INDEX idx_tokens_state_exp ON tokens(state, exp_at);
+-- listagem paginada por dono: WHERE owner_hint = ? ORDER BY issued_at DESC, token_id DESC
+CREATE INDEX idx_tokens_owner_issued ON tokens(owner_hint, issued_at DESC, token_id DESC)
+  INCLUDE (denom_cents, state);
 CREATE INDEX idx_redemptions_status ON redemptions(status);
 CREATE INDEX idx_ledger_tx ON ledger_entries(tx_id);
+-- resolução de carteira no resgate: WHERE user_id=? AND kind='USER_WALLET'
+CREATE INDEX idx_accounts_user_kind ON accounts(user_id, kind);
 
--- 8. View de saldos
+-- 8. View de saldos: checkpoint vigente + partições ainda anexadas
 CREATE VIEW account_balances AS
 SELECT
   account_id,
   currency,
-  COALESCE(SUM(CASE WHEN side='CREDIT' THEN amount_cents ELSE -amount_cents END),0) AS balance_cents
-FROM ledger_entries
+  COALESCE(SUM(balance_cents),0) AS balance_cents
+FROM (
+  SELECT account_id, currency, balance_cents
+  FROM ledger_checkpoints
+  WHERE period_end = (SELECT max(period_end) FROM ledger_archive)
+  UNION ALL
+  SELECT account_id, currency, CASE WHEN side='CREDIT' THEN amount_cents ELSE -amount_cents END
+  FROM ledger_entries
+) s
 GROUP BY account_id, currency;
+
+-- 9. Saldos materializados (atualizados na mesma transação de cada lançamento;
+--    ver wallet_service/ledger.py). A view acima continua servindo para auditoria.
+--    Contas quentes (reserva de emissão) espalham o saldo por várias faixas
+--    (stripe); o saldo da conta é SUM(balance_cents). Demais contas: faixa 0.
+CREATE TABLE balances (
+  account_id      UUID NOT NULL REFERENCES accounts(account_id),
+  stripe          SMALLINT NOT NULL DEFAULT 0,
+  currency        TEXT NOT NULL,
+  balance_cents   BIGINT NOT NULL DEFAULT 0,
+  updated_at      TIMESTAMPTZ NOT NULL DEFAULT now(),
+  PRIMARY KEY (account_id, stripe)
+);
+
+-- 10. Estoque de tokens pré-assinados (ver wallet_service/token_stock.py).
+--     Cada linha já existe em `tokens` como ISSUED; aqui fica a assinatura até a
+--     entrega. claim_id NULL = disponível; claim_id preenchido = reservado para
+--     uma emissão (mesmo claim_id devolve os mesmos tokens) até ser expurgado.
+CREATE TABLE token_stock (
+  token_id        UUID PRIMARY KEY REFERENCES tokens(token_id),
+  denom_cents     BIGINT NOT NULL,
+  issued_at       TEXT NOT NULL,                 -- exatamente como no payload assinado
+  exp_at          TEXT,                          -- idem (NULL = token sem expiração)
+  issuer_pubkey   TEXT NOT NULL,                 -- base64, como no payload
+  signature       BYTEA NOT NULL,
+  payload_sha256  BYTEA NOT NULL,
+  merkle_proof    BYTEA,                         -- prova de inclusão (ISSUE_SIGNING=merkle; signature = assinatura da raiz)
+  created_at      TIMESTAMPTZ NOT NULL DEFAULT now(),
+  claim_id        UUID,
+  claim_pos       INT,                           -- ordem de entrega dentro do claim
+  claimed_at      TIMESTAMPTZ
+);
+CREATE INDEX idx_token_stock_available ON token_stock(denom_cents, created_at) WHERE claim_id IS NULL;
+CREATE INDEX idx_token_stock_claim ON token_stock(claim_id, claim_pos) WHERE claim_id IS NOT NULL;
+
+-- Pedido ({denominação: quantidade}) de cada Idempotency-Key de emissão:
+-- repetir a chave com outro pedido é recusado (422) em vez de devolver outros tokens.
+CREATE TABLE token_claims (
+  claim_id        UUID PRIMARY KEY,
+  mix             JSONB NOT NULL,
+  created_at      TIMESTAMPTZ NOT NULL DEFAULT now()
+);
@@ -15,6 +15,10 @@ VALUES
 INSERT INTO accounts (account_id, kind, currency)
 VALUES ('99999999-9999-9999-9999-999999999999', 'ISSUANCE_RESERVE', 'BRL');
 
+-- Valor de tokens expirados sem resgate (ver wallet_service/token_expiry.py)
+INSERT INTO accounts (account_id, kind, currency)
+VALUES ('88888888-8888-8888-8888-888888888888', 'EXPIRY_BREAKAGE', 'BRL');
+
 -- Carteiras dos usuários
 INSERT INTO accounts (account_id, user_id, kind, currency)
 VALUES
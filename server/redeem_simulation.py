@@ -108,13 +108,22 @@ def redeem_token(token_id, requester_user):
         cur.close()
         conn.close()
 
+# Cache simples: a conta do emissor não muda e a carteira de um usuário só é
+# criada uma vez, então não há por que consultá-las a cada resgate.
+_account_cache = {}
+
 def get_issuer_account(cur):
-    cur.execute("SELECT account_id FROM accounts WHERE kind='ISSUANCE_RESERVE' LIMIT 1;")
-    return cur.fetchone()[0]
+    if "issuer" not in _account_cache:
+        cur.execute("SELECT account_id FROM accounts WHERE kind='ISSUANCE_RESERVE' LIMIT 1;")
+        _account_cache["issuer"] = cur.fetchone()[0]
+    return _account_cache["issuer"]
 
 def get_receiver_account(cur, user_id):
-    cur.execute("SELECT account_id FROM accounts WHERE user_id=%s AND kind='USER_WALLET' LIMIT 1;", (user_id,))
-    return cur.fetchone()[0]
+    key = ("wallet", str(user_id))
+    if key not in _account_cache:
+        cur.execute("SELECT account_id FROM accounts WHERE user_id=%s AND kind='USER_WALLET' LIMIT 1;", (user_id,))
+        _account_cache[key] = cur.fetchone()[0]
+    return _account_cache[key]
 
 # -------------------------------------------------------------------
 # Simulação
@@ -34,6 +34,7 @@ print(f"Usuários criados:\n- user1: {user1}\n- user2: {user2}")
 # 2. Criar contas (carteiras + conta emissora)
 # -------------------------------------------------------------------
 issuer_account = new_uuid()
+breakage_account = new_uuid()
 wallet1 = new_uuid()
 wallet2 = new_uuid()
 
@@ -41,9 +42,10 @@ cur.execute("""
 INSERT INTO accounts (account_id, user_id, kind, currency)
 VALUES
   (%s, NULL, 'ISSUANCE_RESERVE', 'BRL'),
+  (%s, NULL, 'EXPIRY_BREAKAGE', 'BRL'),
   (%s, %s, 'USER_WALLET', 'BRL'),
   (%s, %s, 'USER_WALLET', 'BRL');
-""", (issuer_account, wallet1, user1, wallet2, user2))
+""", (issuer_account, breakage_account, wallet1, user1, wallet2, user2))
 
 print(f"Contas criadas:\n- issuer_account: {issuer_account}\n- wallet1: {wallet1}\n- wallet2: {wallet2}")
 
@@ -87,7 +89,19 @@ for tid, denom in tokens:
     ))
 
 # -------------------------------------------------------------------
-# 5. Commit final
+# 5. Saldos materializados (os lançamentos acima não passam pelo serviço)
+# -------------------------------------------------------------------
+cur.execute("""
+INSERT INTO balances (account_id, currency, balance_cents)
+SELECT account_id, currency, SUM(CASE WHEN side='CREDIT' THEN amount_cents ELSE -amount_cents END)
+FROM ledger_entries
+WHERE account_id = %s
+GROUP BY account_id, currency
+ON CONFLICT (account_id, stripe) DO UPDATE SET balance_cents = EXCLUDED.balance_cents, updated_at = now();
+""", (issuer_account,))
+
+# -------------------------------------------------------------------
+# 6. Commit final
 # -------------------------------------------------------------------
 conn.commit()
 print("✅ Dados inseridos com sucesso!")
@@ -0,0 +1,108 @@
+"""
+Repetição de /redeem/batch: a segunda chamada com o mesmo conjunto de tokens
+responde, token a token, o que a primeira respondeu.
+
+Precisa do PostgreSQL configurado em wallet_service/.env (pulado sem banco):
+    python -m pytest -q tests
+"""
+import os
+import sys
+import uuid
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "wallet_service"))
+
+import psycopg2  # noqa: E402
+
+
+@pytest.fixture(scope="module")
+def conn():
+    from db import get_pool
+    try:
+        pool = get_pool()
+        conn = pool.getconn()
+    except psycopg2.Error as e:
+        pytest.skip(f"PostgreSQL indisponível: {e}")
+    yield conn
+    pool.putconn(conn)
+
+
+def novo_usuario(conn):
+    """Usuário novo com carteira e device, para o teste não depender do seed."""
+    user_id = str(uuid.uuid4())
+    cur = conn.cursor()
+    cur.execute("INSERT INTO users (user_id, kyc_level, status) VALUES (%s, 'basic', 'active')", (user_id,))
+    cur.execute("INSERT INTO accounts (account_id, user_id, kind, currency) VALUES (%s, %s, 'USER_WALLET', 'BRL')",
+                (str(uuid.uuid4()), user_id))
+    cur.execute("INSERT INTO devices (device_id, user_id, attested_pubkey, cert_fingerprint) VALUES (%s, %s, %s, %s)",
+                (str(uuid.uuid4()), user_id, b"pubkey", uuid.uuid4().bytes))
+    conn.commit()
+    cur.close()
+    return user_id
+
+
+@pytest.fixture(scope="module")
+def user_id(conn):
+    return novo_usuario(conn)
+
+
+def item_de(token):
+    return {"token_id": token["payload"]["token_id"], "token_payload": token["payload"],
+            "token_signature_b64": token["signature_b64"], "token_merkle_proof_b64": token.get("merkle_proof_b64")}
+
+
+def resultados(corpo):
+    return [r["result"] for r in corpo["results"]]
+
+
+def test_repeticao_de_lote_misto_devolve_os_resultados_originais(conn, user_id):
+    from issue_tokens import emitir_tokens
+    from redeem_batch import resgatar_lote
+
+    gasto, novo1, novo2, outro = emitir_tokens(4, db=conn)
+    # resgatado antes por outra redenção: no lote será already_redeemed
+    corpo, status, _ = resgatar_lote(lambda: conn, user_id, [item_de(gasto)])
+    assert status == 200 and resultados(corpo) == ["applied"]
+
+    forjado = dict(item_de(outro), token_signature_b64=item_de(novo1)["token_signature_b64"])
+    lote = [item_de(novo1), item_de(gasto), forjado, item_de(novo2)]
+    primeira, status, _ = resgatar_lote(lambda: conn, user_id, lote)
+    assert status == 200
+    assert primeira["status"] == "success"
+    assert resultados(primeira) == ["applied", "already_redeemed", "invalid_signature", "applied"]
+
+    repetida, status, _ = resgatar_lote(lambda: conn, user_id, lote)
+    assert status == 200
+    assert repetida["status"] == "duplicate"
+    assert repetida["redemption_id"] == primeira["redemption_id"]
+    assert resultados(repetida) == ["duplicate", "already_redeemed", "invalid_signature", "duplicate"]
+
+
+def test_repeticao_de_lote_aplicado_passa_pelo_filtro_de_resgatados(conn, user_id):
+    from issue_tokens import emitir_tokens
+    from redeem_batch import resgatar_lote
+
+    lote = [item_de(t) for t in emitir_tokens(2, db=conn)]
+    primeira, _, _ = resgatar_lote(lambda: conn, user_id, lote)
+    assert resultados(primeira) == ["applied", "applied"]
+
+    # todos os tokens já estão no filtro de resgatados; a resposta ainda é a da redenção
+    repetida, status, _ = resgatar_lote(lambda: conn, user_id, lote)
+    assert status == 200
+    assert repetida["redemption_id"] == primeira["redemption_id"]
+    assert resultados(repetida) == ["duplicate", "duplicate"]
+
+
+def test_lote_reapresentado_por_outro_usuario_e_duplo_gasto(conn, user_id):
+    from issue_tokens import emitir_tokens
+    from redeem_batch import resgatar_lote
+
+    lote = [item_de(t) for t in emitir_tokens(2, db=conn)]
+    primeira, _, _ = resgatar_lote(lambda: conn, user_id, lote)
+    assert resultados(primeira) == ["applied", "applied"]
+
+    outro, status, _ = resgatar_lote(lambda: conn, novo_usuario(conn), lote)
+    assert status == 200
+    assert outro["status"] == "rejected" and outro["redemption_id"] is None
+    assert resultados(outro) == ["already_redeemed", "already_redeemed"]
@@ -0,0 +1,158 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import ledger
+
+# Cache de resolução de contas usado no caminho quente do resgate.
+# A conta de reserva do emissor é resolvida uma vez; carteiras de usuário ficam
+# num LRU com TTL. Só resultados encontrados são guardados (nunca "não existe").
+# Reserva e breakage, que entram em quase todo lançamento, são listradas no
+# ledger (saldo em várias linhas de `balances`).
+WALLET_CACHE_SIZE = int(os.getenv("ACCOUNT_CACHE_SIZE", "10000"))
+WALLET_CACHE_TTL = float(os.getenv("ACCOUNT_CACHE_TTL", "300"))
+
+
+class LRUCacheTTL:
+    """LRU simples com expiração por entrada, seguro para threads."""
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None or item[1] < time.monotonic():
+                if item is not None:
+                    del self._data[key]
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return item[0]
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + self.ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        with self._lock:
+            return {"size": len(self._data), "hits": self.hits, "misses": self.misses}
+
+
+_issuer_account = None
+_breakage_account = None
+_wallets = LRUCacheTTL(WALLET_CACHE_SIZE, WALLET_CACHE_TTL)
+
+SQL_ISSUER_ACCOUNT = "SELECT account_id FROM accounts WHERE kind='ISSUANCE_RESERVE' LIMIT 1;"
+SQL_BREAKAGE_ACCOUNT = "SELECT account_id FROM accounts WHERE kind='EXPIRY_BREAKAGE' LIMIT 1;"
+SQL_USER_WALLET = "SELECT account_id FROM accounts WHERE user_id=%s AND kind='USER_WALLET' LIMIT 1;"
+
+
+def get_issuer_account(cur):
+    """Conta ISSUANCE_RESERVE (resolvida uma única vez por processo)."""
+    global _issuer_account
+    if _issuer_account is None:
+        cur.execute(SQL_ISSUER_ACCOUNT)
+        row = cur.fetchone()
+        if row is None:
+            return None
+        _issuer_account = row[0]
+        ledger.listrar(_issuer_account)
+    return _issuer_account
+
+
+def get_breakage_account(cur):
+    """Conta EXPIRY_BREAKAGE, destino do valor de tokens expirados (resolvida uma única vez por processo)."""
+    global _breakage_account
+    if _breakage_account is None:
+        cur.execute(SQL_BREAKAGE_ACCOUNT)
+        row = cur.fetchone()
+        if row is None:
+            return None
+        _breakage_account = row[0]
+        ledger.listrar(_breakage_account)
+    return _breakage_account
+
+
+def get_user_wallet(cur, user_id):
+    """Conta USER_WALLET do usuário (LRU + TTL)."""
+    key = str(user_id)
+    account_id = _wallets.get(key)
+    if account_id is None:
+        cur.execute(SQL_USER_WALLET, (key,))
+        row = cur.fetchone()
+        if row is None:
+            return None
+        account_id = row[0]
+        _wallets.put(key, account_id)
+    return account_id
+
+
+# Variantes para cursores assíncronos (psycopg 3, async_app.py), mesmos caches
+async def get_issuer_account_async(cur):
+    global _issuer_account
+    if _issuer_account is None:
+        await cur.execute(SQL_ISSUER_ACCOUNT)
+        row = await cur.fetchone()
+        if row is None:
+            return None
+        _issuer_account = row[0]
+        ledger.listrar(_issuer_account)
+    return _issuer_account
+
+
+async def get_user_wallet_async(cur, user_id):
+    key = str(user_id)
+    account_id = _wallets.get(key)
+    if account_id is None:
+        await cur.execute(SQL_USER_WALLET, (key,))
+        row = await cur.fetchone()
+        if row is None:
+            return None
+        account_id = row[0]
+        _wallets.put(key, account_id)
+    return account_id
+
+
+def invalidate_user_wallet(user_id):
+    """Deve ser chamado sempre que contas do usuário forem criadas/alteradas."""
+    _wallets.pop(str(user_id))
+
+
+def invalidate_all():
+    global _issuer_account, _breakage_account
+    _issuer_account = None
+    _breakage_account = None
+    _wallets.clear()
+
+
+def warm(conn):
+    """Resolve a conta de reserva na inicialização do serviço."""
+    cur = conn.cursor()
+    try:
+        get_issuer_account(cur)
+        conn.rollback()
+    finally:
+        cur.close()
+
+
+def cache_stats():
+    return {"issuer_account_cached": _issuer_account is not None, "wallets": _wallets.stats()}
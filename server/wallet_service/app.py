@@ -1,17 +1,74 @@
-from flask import Flask, jsonify, request, current_app
-from db import get_db, close_db
+from flask import Flask, jsonify, request, current_app, after_this_request, g, Response, stream_with_context
+from db import get_db, close_db, pool_stats, pooled_connection, PoolTimeout
+import accounts
+import denominations
+import ledger
+import token_verify
+import tx
+import redeemed_filter
+import token_listing
+import token_stock
+import token_expiry
+import token_wire
+import ledger_partitions
+import metrics
+import http_gzip
+import json
+import logging
+import os
+import random
+import time
 import uuid
 from datetime import datetime
-from issue_tokens import emitir_tokens
+from issue_tokens import emitir_tokens, emitir_tokens_em_blocos
 from base64 import b64encode
 import hashlib
 from nacl.signing import SigningKey, VerifyKey
 from issue_tokens import emitir_tokens
+from redeem_batch import resgatar_lote, batch_idempotency_key, ids_do_lote, MAX_BATCH_TOKENS
+import redeem_queue
 
 
 app = Flask(__name__)
+# corpos de requisição com Content-Encoding: gzip (ver http_gzip.py)
+app.wsgi_app = http_gzip.DescomprimirWSGI(app.wsgi_app)
 app.teardown_appcontext(close_db)
 
+# INFO por padrão; corpo das requisições só com LOG_BODIES=1, e por amostragem
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO").upper())
+LOG_BODIES = os.getenv("LOG_BODIES") == "1"
+LOG_BODY_SAMPLE_RATE = float(os.getenv("LOG_BODY_SAMPLE_RATE", "0.01"))
+LOG_BODY_MAX = int(os.getenv("LOG_BODY_MAX", "1024"))
+
+# resolve a conta de reserva, carrega o filtro de tokens resgatados e garante as
+# partições do razão uma vez na subida (se o banco ainda não estiver pronto,
+# tudo segue pelo caminho normal)
+try:
+    with pooled_connection() as conn:
+        ledger_partitions.garantir(conn)
+        accounts.warm(conn)
+        redeemed_filter.warm(conn)
+except Exception as e:
+    print(f"⚠️ Não foi possível preparar partições/contas/filtro de resgatados: {e}")
+
+# verificação periódica das partições do razão (LEDGER_PARTITIONS_INTERVAL; 0 desliga)
+ledger_partitions.iniciar_manutencao_em_thread()
+
+# worker de resgate assíncrono no mesmo processo (opcional)
+if os.getenv("REDEEM_WORKER_INLINE") == "1":
+    redeem_queue.iniciar_worker_em_thread()
+
+# reabastecedor do estoque de tokens pré-assinados no mesmo processo (opcional;
+# com vários workers só um trabalha por vez, ver token_stock.rodada)
+if os.getenv("TOKEN_STOCK_REFILLER_INLINE") == "1":
+    token_stock.iniciar_reabastecedor_em_thread()
+
+# varredor de expiração (token_expiry.py) no mesmo processo (opcional)
+if os.getenv("TOKEN_EXPIRY_SWEEPER_INLINE") == "1":
+    token_expiry.iniciar_varredor_em_thread()
+
+NDJSON = "application/x-ndjson"
+
 def new_uuid(): return str(uuid.uuid4())
 
 # ===============================================================
@@ -22,26 +79,91 @@ def ping():
     return jsonify({"status": "ok", "service": "wallet-service"}), 200
 
 
+# ===============================================================
+# Estatísticas internas (pool de conexões)
+# ===============================================================
+@app.route("/stats", methods=["GET"])
+def stats():
+    return jsonify({
+        "pool": pool_stats(),
+        "accounts_cache": accounts.cache_stats(),
+        "verify": token_verify.verify_stats(),
+        "transactions": tx.tx_stats(),
+        "redeemed_filter": redeemed_filter.filter_stats(),
+        "token_stock": token_stock.stock_stats(),
+        "token_expiry": token_expiry.expiry_stats(),
+        "ledger_partitions": ledger_partitions.partition_stats(),
+    }), 200
+
+
+@app.route("/metrics", methods=["GET"])
+def metrics_endpoint():
+    return Response(metrics.exportar(), mimetype="text/plain; version=0.0.4")
+
+
+@metrics.coletor
+def _metricas_internas():
+    pool = pool_stats()
+    transacoes = tx.tx_stats()
+    verify = token_verify.verify_stats()
+    filtro = redeemed_filter.filter_stats()
+    particoes = ledger_partitions.partition_stats()
+    por_nome = transacoes["by_name"]
+    return [
+        ("db_pool_connections", "gauge", "Conexões do pool por estado.",
+         [({"state": k}, pool[k]) for k in ("in_use", "idle", "waiting")]),
+        ("db_pool_healthy", "gauge", "1 se o pool conecta ao banco, 0 se degradado.", [({}, int(pool["healthy"]))]),
+        ("db_pool_timeouts_total", "counter", "Checkouts que esgotaram DB_POOL_TIMEOUT.", [({}, pool["timeouts"])]),
+        ("db_pool_wait_seconds_total", "counter", "Espera acumulada por conexão.",
+         [({}, round(pool["wait_time_total_s"], 6))]),
+        ("tx_events_total", "counter", "Tentativas, retentativas e desistências por transação.",
+         [({"tx": nome, "event": evento}, n) for nome, c in sorted(por_nome.items()) for evento, n in sorted(c.items())]),
+        ("tx_retry_budget", "gauge", "Fichas disponíveis para retentativas.", [({}, transacoes["retry_budget"])]),
+        ("token_verify_total", "counter", "Provas verificadas por resultado.",
+         [({"result": "ok"}, verify["verified"]), ({"result": "rejected"}, verify["rejected"])]),
+        ("token_verify_cpu_seconds_total", "counter", "CPU gasta verificando provas.",
+         [({}, round(verify["cpu_s_total"], 6))]),
+        ("token_verify_merkle_roots_total", "counter", "Raízes de Merkle: do cache (hit) ou verificadas (miss).",
+         [({"cache": "hit"}, verify["merkle_roots"]["hits"]), ({"cache": "miss"}, verify["merkle_roots"]["misses"])]),
+        ("redeemed_filter_size", "gauge", "Tokens no conjunto de resgatados.", [({}, filtro["size"])]),
+        ("redeemed_filter_hits_total", "counter", "Duplo gasto rejeitado pelo conjunto.", [({}, filtro["hits"])]),
+        ("ledger_default_partition_rows", "gauge",
+         "Lançamentos na partição DEFAULT do razão (deveria ser 0; alerta se > 0).",
+         [({}, particoes["default_rows"])]),
+    ]
+
+
+@app.errorhandler(PoolTimeout)
+def pool_timeout(e):
+    return jsonify({"error": "Serviço sobrecarregado, tente novamente", "detail": str(e)}), 503
+
+
 # ===============================================================
 # 1. Listar tokens disponíveis (mock de carteira do usuário)
 # ===============================================================
 @app.route("/tokens/<user_id>", methods=["GET"])
 def list_tokens(user_id):
-    print(f"🔍 Listando tokens para user_id: {user_id}")
+    """
+    Paginação por cursor (keyset): ?limit=N&after=<cursor>&state=ISSUED
+    O cursor (opaco, base64url) da próxima página vem no header X-Next-After (ausente na última).
+    Consulta e validação em token_listing.py (compartilhadas com async_app.py).
+    """
+    try:
+        params = token_listing.parametros(user_id, request.args)
+    except ValueError:
+        return jsonify({"error": "Parâmetros inválidos (user_id, limit, state ou after)"}), 400
+
     db = get_db()
     cur = db.cursor()
     try:
-        cur.execute("""
-            SELECT token_id, denom_cents, state
-            FROM tokens
-            WHERE owner_hint IS NULL OR owner_hint = %s::uuid
-            ORDER BY issued_at DESC
-        """, (user_id,))
-        tokens = [
-            {"token_id": str(tid), "denom": denom, "state": state}
-            for tid, denom, state in cur.fetchall()
-        ]
-        return jsonify(tokens), 200
+        cur.execute(token_listing.consulta(params), params)
+        rows = cur.fetchall()
+        db.rollback()
+        tokens, proximo = token_listing.pagina(rows, params["limit"])
+        response = jsonify(tokens)
+        if proximo:
+            response.headers["X-Next-After"] = proximo
+        return response, 200
     except Exception as e:
         db.rollback()
         print("❌ Erro em list_tokens:", e)
@@ -56,17 +178,62 @@ def list_tokens(user_id):
 @app.route("/redeem", methods=["POST"])
 def redeem_token():
     data = request.get_json()
+    # token no formato binário (token_wire) em "token_b64" no lugar de token_id + prova
+    try:
+        data = token_verify.expandir_binario(data)
+    except token_verify.TokenInvalido as e:
+        return jsonify({"error": f"Token inválido: {e}"}), 422
     user_id = data.get("user_id")
     token_id = data.get("token_id")
 
     if not user_id or not token_id:
         return jsonify({"error": "Campos obrigatórios: user_id, token_id"}), 400
 
-    db = get_db()
-    cur = db.cursor()
+    # repetição certa (replay/duplo gasto): 409 sem nenhuma escrita no banco
+    if redeemed_filter.ja_resgatado(token_id):
+        return jsonify({"status": "already_redeemed", "error": "Token já resgatado (REDEEMED)"}), 409
+
+    # prova criptográfica: verificada antes de qualquer acesso ao banco
+    try:
+        digest, verify_cpu = token_verify.verificar_token(
+            token_id, data.get("token_payload"), data.get("token_signature_b64"),
+            data.get("token_merkle_proof_b64"))
+    except token_verify.TokenExpirado as e:
+        return jsonify({"status": "expired", "error": str(e)}), 410
+    except token_verify.TokenInvalido as e:
+        return jsonify({"error": f"Token inválido: {e}"}), 422
+
+    @after_this_request
+    def _server_timing(response):
+        response.headers["Server-Timing"] = token_verify.server_timing(verify_cpu)
+        return response
+
+    # gerados fora do corpo: retentativas reaproveitam a mesma chave idempotente
     redemption_id = new_uuid()
     idempotency_key = uuid.uuid5(uuid.NAMESPACE_DNS, token_id).bytes
 
+    # modo assíncrono: enfileira e responde 202 (?mode=async ou "async": true)
+    if _modo_async(data):
+        return _enfileirar_resgate(user_id, [data], idempotency_key)
+
+    db = get_db()
+
+    try:
+        body, status = tx.executar(
+            db, lambda: _resgatar_token(db, user_id, token_id, digest, redemption_id, idempotency_key),
+            nome="redeem")
+        return jsonify(body), status
+    except tx.TransacaoEsgotada as e:
+        return jsonify({"error": "Conflito de concorrência, tente novamente", "detail": str(e)}), 503, \
+            {"Retry-After": "1"}
+    except Exception as e:
+        db.rollback()
+        return jsonify({"error": str(e)}), 500
+
+
+def _resgatar_token(db, user_id, token_id, digest, redemption_id, idempotency_key):
+    """Corpo transacional do /redeem (pode ser reexecutado por tx.executar)."""
+    cur = db.cursor()
     try:
         # garante device
         cur.execute("SELECT device_id FROM devices WHERE user_id=%s LIMIT 1;", (user_id,))
@@ -90,61 +257,173 @@ def redeem_token():
         cur.execute("SELECT redemption_id, status FROM redemptions WHERE idempotency_key=%s;",
                     (idempotency_key,))
         existing = cur.fetchone()
-        if existing and existing[1] == "APPLIED":
-            db.rollback()
-            return jsonify({"status": "duplicate", "message": "Redenção já aplicada"}), 200
+        if existing and str(existing[0]) != redemption_id:
+            anterior = redeem_queue.resposta_redencao_existente(db, existing)
+            if anterior is not None:
+                return anterior
 
-        # insere item
+        # lock token (só trava se o hash do payload conferir com o emitido)
         cur.execute("""
-            INSERT INTO redemption_items (redemption_id, token_id)
-            VALUES (%s, %s)
-            ON CONFLICT DO NOTHING
-        """, (redemption_id, token_id))
-
-        # lock token
-        cur.execute("SELECT token_id, denom_cents, state FROM tokens WHERE token_id=%s FOR UPDATE;",
-                    (token_id,))
+            SELECT token_id, denom_cents,
+                   CASE WHEN state = 'ISSUED' AND exp_at <= now() THEN 'EXPIRED' ELSE state::text END
+            FROM tokens
+            WHERE token_id=%s AND (%s::bytea IS NULL OR payload_sha256=%s)
+            FOR UPDATE;
+        """, (token_id, digest, digest))
         row = cur.fetchone()
         if not row:
             db.rollback()
-            return jsonify({"error": "Token não encontrado"}), 404
+            return {"error": "Token não encontrado ou payload divergente"}, 404
+        if row[2] == "EXPIRED":
+            db.rollback()
+            return {"status": "expired", "error": "Token expirado"}, 410
         if row[2] != "ISSUED":
             db.rollback()
-            return jsonify({"error": f"Token já resgatado ({row[2]})"}), 409
+            if row[2] == "REDEEMED":
+                redeemed_filter.registrar([token_id])
+            return {"error": f"Token já resgatado ({row[2]})"}, 409
 
         denom = row[1]
 
+        # insere item (um token só pode pertencer a uma redenção, inclusive pendente)
+        cur.execute("""
+            INSERT INTO redemption_items (redemption_id, token_id)
+            VALUES (%s, %s)
+            ON CONFLICT DO NOTHING
+            RETURNING token_id
+        """, (redemption_id, token_id))
+        if cur.fetchone() is None:
+            db.rollback()
+            return {"error": "Token já está em outra redenção (pendente na fila)"}, 409
+
         # atualiza token
         cur.execute("UPDATE tokens SET state='REDEEMED', owner_hint=%s WHERE token_id=%s;",
                     (user_id, token_id))
 
-        # contas
-        cur.execute("SELECT account_id FROM accounts WHERE kind='ISSUANCE_RESERVE' LIMIT 1;")
-        issuer_account = cur.fetchone()[0]
-        cur.execute("SELECT account_id FROM accounts WHERE user_id=%s AND kind='USER_WALLET' LIMIT 1;",
-                    (user_id,))
-        receiver_account = cur.fetchone()[0]
+        # contas (resolvidas via cache em memória)
+        issuer_account = accounts.get_issuer_account(cur)
+        receiver_account = accounts.get_user_wallet(cur, user_id)
+        if issuer_account is None or receiver_account is None:
+            db.rollback()
+            return {"error": "Conta de reserva ou carteira do usuário não encontrada"}, 404
 
-        tx_id = new_uuid()
-        cur.execute("""
-            INSERT INTO ledger_entries (tx_id, account_id, side, amount_cents, currency, description)
-            VALUES
-              (%s, %s, 'DEBIT',  %s, 'BRL', 'Resgate de token via API'),
-              (%s, %s, 'CREDIT', %s, 'BRL', 'Recebimento de token via API');
-        """, (tx_id, issuer_account, denom, tx_id, receiver_account, denom))
+        ledger.lancar_partida_dobrada(cur, issuer_account, receiver_account, denom,
+                                      "Resgate de token via API", "Recebimento de token via API")
 
         cur.execute("UPDATE redemptions SET status='APPLIED' WHERE redemption_id=%s;", (redemption_id,))
         db.commit()
-        return jsonify({"status": "success", "redemption_id": redemption_id}), 200
+        metrics.TOKENS_REDEEMED.inc(mode="single")
+        redeemed_filter.registrar([token_id])
+        return {"status": "success", "redemption_id": redemption_id}, 200
+    finally:
+        cur.close()
+
 
+# ===============================================================
+# 2b. Resgate de vários tokens numa única transação
+# ===============================================================
+@app.route("/redeem/batch", methods=["POST"])
+def redeem_batch():
+    data = request.get_json()
+    user_id = data.get("user_id")
+    tokens = data.get("tokens") or []
+
+    if not user_id or not tokens:
+        return jsonify({"error": "Campos obrigatórios: user_id, tokens"}), 400
+    if len(tokens) > MAX_BATCH_TOKENS:
+        return jsonify({"error": f"Máximo de {MAX_BATCH_TOKENS} tokens por lote"}), 413
+
+    if _modo_async(data):
+        # tokens binários ("token_b64") precisam do token_id para a chave idempotente
+        tokens = token_verify.expandir_lote(tokens)
+        return _enfileirar_resgate(user_id, tokens, batch_idempotency_key(ids_do_lote(tokens)))
+
+    try:
+        body, status, verify_cpu = resgatar_lote(get_db, user_id, tokens)
+    except tx.TransacaoEsgotada as e:
+        return jsonify({"error": "Conflito de concorrência, tente novamente", "detail": str(e)}), 503, \
+            {"Retry-After": "1"}
+    except Exception as e:
+        if "db" in g:
+            g.db.rollback()
+        return jsonify({"error": str(e)}), 500
+
+    response = jsonify(body)
+    response.headers["Server-Timing"] = token_verify.server_timing(verify_cpu)
+    return response, status
+
+
+def _modo_async(data):
+    return request.args.get("mode") == "async" or data.get("async") is True
+
+
+def _enfileirar_resgate(user_id, itens, idempotency_key):
+    try:
+        body, status, verify_cpu = redeem_queue.enfileirar(get_db, user_id, itens, idempotency_key)
+    except tx.TransacaoEsgotada as e:
+        return jsonify({"error": "Conflito de concorrência, tente novamente", "detail": str(e)}), 503, \
+            {"Retry-After": "1"}
+    except Exception as e:
+        if "db" in g:
+            g.db.rollback()
+        return jsonify({"error": str(e)}), 500
+
+    response = jsonify(body)
+    response.headers["Server-Timing"] = token_verify.server_timing(verify_cpu)
+    if body.get("status_url"):
+        response.headers["Location"] = body["status_url"]
+    return response, status
+
+
+# ===============================================================
+# 2c. Status de uma redenção (útil para o modo assíncrono)
+# ===============================================================
+@app.route("/redemptions/<redemption_id>", methods=["GET"])
+def redemption_status(redemption_id):
+    try:
+        redemption_id = str(uuid.UUID(redemption_id))
+    except ValueError:
+        return jsonify({"error": "redemption_id inválido"}), 400
+
+    db = get_db()
+    cur = db.cursor()
+    try:
+        body = redeem_queue.consultar(cur, redemption_id)
+        db.rollback()
+        if body is None:
+            return jsonify({"error": "Redenção não encontrada"}), 404
+        return jsonify(body), 200
     except Exception as e:
         db.rollback()
         return jsonify({"error": str(e)}), 500
     finally:
         cur.close()
 
-import logging
-logging.basicConfig(level=logging.DEBUG)
+
+# ===============================================================
+# Saldo de uma conta (lido da tabela balances: soma das faixas da conta)
+# ===============================================================
+@app.route("/accounts/<account_id>/balance", methods=["GET"])
+def account_balance(account_id):
+    try:
+        uuid.UUID(account_id)
+    except ValueError:
+        return jsonify({"error": "account_id inválido"}), 400
+
+    db = get_db()
+    cur = db.cursor()
+    try:
+        row = ledger.saldo(cur, account_id)
+        db.rollback()
+        if row is None:
+            return jsonify({"error": "Conta não encontrada"}), 404
+        balance_cents, currency = row
+        return jsonify({"account_id": account_id, "balance_cents": balance_cents, "currency": currency}), 200
+    except Exception as e:
+        db.rollback()
+        return jsonify({"error": str(e)}), 500
+    finally:
+        cur.close()
 
 # ===============================================================
 # 3. Emitir tokens (somente servidor)
@@ -153,16 +432,43 @@ logging.basicConfig(level=logging.DEBUG)
 def issue_tokens(): # Renomeei de issue_tokens2 para o nome no traceback
     try:
         data = request.get_json(force=True)
-        qtd = int(data.get("qtd", 1))
+        # {"qtd": n} (n tokens de 100) ou {"amount_cents": v, "denoms": [...]} (troco mínimo)
+        try:
+            mix = denominations.pedido_de_emissao(data)
+        except ValueError as e:
+            return jsonify({"status": "error", "message": str(e)}), 400
+        # Idempotency-Key: repetir a requisição devolve os mesmos tokens (claim no estoque)
+        chave = request.headers.get("Idempotency-Key")
+        claim_id = token_stock.claim_id_de(chave)
+        if chave:
+            try:
+                token_stock.registrar_pedido(get_db(), claim_id, mix)
+            except token_stock.PedidoDivergente as e:
+                return jsonify({"status": "error", "message": str(e)}), 422
+
+        # modo streaming (NDJSON): ?stream=1 ou Accept: application/x-ndjson
+        if request.args.get("stream") == "1" or request.accept_mimetypes.best == NDJSON:
+            return Response(stream_with_context(_issue_tokens_ndjson(mix, claim_id)), status=201, mimetype=NDJSON)
         
         # A função emitir_tokens já retorna uma lista de dicionários
         # com 'payload', 'signature_b64', etc.
-        tokens_emitidos = emitir_tokens(qtd)
+        if claim_id:
+            tokens_emitidos = token_stock.reservar_mix(get_db(), mix, claim_id)
+        else:
+            tokens_emitidos = emitir_tokens(sum(mix.values()), mix=mix)
+
+        # formato binário compacto (token_wire): tokens concatenados, resumo nos headers
+        if request.accept_mimetypes.best == token_wire.MIME:
+            return Response(token_wire.codificar_todos(tokens_emitidos), status=201, mimetype=token_wire.MIME,
+                            headers=_cabecalhos_emissao(tokens_emitidos, mix, claim_id))
 
         # Você pode retornar essa lista diretamente!
         return jsonify({
             "status": "success",
             "qtd_emitidos": len(tokens_emitidos),
+            "amount_cents": sum(d * n for d, n in mix.items()),
+            "mix": {str(d): n for d, n in mix.items()},
+            "claim_id": claim_id,
             "tokens": tokens_emitidos # Retorna a lista completa de tokens gerados
         }), 201
 
@@ -172,16 +478,76 @@ def issue_tokens(): # Renomeei de issue_tokens2 para o nome no traceback
             "status": "error",
             "message": "Erro interno ao emitir tokens."
         }), 500
+
+
+def _cabecalhos_emissao(tokens, mix, claim_id):
+    return {
+        "X-Tokens-Count": str(len(tokens)),
+        "X-Amount-Cents": str(sum(d * n for d, n in mix.items())),
+        "X-Claim-Id": claim_id or "",
+    }
+
+
+def _issue_tokens_ndjson(mix, claim_id):
+    """
+    Uma linha JSON por token, enviada assim que o bloco dele é commitado,
+    seguida de um registro final {"summary": {...}}.
+    """
+    emitidos = 0
+    try:
+        if claim_id:
+            blocos = token_stock.reservar_em_blocos(mix, get_db(), claim_id)
+        else:
+            blocos = emitir_tokens_em_blocos(sum(mix.values()), mix=mix)
+        for bloco in blocos:
+            yield "".join(json.dumps(t, separators=(",", ":")) + "\n" for t in bloco)
+            emitidos += len(bloco)
+        resumo = {"status": "success", "qtd_emitidos": emitidos,
+                  "mix": {str(d): n for d, n in mix.items()},
+                  "claim_id": claim_id}
+    except Exception as e:
+        current_app.logger.error(f"Erro ao emitir tokens (streaming): {e}", exc_info=True)
+        resumo = {"status": "error", "qtd_emitidos": emitidos, "message": "Erro interno ao emitir tokens."}
+    yield json.dumps({"summary": resumo}) + "\n"
     
 
 # ===============================================================
-# Logging
-@app.before_request
-def log_request_info():
-    app.logger.debug(f"Request: {request.method} {request.url}")
-    app.logger.debug(f"Headers: {request.headers}")
-    app.logger.debug(f"Body: {request.get_data()}")
+# Métricas e logging por requisição
 # ===============================================================
+@app.before_request
+def iniciar_metricas():
+    g.inicio = time.perf_counter()
+    metrics.iniciar_requisicao()
+    if LOG_BODIES and random.random() < LOG_BODY_SAMPLE_RATE:
+        app.logger.info("Request: %s %s body=%r", request.method, request.path,
+                        request.get_data()[:LOG_BODY_MAX])
+
+
+@app.after_request
+def registrar_metricas(response):
+    # em respostas streaming, mede até o início do corpo (o resto é do gerador)
+    rota = request.url_rule.rule if request.url_rule is not None else "<unmatched>"
+    duracao = time.perf_counter() - g.get("inicio", time.perf_counter())
+    db_s, comandos = metrics.tempo_de_banco()
+    metrics.HTTP_REQUESTS.inc(route=rota, method=request.method, status=response.status_code)
+    metrics.HTTP_LATENCY.observe(duracao, route=rota, method=request.method)
+    metrics.HTTP_DB_TIME.observe(db_s, route=rota)
+    metrics.DB_QUERIES.inc(comandos, route=rota)
+    app.logger.debug("%s %s -> %s em %.1fms (db %.1fms)", request.method, request.path,
+                     response.status_code, duracao * 1000, db_s * 1000)
+    return response
+
+
+@app.after_request
+def comprimir_resposta(response):
+    if response.is_streamed or response.direct_passthrough:
+        return response
+    if http_gzip.deve_comprimir(request.headers.get("Accept-Encoding"), response.mimetype,
+                                response.content_length or 0, "Content-Encoding" in response.headers):
+        response.set_data(http_gzip.comprimir(response.get_data()))
+        response.headers["Content-Encoding"] = "gzip"
+        response.vary.add("Accept-Encoding")
+    return response
 
 
 if __name__ == "__main__":
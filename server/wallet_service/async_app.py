@@ -0,0 +1,506 @@
+"""
+Modo de serviço asyncio: Quart + psycopg 3 com pool assíncrono.
+
+Serve /ping, /tokens/<user_id>, /tokens/issue e /redeem (mais /stats e
+/metrics) com o MESMO contrato HTTP e a mesma semântica transacional do app.py
+(SERIALIZABLE, chave idempotente, lock do token com conferência do hash,
+retentativa de 40001/40P01 com o mesmo orçamento). Enquanto uma requisição espera o Postgres, o mesmo
+processo atende outras; o que é CPU (assinar lotes) roda numa thread.
+
+O que é independente de driver vem dos módulos de sempre (token_verify,
+token_listing, redeemed_filter, accounts, ledger, tx). O resgate com
+?mode=async e a reserva no estoque pré-assinado (token_stock) reaproveitam o
+código síncrono numa thread, com um pool psycopg2 secundário limitado a
+ASYNC_SYNC_POOL_MAX conexões (padrão 2): o processo abre no máximo
+DB_POOL_MAX + ASYNC_SYNC_POOL_MAX conexões. O tempo de banco por requisição
+(http_request_db_seconds) conta os dois pools.
+
+Desempenho: não é mais rápido que o app síncrono por si só. Com resgates
+concorrentes limitados por conflitos de serialização, mais requisições em voo
+significam mais conflitos: benchmarks/bench_async_vs_sync.py (16 workers, todos
+resgatando para a mesma carteira) mede ~0.6x os resgates/s do Flask.
+
+Execução:
+    hypercorn async_app:app --bind 0.0.0.0:5001
+"""
+import asyncio
+import json
+import os
+import time
+import uuid
+
+from dotenv import load_dotenv
+from psycopg import AsyncConnection, AsyncCursor, IsolationLevel
+from psycopg.conninfo import make_conninfo
+from psycopg_pool import AsyncConnectionPool, PoolTimeout
+from quart import Quart, Response, g, jsonify, request
+from quart.wrappers.response import DataBody
+
+import accounts
+import db
+import denominations
+import http_gzip
+import ledger
+import ledger_partitions
+import metrics
+import redeem_queue
+import redeemed_filter
+import token_listing
+import token_expiry
+import token_stock
+import token_verify
+import token_wire
+import tx
+from issue_tokens import STREAM_CHUNK, assinar_mix, gravar_tokens_async
+
+load_dotenv()
+
+POOL_MIN = int(os.getenv("DB_POOL_MIN", "1"))
+POOL_MAX = int(os.getenv("DB_POOL_MAX", "10"))
+POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "5"))
+# pool psycopg2 das partes síncronas rodadas em thread (ver docstring)
+SYNC_POOL_MAX = int(os.getenv("ASYNC_SYNC_POOL_MAX", "2"))
+db.configurar_pool(minconn=0, maxconn=SYNC_POOL_MAX)
+
+NDJSON = "application/x-ndjson"
+
+app = Quart(__name__)
+# corpos de requisição com Content-Encoding: gzip (ver http_gzip.py)
+app.asgi_app = http_gzip.DescomprimirASGI(app.asgi_app)
+_pool = None
+_manutencao = None
+
+
+def new_uuid(): return str(uuid.uuid4())
+
+
+class TimedAsyncCursor(AsyncCursor):
+    """Equivalente assíncrono do metrics.TimedCursor."""
+
+    async def execute(self, query, params=None, **kwargs):
+        inicio = time.perf_counter()
+        try:
+            return await super().execute(query, params, **kwargs)
+        finally:
+            metrics.acumular_tempo_de_banco(inicio)
+
+
+class TimedAsyncConnection(AsyncConnection):
+    """COMMIT também conta como tempo de banco (é onde SERIALIZABLE valida)."""
+
+    async def commit(self):
+        inicio = time.perf_counter()
+        try:
+            return await super().commit()
+        finally:
+            metrics.acumular_tempo_de_banco(inicio)
+
+
+async def _configurar(conn):
+    await conn.set_isolation_level(IsolationLevel.SERIALIZABLE)
+    await conn.set_autocommit(False)
+    conn.cursor_factory = TimedAsyncCursor
+
+
+@app.before_serving
+async def abrir_pool():
+    global _pool, _manutencao
+    _pool = AsyncConnectionPool(
+        make_conninfo(dbname=os.getenv("DB_NAME"), user=os.getenv("DB_USER"), password=os.getenv("DB_PASS"),
+                      host=os.getenv("DB_HOST"), port=os.getenv("DB_PORT")),
+        min_size=POOL_MIN, max_size=POOL_MAX, timeout=POOL_TIMEOUT, configure=_configurar,
+        connection_class=TimedAsyncConnection, open=False)
+    await _pool.open()
+
+    # mesmo aquecimento do app.py: partições do razão, conta de reserva e filtro
+    try:
+        async with _pool.connection() as conn:
+            await ledger_partitions.garantir_async(conn)
+            async with conn.cursor() as cur:
+                await accounts.get_issuer_account_async(cur)
+                await conn.rollback()
+            await redeemed_filter.warm_async(conn)
+    except Exception as e:
+        print(f"⚠️ Não foi possível preparar partições/contas/filtro de resgatados: {e}")
+
+    # verificação periódica das partições (LEDGER_PARTITIONS_INTERVAL; 0 desliga)
+    if ledger_partitions.INTERVALO > 0:
+        _manutencao = asyncio.create_task(_manter_particoes())
+
+
+async def _manter_particoes():
+    while True:
+        await asyncio.sleep(ledger_partitions.INTERVALO)
+        try:
+            async with _pool.connection() as conn:
+                criadas = await ledger_partitions.garantir_async(conn)
+            if criadas:
+                print(f"🗓️ {criadas} partição(ões) do razão criada(s).")
+        except Exception as e:
+            print(f"❌ Erro ao garantir partições do razão: {e}")
+
+
+@app.after_serving
+async def fechar_pool():
+    if _manutencao is not None:
+        _manutencao.cancel()
+    await _pool.close()
+
+
+@app.before_request
+async def iniciar_metricas():
+    g.inicio = time.perf_counter()
+    # asyncio.to_thread copia o contexto: o pool síncrono soma no mesmo acumulador
+    metrics.iniciar_requisicao()
+
+
+@app.after_request
+async def registrar_metricas(response):
+    rota = request.url_rule.rule if request.url_rule is not None else "<unmatched>"
+    duracao = time.perf_counter() - g.get("inicio", time.perf_counter())
+    db_s, comandos = metrics.tempo_de_banco()
+    metrics.HTTP_REQUESTS.inc(route=rota, method=request.method, status=response.status_code)
+    metrics.HTTP_LATENCY.observe(duracao, route=rota, method=request.method)
+    metrics.HTTP_DB_TIME.observe(db_s, route=rota)
+    metrics.DB_QUERIES.inc(comandos, route=rota)
+    return response
+
+
+@app.after_request
+async def comprimir_resposta(response):
+    # só corpos já materializados; streams (NDJSON) seguem sem compressão
+    if not isinstance(response.response, DataBody):
+        return response
+    if http_gzip.deve_comprimir(request.headers.get("Accept-Encoding"), response.mimetype,
+                                response.content_length or 0, "Content-Encoding" in response.headers):
+        response.set_data(http_gzip.comprimir(await response.get_data()))
+        response.headers["Content-Encoding"] = "gzip"
+        response.vary.add("Accept-Encoding")
+    return response
+
+
+@app.errorhandler(PoolTimeout)
+async def pool_timeout(e):
+    return jsonify({"error": "Serviço sobrecarregado, tente novamente", "detail": str(e)}), 503
+
+
+# ===============================================================
+# Endpoint de teste
+# ===============================================================
+@app.route("/ping", methods=["GET"])
+async def ping():
+    return jsonify({"status": "ok", "service": "wallet-service"}), 200
+
+
+@app.route("/stats", methods=["GET"])
+async def stats():
+    return jsonify({
+        "pool": _pool.get_stats(),
+        "sync_pool": db.pool_stats(),
+        "accounts_cache": accounts.cache_stats(),
+        "verify": token_verify.verify_stats(),
+        "transactions": tx.tx_stats(),
+        "redeemed_filter": redeemed_filter.filter_stats(),
+        "token_stock": token_stock.stock_stats(),
+        "token_expiry": token_expiry.expiry_stats(),
+        "ledger_partitions": ledger_partitions.partition_stats(),
+    }), 200
+
+
+@app.route("/metrics", methods=["GET"])
+async def metrics_endpoint():
+    return Response(metrics.exportar(), mimetype="text/plain; version=0.0.4")
+
+
+# ===============================================================
+# 1. Listar tokens (paginação por keyset, ver token_listing.py)
+# ===============================================================
+@app.route("/tokens/<user_id>", methods=["GET"])
+async def list_tokens(user_id):
+    try:
+        params = token_listing.parametros(user_id, request.args)
+    except ValueError:
+        return jsonify({"error": "Parâmetros inválidos (user_id, limit, state ou after)"}), 400
+
+    try:
+        async with _pool.connection() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(token_listing.consulta(params), params)
+                rows = await cur.fetchall()
+            await conn.rollback()
+    except PoolTimeout:
+        raise
+    except Exception as e:
+        print("❌ Erro em list_tokens:", e)
+        return jsonify({"error": str(e)}), 500
+
+    tokens, proximo = token_listing.pagina(rows, params["limit"])
+    response = jsonify(tokens)
+    if proximo:
+        response.headers["X-Next-After"] = proximo
+    return response, 200
+
+
+# ===============================================================
+# 2. Resgatar token
+# ===============================================================
+@app.route("/redeem", methods=["POST"])
+async def redeem_token():
+    data = await request.get_json()
+    # token no formato binário (token_wire) em "token_b64" no lugar de token_id + prova
+    try:
+        data = token_verify.expandir_binario(data)
+    except token_verify.TokenInvalido as e:
+        return jsonify({"error": f"Token inválido: {e}"}), 422
+    user_id = data.get("user_id")
+    token_id = data.get("token_id")
+
+    if not user_id or not token_id:
+        return jsonify({"error": "Campos obrigatórios: user_id, token_id"}), 400
+
+    # repetição certa (replay/duplo gasto): 409 sem nenhuma escrita no banco
+    if redeemed_filter.ja_resgatado(token_id):
+        return jsonify({"status": "already_redeemed", "error": "Token já resgatado (REDEEMED)"}), 409
+
+    # prova criptográfica: verificada antes de qualquer acesso ao banco
+    try:
+        digest, verify_cpu = token_verify.verificar_token(
+            token_id, data.get("token_payload"), data.get("token_signature_b64"),
+            data.get("token_merkle_proof_b64"))
+    except token_verify.TokenExpirado as e:
+        return jsonify({"status": "expired", "error": str(e)}), 410
+    except token_verify.TokenInvalido as e:
+        return jsonify({"error": f"Token inválido: {e}"}), 422
+    timing = {"Server-Timing": token_verify.server_timing(verify_cpu)}
+
+    # gerados fora do corpo: retentativas reaproveitam a mesma chave idempotente
+    redemption_id = new_uuid()
+    idempotency_key = uuid.uuid5(uuid.NAMESPACE_DNS, token_id).bytes
+
+    if request.args.get("mode") == "async" or data.get("async") is True:
+        return await _enfileirar_resgate(user_id, [data], idempotency_key, timing)
+
+    try:
+        async with _pool.connection() as conn:
+            body, status = await tx.executar_async(
+                conn, lambda: _resgatar_token(conn, user_id, token_id, digest, redemption_id, idempotency_key),
+                nome="redeem")
+        return jsonify(body), status, timing
+    except tx.TransacaoEsgotada as e:
+        return jsonify({"error": "Conflito de concorrência, tente novamente", "detail": str(e)}), 503, \
+            {"Retry-After": "1", **timing}
+    except PoolTimeout:
+        raise
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500, timing
+
+
+async def _resgatar_token(conn, user_id, token_id, digest, redemption_id, idempotency_key):
+    """Corpo transacional do /redeem; espelha app._resgatar_token."""
+    async with conn.cursor() as cur:
+        # garante device
+        await cur.execute("SELECT device_id FROM devices WHERE user_id=%s LIMIT 1;", (user_id,))
+        row = await cur.fetchone()
+        if row:
+            requester_device = row[0]
+        else:
+            requester_device = new_uuid()
+            await cur.execute("""
+                INSERT INTO devices (device_id, user_id, attested_pubkey, cert_fingerprint)
+                VALUES (%s, %s, %s, %s)
+            """, (requester_device, user_id, b"pubkey", b"fingerprint"))
+
+        # cria redenção (idempotente)
+        await cur.execute("""
+            INSERT INTO redemptions (redemption_id, requester_user, requester_device, idempotency_key)
+            VALUES (%s, %s, %s, %s)
+            ON CONFLICT (idempotency_key) DO NOTHING
+        """, (redemption_id, user_id, requester_device, idempotency_key))
+
+        await cur.execute("SELECT redemption_id, status FROM redemptions WHERE idempotency_key=%s;",
+                          (idempotency_key,))
+        existing = await cur.fetchone()
+        if existing and str(existing[0]) != redemption_id:
+            anterior = redeem_queue.corpo_redencao_existente(existing)
+            if anterior is not None:
+                await conn.rollback()
+                return anterior
+
+        # lock token (só trava se o hash do payload conferir com o emitido)
+        await cur.execute("""
+            SELECT token_id, denom_cents,
+                   CASE WHEN state = 'ISSUED' AND exp_at <= now() THEN 'EXPIRED' ELSE state::text END
+            FROM tokens
+            WHERE token_id=%s AND (%s::bytea IS NULL OR payload_sha256=%s)
+            FOR UPDATE;
+        """, (token_id, digest, digest))
+        row = await cur.fetchone()
+        if not row:
+            await conn.rollback()
+            return {"error": "Token não encontrado ou payload divergente"}, 404
+        if row[2] == "EXPIRED":
+            await conn.rollback()
+            return {"status": "expired", "error": "Token expirado"}, 410
+        if row[2] != "ISSUED":
+            await conn.rollback()
+            if row[2] == "REDEEMED":
+                redeemed_filter.registrar([token_id])
+            return {"error": f"Token já resgatado ({row[2]})"}, 409
+
+        denom = row[1]
+
+        # insere item (um token só pode pertencer a uma redenção, inclusive pendente)
+        await cur.execute("""
+            INSERT INTO redemption_items (redemption_id, token_id)
+            VALUES (%s, %s)
+            ON CONFLICT DO NOTHING
+            RETURNING token_id
+        """, (redemption_id, token_id))
+        if await cur.fetchone() is None:
+            await conn.rollback()
+            return {"error": "Token já está em outra redenção (pendente na fila)"}, 409
+
+        await cur.execute("UPDATE tokens SET state='REDEEMED', owner_hint=%s WHERE token_id=%s;",
+                          (user_id, token_id))
+
+        issuer_account = await accounts.get_issuer_account_async(cur)
+        receiver_account = await accounts.get_user_wallet_async(cur, user_id)
+        if issuer_account is None or receiver_account is None:
+            await conn.rollback()
+            return {"error": "Conta de reserva ou carteira do usuário não encontrada"}, 404
+
+        await ledger.lancar_partida_dobrada_async(cur, issuer_account, receiver_account, denom,
+                                                  "Resgate de token via API", "Recebimento de token via API")
+
+        await cur.execute("UPDATE redemptions SET status='APPLIED' WHERE redemption_id=%s;", (redemption_id,))
+        await conn.commit()
+    metrics.TOKENS_REDEEMED.inc(mode="single")
+    redeemed_filter.registrar([token_id])
+    return {"status": "success", "redemption_id": redemption_id}, 200
+
+
+async def _enfileirar_resgate(user_id, itens, idempotency_key, timing):
+    """Modo fila: mesmo código do app.py (redeem_queue), numa thread com conexão psycopg2."""
+    from db import pooled_connection
+
+    def enfileirar():
+        with pooled_connection() as conn:
+            return redeem_queue.enfileirar(lambda: conn, user_id, itens, idempotency_key)
+
+    try:
+        body, status, _ = await asyncio.to_thread(enfileirar)
+    except tx.TransacaoEsgotada as e:
+        return jsonify({"error": "Conflito de concorrência, tente novamente", "detail": str(e)}), 503, \
+            {"Retry-After": "1", **timing}
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500, timing
+
+    headers = dict(timing)
+    if body.get("status_url"):
+        headers["Location"] = body["status_url"]
+    return jsonify(body), status, headers
+
+
+# ===============================================================
+# 3. Emitir tokens (somente servidor)
+# ===============================================================
+@app.route("/tokens/issue", methods=["POST"])
+async def issue_tokens():
+    try:
+        data = await request.get_json(force=True)
+        try:
+            mix = denominations.pedido_de_emissao(data)
+        except ValueError as e:
+            return jsonify({"status": "error", "message": str(e)}), 400
+        chave = request.headers.get("Idempotency-Key")
+        claim_id = token_stock.claim_id_de(chave)
+        if chave:
+            try:
+                await asyncio.to_thread(_registrar_pedido, mix, claim_id)
+            except token_stock.PedidoDivergente as e:
+                return jsonify({"status": "error", "message": str(e)}), 422
+
+        # modo streaming (NDJSON): ?stream=1 ou Accept: application/x-ndjson
+        if request.args.get("stream") == "1" or request.accept_mimetypes.best == NDJSON:
+            return Response(_issue_tokens_ndjson(mix, claim_id), status=201, mimetype=NDJSON)
+
+        if claim_id:
+            emitidos = await asyncio.to_thread(_reservar, mix, claim_id)
+        else:
+            # assinatura é CPU: fora do event loop; gravação tudo-ou-nada numa transação
+            linhas, emitidos = await asyncio.to_thread(assinar_mix, mix)
+            async with _pool.connection() as conn:
+                async with conn.cursor() as cur:
+                    await gravar_tokens_async(cur, linhas)
+                await conn.commit()
+            metrics.TOKENS_ISSUED.inc(len(emitidos))
+
+        if request.accept_mimetypes.best == token_wire.MIME:
+            return Response(token_wire.codificar_todos(emitidos), status=201, mimetype=token_wire.MIME,
+                            headers={
+                                "X-Tokens-Count": str(len(emitidos)),
+                                "X-Amount-Cents": str(sum(d * n for d, n in mix.items())),
+                                "X-Claim-Id": claim_id or "",
+                            })
+
+        return jsonify({
+            "status": "success",
+            "qtd_emitidos": len(emitidos),
+            "amount_cents": sum(d * n for d, n in mix.items()),
+            "mix": {str(d): n for d, n in mix.items()},
+            "claim_id": claim_id,
+            "tokens": emitidos,
+        }), 201
+
+    except Exception as e:
+        app.logger.error(f"Erro ao emitir tokens: {e}", exc_info=True)
+        return jsonify({
+            "status": "error",
+            "message": "Erro interno ao emitir tokens."
+        }), 500
+
+
+def _reservar(mix, claim_id, inicio=0):
+    from db import pooled_connection
+
+    with pooled_connection() as conn:
+        return token_stock.reservar_mix(conn, mix, claim_id, inicio)
+
+
+def _registrar_pedido(mix, claim_id):
+    from db import pooled_connection
+
+    with pooled_connection() as conn:
+        token_stock.registrar_pedido(conn, claim_id, mix)
+
+
+async def _issue_tokens_ndjson(mix, claim_id):
+    """Mesmo formato do app.py: uma linha por token, por bloco commitado, e o resumo."""
+    emitidos = 0
+    qtd = sum(mix.values())
+    try:
+        if claim_id:
+            while emitidos < qtd:
+                fim = min(emitidos + STREAM_CHUNK, qtd)
+                parcial = denominations.prefixo(mix, fim)
+                bloco = await asyncio.to_thread(_reservar, parcial, claim_id, emitidos)
+                emitidos = fim
+                yield "".join(json.dumps(t, separators=(",", ":")) + "\n" for t in bloco)
+        else:
+            async with _pool.connection() as conn:
+                while emitidos < qtd:
+                    n = min(STREAM_CHUNK, qtd - emitidos)
+                    linhas, bloco = await asyncio.to_thread(assinar_mix, denominations.fatia(mix, emitidos, emitidos + n))
+                    async with conn.cursor() as cur:
+                        await gravar_tokens_async(cur, linhas)
+                    await conn.commit()
+                    metrics.TOKENS_ISSUED.inc(n)
+                    emitidos += n
+                    yield "".join(json.dumps(t, separators=(",", ":")) + "\n" for t in bloco)
+        resumo = {"status": "success", "qtd_emitidos": emitidos,
+                  "mix": {str(d): n for d, n in mix.items()},
+                  "claim_id": claim_id}
+    except Exception as e:
+        app.logger.error(f"Erro ao emitir tokens (streaming): {e}", exc_info=True)
+        resumo = {"status": "error", "qtd_emitidos": emitidos, "message": "Erro interno ao emitir tokens."}
+    yield json.dumps({"summary": resumo}) + "\n"
@@ -1,23 +1,236 @@
 import psycopg2
+import psycopg2.extensions
 import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
 from flask import g
 from dotenv import load_dotenv
 
+from metrics import TimedConnection, TimedCursor
+
 load_dotenv()
 
+# Tamanho do pool e política de checkout (configuráveis via .env)
+POOL_MIN = int(os.getenv("DB_POOL_MIN", "1"))
+POOL_MAX = int(os.getenv("DB_POOL_MAX", "10"))
+POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "5"))
+# Conexões ociosas há mais que isso passam por um SELECT 1 antes de serem entregues
+POOL_CHECK_IDLE = float(os.getenv("DB_POOL_CHECK_IDLE", "30"))
+
+
+class PoolTimeout(Exception):
+    """Nenhuma conexão livre dentro de DB_POOL_TIMEOUT segundos."""
+
+
+def _connect():
+    conn = psycopg2.connect(
+        dbname=os.getenv("DB_NAME"),
+        user=os.getenv("DB_USER"),
+        password=os.getenv("DB_PASS"),
+        host=os.getenv("DB_HOST"),
+        port=os.getenv("DB_PORT"),
+        # tempo de cada comando/COMMIT vai para as métricas da requisição
+        connection_factory=TimedConnection,
+        cursor_factory=TimedCursor,
+    )
+    conn.set_session(isolation_level='SERIALIZABLE', autocommit=False)
+    return conn
+
+
+class ConnectionPool:
+    """
+    Pool de conexões por processo, seguro para threads.
+    - no máximo `maxconn` conexões abertas; quem passa disso espera até `timeout`
+    - health check no checkout para conexões fechadas ou ociosas há muito tempo
+    - no retorno, transações abertas/abortadas são desfeitas antes de reaproveitar
+    """
+
+    def __init__(self, minconn=POOL_MIN, maxconn=POOL_MAX, timeout=POOL_TIMEOUT,
+                 check_idle=POOL_CHECK_IDLE, connect=_connect):
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.check_idle = check_idle
+        self._connect = connect
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(maxconn)
+        self._idle = deque()  # (conn, devolvida_em)
+        self._in_use = 0
+        self._waiting = 0
+        self._stats = {
+            "checkouts": 0,
+            "created": 0,
+            "discarded": 0,
+            "timeouts": 0,
+            "health_check_failures": 0,
+            "wait_time_total_s": 0.0,
+            "wait_time_max_s": 0.0,
+        }
+        for _ in range(minconn):
+            self._idle.append((self._new_conn(), time.monotonic()))
+
+    def _new_conn(self):
+        conn = self._connect()
+        with self._lock:
+            self._stats["created"] += 1
+        return conn
+
+    def _healthy(self, conn, idle_since):
+        if conn.closed:
+            return False
+        if time.monotonic() - idle_since < self.check_idle:
+            return True
+        try:
+            cur = conn.cursor()
+            cur.execute("SELECT 1")
+            cur.close()
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def getconn(self):
+        inicio = time.monotonic()
+        with self._lock:
+            self._waiting += 1
+        adquirido = self._slots.acquire(timeout=self.timeout)
+        espera = time.monotonic() - inicio
+        with self._lock:
+            self._waiting -= 1
+            self._stats["wait_time_total_s"] += espera
+            self._stats["wait_time_max_s"] = max(self._stats["wait_time_max_s"], espera)
+            if not adquirido:
+                self._stats["timeouts"] += 1
+        if not adquirido:
+            raise PoolTimeout(f"Sem conexão livre após {self.timeout}s")
+
+        try:
+            conn = None
+            while conn is None:
+                with self._lock:
+                    item = self._idle.pop() if self._idle else None
+                if item is None:
+                    conn = self._new_conn()
+                elif self._healthy(*item):
+                    conn = item[0]
+                else:
+                    self._discard(item[0], health_check=True)
+        except Exception:
+            self._slots.release()
+            raise
+
+        with self._lock:
+            self._in_use += 1
+            self._stats["checkouts"] += 1
+        return conn
+
+    def putconn(self, conn, close=False):
+        try:
+            if not close and not conn.closed:
+                status = conn.get_transaction_status()
+                if status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                    try:
+                        conn.rollback()
+                    except psycopg2.Error:
+                        close = True
+            if close or conn.closed:
+                self._discard(conn)
+            else:
+                with self._lock:
+                    self._idle.append((conn, time.monotonic()))
+        finally:
+            with self._lock:
+                self._in_use -= 1
+            self._slots.release()
+
+    def _discard(self, conn, health_check=False):
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+        with self._lock:
+            self._stats["discarded"] += 1
+            if health_check:
+                self._stats["health_check_failures"] += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "max": self.maxconn,
+                "in_use": self._in_use,
+                "idle": len(self._idle),
+                "waiting": self._waiting,
+                **self._stats,
+            }
+
+    def closeall(self):
+        with self._lock:
+            while self._idle:
+                self._idle.pop()[0].close()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+_pool_kwargs = {}
+
+def configurar_pool(**kwargs):
+    """Parâmetros do pool (minconn, maxconn, timeout...) antes do primeiro uso."""
+    with _pool_lock:
+        if _pool is not None:
+            raise RuntimeError("Pool já criado")
+        _pool_kwargs.update(kwargs)
+
+def get_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool(**_pool_kwargs)
+    return _pool
+
+def pool_stats():
+    """
+    Estado do pool para /stats e /metrics. Se o pool não puder ser criado (banco
+    fora do ar na primeira conexão), devolve um estado degradado explícito com as
+    mesmas chaves zeradas em vez de derrubar o endpoint de observabilidade.
+    """
+    try:
+        return {"healthy": True, **get_pool().stats()}
+    except psycopg2.Error as e:
+        maxconn = _pool_kwargs.get("maxconn", POOL_MAX)
+        return {
+            "healthy": False,
+            "error": str(e).strip() or type(e).__name__,
+            "max": maxconn,
+            "in_use": 0,
+            "idle": 0,
+            "waiting": 0,
+            "checkouts": 0,
+            "created": 0,
+            "discarded": 0,
+            "timeouts": 0,
+            "health_check_failures": 0,
+            "wait_time_total_s": 0.0,
+            "wait_time_max_s": 0.0,
+        }
+
+@contextmanager
+def pooled_connection():
+    """Conexão do pool para uso fora de uma requisição Flask (scripts, workers)."""
+    pool = get_pool()
+    conn = pool.getconn()
+    try:
+        yield conn
+    finally:
+        pool.putconn(conn)
+
 def get_db():
     if "db" not in g:
-        g.db = psycopg2.connect(
-            dbname=os.getenv("DB_NAME"),
-            user=os.getenv("DB_USER"),
-            password=os.getenv("DB_PASS"),
-            host=os.getenv("DB_HOST"),
-            port=os.getenv("DB_PORT")
-        )
-        g.db.set_session(isolation_level='SERIALIZABLE', autocommit=False)
+        g.db = get_pool().getconn()
     return g.db
 
 def close_db(e=None):
     db = g.pop("db", None)
     if db is not None:
-        db.close()
+        get_pool().putconn(db)
@@ -0,0 +1,155 @@
+"""
+Denominações emitíveis e troco ótimo para /tokens/issue.
+
+Dado um valor e um conjunto de denominações, escolhe a combinação com o MENOR
+número de tokens (menos assinaturas, linhas e bytes na carteira), respeitando
+limites por denominação (ISSUE_DENOM_CAPS).
+
+- Tudo é reduzido pelo MDC das denominações (100/500/1000 viram 1/5/10).
+- Sistemas canônicos sem limite ativo: guloso, que é ótimo e O(#denominações).
+- Caso contrário: programação dinâmica 0/1 com os limites quebrados em
+  potências de 2, O(valor/MDC * Σ log(limite)); o valor máximo é limitado por
+  ISSUE_MAX_AMOUNT_CENTS.
+"""
+import os
+from functools import lru_cache, reduce
+from math import gcd
+
+DEFAULT_DENOM = 100
+DENOMS = sorted({int(d) for d in os.getenv("ISSUE_DENOMS", "100,500,1000,5000,10000").split(",") if d.strip()},
+                reverse=True)
+# Máximo de tokens de cada denominação por emissão, ex.: "100:50,500:100" (ausente = sem limite)
+CAPS = {int(d): int(n) for d, n in (p.split(":") for p in os.getenv("ISSUE_DENOM_CAPS", "").split(",") if p.strip())}
+MAX_AMOUNT = int(os.getenv("ISSUE_MAX_AMOUNT_CENTS", "1000000"))
+
+
+class SemTroco(ValueError):
+    """Não há combinação das denominações (dentro dos limites) que forme o valor."""
+
+
+def _guloso(valor, denoms):
+    mix = {}
+    for d in denoms:
+        if valor >= d:
+            mix[d], valor = divmod(valor, d)
+    return mix if valor == 0 else None
+
+
+@lru_cache(maxsize=32)
+def canonico(denoms):
+    """
+    True se o guloso é ótimo para qualquer valor (denoms já reduzidas, decrescentes).
+    Basta checar valores menores que a soma das duas maiores (Kozen & Zaks).
+    """
+    if len(denoms) < 3:
+        return True
+    limite = denoms[0] + denoms[1]
+    minimo = [0] + [None] * limite
+    for v in range(1, limite + 1):
+        candidatos = [minimo[v - d] for d in denoms if d <= v and minimo[v - d] is not None]
+        minimo[v] = min(candidatos) + 1 if candidatos else None
+        guloso = _guloso(v, denoms)
+        if minimo[v] is not None and (guloso is None or sum(guloso.values()) > minimo[v]):
+            return False
+    return True
+
+
+def _programacao_dinamica(valor, denoms, limites):
+    itens = []  # (denominação, quantidade) após quebrar cada limite em potências de 2
+    for d in denoms:
+        restante = min(limites.get(d, valor // d), valor // d)
+        k = 1
+        while restante > 0:
+            n = min(k, restante)
+            itens.append((d, n))
+            restante -= n
+            k *= 2
+
+    infinito = valor + 1
+    melhor = [0] + [infinito] * valor
+    usou = []
+    for d, n in itens:
+        peso = d * n
+        marcado = bytearray(valor + 1)
+        for v in range(valor, peso - 1, -1):
+            candidato = melhor[v - peso] + n
+            if candidato < melhor[v]:
+                melhor[v] = candidato
+                marcado[v] = 1
+        usou.append(marcado)
+    if melhor[valor] >= infinito:
+        return None
+
+    mix = {}
+    v = valor
+    for (d, n), marcado in zip(reversed(itens), reversed(usou)):
+        if marcado[v]:
+            mix[d] = mix.get(d, 0) + n
+            v -= d * n
+    return mix
+
+
+def troco_minimo(valor_cents, denoms=None, caps=None):
+    """Retorna {denominação: quantidade} (decrescente) com o menor total de tokens."""
+    denoms = sorted(set(denoms or DENOMS), reverse=True)
+    caps = CAPS if caps is None else caps
+    mdc = reduce(gcd, denoms)
+    if valor_cents <= 0 or valor_cents % mdc:
+        raise SemTroco(f"Valor {valor_cents} não é múltiplo de {mdc} centavos")
+
+    reduzidas = tuple(d // mdc for d in denoms)
+    valor = valor_cents // mdc
+    limites = {d // mdc: caps[d] for d in denoms if d in caps}
+
+    mix = None
+    if canonico(reduzidas):
+        mix = _guloso(valor, reduzidas)
+        if mix is not None and any(n > limites.get(d, n) for d, n in mix.items()):
+            mix = None
+    if mix is None:
+        mix = _programacao_dinamica(valor, reduzidas, limites)
+    if mix is None:
+        raise SemTroco(f"Não há combinação de {list(denoms)} para {valor_cents} centavos dentro dos limites")
+    return {d * mdc: mix[d] for d in sorted(mix, reverse=True) if mix[d]}
+
+
+def pedido_de_emissao(data):
+    """
+    Interpreta o corpo de /tokens/issue:
+      {"amount_cents": 50000, "denoms": [100, 500, 1000]}  -> troco mínimo
+      {"qtd": 5}                                            -> 5 tokens de DEFAULT_DENOM
+    Retorna {denominação: quantidade}; lança ValueError com a mensagem para o cliente.
+    """
+    if data.get("amount_cents") is not None:
+        valor = int(data["amount_cents"])
+        if not 0 < valor <= MAX_AMOUNT:
+            raise ValueError(f"amount_cents deve estar entre 1 e {MAX_AMOUNT}")
+        denoms = [int(d) for d in data.get("denoms") or DENOMS]
+        fora = sorted(set(denoms) - set(DENOMS))
+        if fora:
+            raise ValueError(f"Denominações não emitidas: {fora} (aceitas: {DENOMS})")
+        return troco_minimo(valor, denoms)
+
+    qtd = int(data.get("qtd", 1))
+    if qtd < 1:
+        raise ValueError("qtd deve ser pelo menos 1")
+    if qtd > CAPS.get(DEFAULT_DENOM, qtd):
+        raise ValueError(f"Máximo de {CAPS[DEFAULT_DENOM]} tokens de {DEFAULT_DENOM} por emissão")
+    return {DEFAULT_DENOM: qtd}
+
+
+def prefixo(mix, k):
+    """Os primeiros k tokens do mix, na ordem de entrega (maiores denominações primeiro)."""
+    parcial = {}
+    for d, n in mix.items():
+        if k <= 0:
+            break
+        parcial[d] = min(n, k)
+        k -= parcial[d]
+    return parcial
+
+
+def fatia(mix, inicio, fim):
+    """Os tokens de `inicio` a `fim` do mix (ordem de entrega), como {denominação: quantidade}."""
+    antes = prefixo(mix, inicio)
+    return {d: n - antes.get(d, 0) for d, n in prefixo(mix, fim).items() if n > antes.get(d, 0)}
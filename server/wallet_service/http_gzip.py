@@ -0,0 +1,166 @@
+"""
+gzip no HTTP do wallet_service (par do transporte da carteira, simular/transport.py).
+
+- Requisições com Content-Encoding: gzip são descomprimidas antes de chegar ao
+  Flask (middleware WSGI) ou ao Quart (middleware ASGI). O corpo comprimido é
+  lido e descomprimido em blocos, e tanto ele (Content-Length, antes de ler)
+  quanto o resultado são limitados a GZIP_MAX_REQUEST_BYTES (413) contra
+  "gzip bombs" e corpos enormes.
+- Respostas JSON a partir de GZIP_MIN_BYTES saem comprimidas quando o cliente
+  envia Accept-Encoding: gzip. Respostas em streaming (NDJSON) e o formato
+  binário de tokens (incompressível) saem como estão.
+"""
+import gzip
+import io
+import os
+import zlib
+
+GZIP_MIN_BYTES = int(os.getenv("GZIP_MIN_BYTES", "1024"))
+GZIP_LEVEL = int(os.getenv("GZIP_LEVEL", "6"))
+GZIP_MAX_REQUEST_BYTES = int(os.getenv("GZIP_MAX_REQUEST_BYTES", str(16 * 1024 * 1024)))
+MIMETYPES = ("application/json",)
+# Bloco de leitura do corpo comprimido
+BLOCO_LEITURA = 64 * 1024
+
+_ERRO = b'{"error": "Corpo gzip inv\\u00e1lido"}'
+_ERRO_GRANDE = b'{"error": "Corpo gzip grande demais"}'
+
+
+class CorpoGrandeDemais(ValueError):
+    """Corpo comprimido ou descomprimido acima de GZIP_MAX_REQUEST_BYTES."""
+
+
+class Descompressor:
+    """Descompressão gzip incremental: alimentar() bloco a bloco, concluir() no fim."""
+
+    def __init__(self, limite=GZIP_MAX_REQUEST_BYTES):
+        self.limite = limite
+        self.recebidos = 0
+        self._d = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        self._saida = bytearray()
+
+    def alimentar(self, dados: bytes):
+        self.recebidos += len(dados)
+        if self.recebidos > self.limite:
+            raise CorpoGrandeDemais("corpo comprimido grande demais")
+        try:
+            self._saida += self._d.decompress(dados, self.limite + 1 - len(self._saida))
+        except zlib.error as e:
+            raise ValueError(str(e))
+        if len(self._saida) > self.limite or self._d.unconsumed_tail:
+            raise CorpoGrandeDemais("corpo descomprimido grande demais")
+
+    def concluir(self) -> bytes:
+        if not self._d.eof:
+            raise ValueError("gzip truncado")
+        return bytes(self._saida)
+
+
+def descomprimir(dados: bytes) -> bytes:
+    """Descomprime um corpo gzip; ValueError se inválido, CorpoGrandeDemais acima de GZIP_MAX_REQUEST_BYTES."""
+    d = Descompressor()
+    d.alimentar(dados)
+    return d.concluir()
+
+
+def _recusa(erro):
+    """(status, corpo) da resposta a um corpo gzip recusado."""
+    if isinstance(erro, CorpoGrandeDemais):
+        return 413, _ERRO_GRANDE
+    return 400, _ERRO
+
+
+def aceita_gzip(accept_encoding: str) -> bool:
+    for parte in (accept_encoding or "").split(","):
+        nome, _, q = parte.strip().partition(";")
+        if nome.strip().lower() in ("gzip", "*"):
+            return q.replace(" ", "") not in ("q=0", "q=0.0")
+    return False
+
+
+def deve_comprimir(accept_encoding, mimetype, tamanho, ja_codificado) -> bool:
+    return (not ja_codificado and mimetype in MIMETYPES and tamanho >= GZIP_MIN_BYTES
+            and aceita_gzip(accept_encoding))
+
+
+def comprimir(dados: bytes) -> bytes:
+    return gzip.compress(dados, compresslevel=GZIP_LEVEL)
+
+
+class DescomprimirWSGI:
+    """Middleware WSGI: app.wsgi_app = DescomprimirWSGI(app.wsgi_app)."""
+
+    def __init__(self, app):
+        self.app = app
+
+    def __call__(self, environ, start_response):
+        if environ.get("HTTP_CONTENT_ENCODING", "").lower() == "gzip":
+            try:
+                corpo = self._ler(environ)
+            except ValueError as e:
+                status, erro = _recusa(e)
+                start_response("413 Request Entity Too Large" if status == 413 else "400 Bad Request",
+                               [("Content-Type", "application/json")])
+                return [erro]
+            environ["wsgi.input"] = io.BytesIO(corpo)
+            environ["CONTENT_LENGTH"] = str(len(corpo))
+            del environ["HTTP_CONTENT_ENCODING"]
+        return self.app(environ, start_response)
+
+    @staticmethod
+    def _ler(environ):
+        restantes = int(environ.get("CONTENT_LENGTH") or 0)
+        if restantes > GZIP_MAX_REQUEST_BYTES:
+            # recusado antes de ler o corpo
+            raise CorpoGrandeDemais("corpo comprimido grande demais")
+        d = Descompressor()
+        while restantes > 0:
+            bloco = environ["wsgi.input"].read(min(BLOCO_LEITURA, restantes))
+            if not bloco:
+                break
+            restantes -= len(bloco)
+            d.alimentar(bloco)
+        return d.concluir()
+
+
+class DescomprimirASGI:
+    """Middleware ASGI: app.asgi_app = DescomprimirASGI(app.asgi_app)."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        cabecalhos = dict(scope["headers"]) if scope["type"] == "http" else {}
+        if cabecalhos.get(b"content-encoding", b"").lower() != b"gzip":
+            return await self.app(scope, receive, send)
+
+        try:
+            if int(cabecalhos.get(b"content-length") or 0) > GZIP_MAX_REQUEST_BYTES:
+                # recusado antes de ler o corpo
+                raise CorpoGrandeDemais("corpo comprimido grande demais")
+            d = Descompressor()
+            while True:
+                mensagem = await receive()
+                d.alimentar(mensagem.get("body", b""))
+                if not mensagem.get("more_body"):
+                    break
+            corpo = d.concluir()
+        except ValueError as e:
+            status, erro = _recusa(e)
+            await send({"type": "http.response.start", "status": status,
+                        "headers": [(b"content-type", b"application/json")]})
+            await send({"type": "http.response.body", "body": erro})
+            return
+
+        headers = [(k, v) for k, v in scope["headers"] if k not in (b"content-encoding", b"content-length")]
+        headers.append((b"content-length", str(len(corpo)).encode()))
+        entregue = False
+
+        async def receber():
+            nonlocal entregue
+            if not entregue:
+                entregue = True
+                return {"type": "http.request", "body": corpo, "more_body": False}
+            return await receive()
+
+        return await self.app(dict(scope, headers=headers), receber, send)
@@ -1,13 +1,18 @@
 import hashlib
 import uuid
-from datetime import datetime
+from datetime import datetime, timedelta
 import os
 from dotenv import load_dotenv
 from nacl.signing import SigningKey
 from nacl.encoding import Base64Encoder
 from db import get_db
+import merkle
+import metrics
+from denominations import fatia
 import psycopg2
+from psycopg2.extras import execute_values
 import base64
+import io
 
 load_dotenv()
 
@@ -15,9 +20,11 @@ SERVER_SK_B64 = os.getenv("SERVER_SK_B64")
 SERVER_PK_B64 = os.getenv("SERVER_PK_B64")
 
 def canonical_bytes(payload: dict) -> bytes:
-    """Serialização canônica estável e determinística"""
+    """Serialização canônica estável e determinística (exp_at só entra quando presente)"""
+    exp_at = f'"exp_at":"{payload["exp_at"]}",' if payload.get("exp_at") else ""
     s = (
         f'{{"denom_cents":{payload["denom_cents"]},'
+        f'{exp_at}'
         f'"issued_at":"{payload["issued_at"]}",'
         f'"issuer_pubkey":"{payload["issuer_pubkey"]}",'
         f'"token_id":"{payload["token_id"]}"}}'
@@ -32,44 +39,133 @@ def sign_payload(payload_bytes: bytes, sk_b64: str) -> str:
     sig = sk.sign(payload_bytes).signature
     return Base64Encoder.encode(sig).decode()
 
-def emitir_tokens(qtd: int):
-    db = get_db()
-    cur = db.cursor()
-    emitidos = []
-    
-    # Decodifica a chave pública de Base64 para bytes UMA VEZ fora do loop
+# Acima deste tamanho o lote é gravado via COPY em vez de INSERT multi-linha
+COPY_THRESHOLD = int(os.getenv("ISSUE_COPY_THRESHOLD", "5000"))
+INSERT_PAGE_SIZE = 1000
+# Tamanho do bloco assinado+commitado por vez no modo streaming
+STREAM_CHUNK = int(os.getenv("ISSUE_STREAM_CHUNK", "1000"))
+
+# "token": uma assinatura Ed25519 por token; "merkle": uma por árvore de até
+# ISSUE_MERKLE_LEAVES tokens, com prova de inclusão em cada token (merkle.py).
+# A prova custa 8 + 32·log2(folhas) bytes por token: o token binário vai de ~102 B
+# para ~238 B com 16 folhas e ~302 B com 64 — por isso o teto MERKLE_LEAVES_MAX.
+ISSUE_SIGNING = os.getenv("ISSUE_SIGNING", "token")
+MERKLE_LEAVES_MAX = 64
+MERKLE_LEAVES = max(1, min(int(os.getenv("ISSUE_MERKLE_LEAVES", "16")), MERKLE_LEAVES_MAX))
+# Validade dos tokens emitidos (exp_at no payload assinado); 0 = sem expiração
+TOKEN_TTL_DAYS = float(os.getenv("ISSUE_TOKEN_TTL_DAYS", "365"))
+
+_signing_key = None
+
+def get_signing_key() -> SigningKey:
+    """Decodifica a chave de assinatura do servidor UMA vez por processo."""
+    global _signing_key
+    if _signing_key is None:
+        _signing_key = SigningKey(SERVER_SK_B64, encoder=Base64Encoder)
+    return _signing_key
+
+def novos_payloads(qtd: int, denom_cents: int = 100, ttl_days: float = None):
+    ttl = timedelta(days=TOKEN_TTL_DAYS if ttl_days is None else ttl_days)
+    payloads = []
+    for _ in range(qtd):
+        agora = datetime.utcnow()
+        payload = {
+            "token_id": str(uuid.uuid4()),
+            "denom_cents": denom_cents,
+            "issuer_pubkey": SERVER_PK_B64, # A chave em Base64 vai no payload JSON
+            "issued_at": agora.isoformat() + "Z"
+        }
+        if ttl:
+            payload["exp_at"] = (agora + ttl).isoformat() + "Z"
+        payloads.append(payload)
+    return payloads
+
+def _assinaturas(pbs, modo):
+    """[(assinatura, prova ou None)] para cada payload canônico de `pbs`."""
+    sk = get_signing_key()
+    if modo != "merkle":
+        return [(sk.sign(pb).signature, None) for pb in pbs]
+    saida = []
+    for i in range(0, len(pbs), MERKLE_LEAVES):
+        bloco = pbs[i:i + MERKLE_LEAVES]
+        raiz, provas = merkle.construir([merkle.folha(pb) for pb in bloco])
+        assinatura = sk.sign(merkle.mensagem_raiz(raiz, len(bloco))).signature
+        saida += [(assinatura, prova) for prova in provas]
+    return saida
+
+def assinar_payloads(payloads, modo=None):
+    """
+    Assina `payloads` em memória (sem tocar no banco), token a token ou por
+    árvore de Merkle conforme `modo` (padrão ISSUE_SIGNING).
+    Retorna (linhas para a tabela tokens, pacotes para o cliente).
+    """
     issuer_pubkey_bytes = base64.b64decode(SERVER_PK_B64)
+    pbs = [canonical_bytes(p) for p in payloads]
+    linhas = []
+    emitidos = []
+    for payload, pb, (signature, prova) in zip(payloads, pbs, _assinaturas(pbs, modo or ISSUE_SIGNING)):
+        digest = sha256(pb)
+        linhas.append((payload["token_id"], payload["denom_cents"], payload["issued_at"], payload.get("exp_at"),
+                       issuer_pubkey_bytes, digest))
+        pacote = {
+            "payload": payload,
+            "signature_b64": base64.b64encode(signature).decode(),
+            "payload_sha256_b64": base64.b64encode(digest).decode()
+        }
+        if prova is not None:
+            pacote["merkle_proof_b64"] = base64.b64encode(prova).decode()
+        emitidos.append(pacote)
+    return linhas, emitidos
 
-    print(f"🚀 Emitindo {qtd} tokens...")
-    try:
-        for _ in range(qtd):
-            token_id = str(uuid.uuid4())
-            denom_cents = 100
-            issued_at = datetime.utcnow().isoformat() + "Z"
-
-            payload = {
-                "token_id": token_id,
-                "denom_cents": denom_cents,
-                "issuer_pubkey": SERVER_PK_B64, # A chave em Base64 vai no payload JSON
-                "issued_at": issued_at
-            }
-
-            pb = canonical_bytes(payload)
-            digest = sha256(pb)
-            signature_b64 = sign_payload(pb, SERVER_SK_B64)
-
-            cur.execute("""
-                INSERT INTO tokens (token_id, denom_cents, issued_at, issuer_pubkey, payload_sha256, state)
-                VALUES (%s, %s, %s, %s, %s, 'ISSUED')
-            """, (token_id, denom_cents, issued_at, issuer_pubkey_bytes, psycopg2.Binary(digest)))
-
-            emitidos.append({
-                "payload": payload,
-                "signature_b64": signature_b64,
-                "payload_sha256_b64": Base64Encoder.encode(digest).decode()
-            })
+def assinar_tokens(qtd: int, denom_cents: int = 100):
+    """Gera e assina `qtd` tokens de `denom_cents`. Retorna (linhas, pacotes) como assinar_payloads()."""
+    return assinar_payloads(novos_payloads(qtd, denom_cents))
+
+def gravar_tokens(cur, linhas):
+    """Grava o lote inteiro com um INSERT multi-linha (ou COPY para lotes grandes)."""
+    if len(linhas) >= COPY_THRESHOLD:
+        buf = io.StringIO()
+        for token_id, denom_cents, issued_at, exp_at, pubkey, digest in linhas:
+            exp_at = exp_at or "\\N"  # NULL no COPY
+            buf.write(f"{token_id}\t{denom_cents}\t{issued_at}\t{exp_at}\t"
+                      f"\\\\x{pubkey.hex()}\t\\\\x{digest.hex()}\tISSUED\n")
+        buf.seek(0)
+        cur.copy_expert("""
+            COPY tokens (token_id, denom_cents, issued_at, exp_at, issuer_pubkey, payload_sha256, state)
+            FROM STDIN
+        """, buf)
+    else:
+        execute_values(cur, """
+            INSERT INTO tokens (token_id, denom_cents, issued_at, exp_at, issuer_pubkey, payload_sha256, state)
+            VALUES %s
+        """, linhas, template="(%s, %s, %s, %s, %s, %s, 'ISSUED')", page_size=INSERT_PAGE_SIZE)
+
+async def gravar_tokens_async(cur, linhas):
+    """gravar_tokens para cursores assíncronos (psycopg 3, async_app.py): sempre COPY."""
+    async with cur.copy("""
+        COPY tokens (token_id, denom_cents, issued_at, exp_at, issuer_pubkey, payload_sha256, state)
+        FROM STDIN
+    """) as copy:
+        for linha in linhas:
+            await copy.write_row((*linha, "ISSUED"))
 
+def assinar_mix(mix: dict):
+    """assinar_tokens() para {denominação: quantidade}, na ordem do mix (uma árvore cobre todas as denominações)."""
+    return assinar_payloads([p for denom_cents, n in mix.items() for p in novos_payloads(n, denom_cents)])
+
+
+def emitir_tokens(qtd: int, db=None, mix: dict = None):
+    db = db or get_db()
+    cur = db.cursor()
+    mix = mix or {100: qtd}
+
+    print(f"🚀 Emitindo {sum(mix.values())} tokens...")
+    try:
+        linhas, emitidos = assinar_mix(mix)
+        # tudo ou nada: o lote inteiro entra na mesma transação
+        gravar_tokens(cur, linhas)
         db.commit()
+        metrics.TOKENS_ISSUED.inc(len(emitidos))
         print(f"✅ {len(emitidos)} token(s) emitido(s) com sucesso.")
     
     except (Exception, psycopg2.Error) as error:
@@ -79,6 +175,33 @@ def emitir_tokens(qtd: int):
     
     finally:
         cur.close()
-        db.close()
 
-    return emitidos
\ No newline at end of file
+    return emitidos
+
+
+def emitir_tokens_em_blocos(qtd: int, db=None, bloco: int = STREAM_CHUNK, mix: dict = None):
+    """
+    Emissão incremental: assina, grava e COMMITA blocos de até `bloco` tokens,
+    devolvendo cada bloco logo após o commit. A memória fica limitada a um
+    bloco, qualquer que seja `qtd`. Um token só é entregue depois de durável;
+    em caso de erro, os blocos anteriores continuam válidos.
+    """
+    db = db or get_db()
+    cur = db.cursor()
+    mix = mix or {100: qtd}
+    entregues, total = 0, sum(mix.values())
+    try:
+        while entregues < total:
+            n = min(bloco, total - entregues)
+            linhas, emitidos = assinar_mix(fatia(mix, entregues, entregues + n))
+            gravar_tokens(cur, linhas)
+            db.commit()
+            metrics.TOKENS_ISSUED.inc(n)
+            entregues += n
+            yield emitidos
+    except (Exception, psycopg2.Error) as error:
+        db.rollback()
+        print(f"❌ Erro ao emitir tokens (streaming): {error}")
+        raise
+    finally:
+        cur.close()
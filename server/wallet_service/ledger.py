@@ -0,0 +1,195 @@
+"""
+Razão contábil em partidas dobradas + saldos mantidos incrementalmente.
+
+Todo lançamento em ledger_entries deve passar por aqui, para que a tabela
+`balances` seja atualizada na MESMA transação. Leitura de saldo vira uma busca
+por chave primária, independente do tamanho do histórico.
+
+Contas quentes (reserva de emissão, breakage), que entram em quase todo
+resgate, têm o saldo espalhado por BALANCE_STRIPES linhas (account_id, stripe):
+cada transação soma seu delta na faixa sorteada pelo tx_id, então resgates
+concorrentes não disputam a mesma linha (e não falham com 40001 sob
+SERIALIZABLE). O saldo é a soma das faixas. Contas de usuário usam só a faixa 0.
+
+Manutenção (recalcula a partir do razão e reporta divergências):
+    python ledger.py verificar
+    python ledger.py reconstruir
+"""
+import os
+import sys
+import uuid
+from collections import defaultdict
+
+BALANCE_STRIPES = int(os.getenv("LEDGER_BALANCE_STRIPES", "16"))
+
+_listradas = set()
+
+
+def new_uuid(): return str(uuid.uuid4())
+
+
+def listrar(account_id):
+    """Marca uma conta quente: seus deltas se espalham por BALANCE_STRIPES linhas de `balances`."""
+    _listradas.add(str(account_id))
+
+
+def _faixa(tx_id, account_id):
+    if BALANCE_STRIPES <= 1 or account_id not in _listradas:
+        return 0
+    return uuid.UUID(str(tx_id)).int % BALANCE_STRIPES
+
+
+def _delta(side, amount_cents):
+    return amount_cents if side == "CREDIT" else -amount_cents
+
+
+def comandos_lancamento(tx_id, lancamentos, currency="BRL"):
+    """
+    SQL (comando, parâmetros) que grava os lançamentos (account_id, side,
+    amount_cents, description) de uma transação lógica e aplica os deltas em
+    `balances`. Os saldos são atualizados em ordem de (account_id, stripe)
+    para evitar deadlocks.
+    """
+    valores = []
+    params = []
+    deltas = defaultdict(int)
+    for account_id, side, amount_cents, description in lancamentos:
+        valores.append("(%s, %s, %s, %s, %s, %s)")
+        params += [tx_id, account_id, side, amount_cents, currency, description]
+        account_id = str(account_id)
+        deltas[(account_id, _faixa(tx_id, account_id))] += _delta(side, amount_cents)
+
+    ordenadas = sorted(deltas.items())
+    return [
+        (f"""
+        INSERT INTO ledger_entries (tx_id, account_id, side, amount_cents, currency, description)
+        VALUES {", ".join(valores)}
+        """, params),
+        (f"""
+        INSERT INTO balances (account_id, stripe, currency, balance_cents)
+        VALUES {", ".join(["(%s, %s, %s, %s)"] * len(ordenadas))}
+        ON CONFLICT (account_id, stripe) DO UPDATE
+        SET balance_cents = balances.balance_cents + EXCLUDED.balance_cents,
+            updated_at = now()
+        """, [v for (account_id, faixa), delta in ordenadas for v in (account_id, faixa, currency, delta)]),
+    ]
+
+
+def lancar(cur, tx_id, lancamentos, currency="BRL"):
+    """Grava os lançamentos e atualiza `balances` na transação corrente."""
+    for sql, params in comandos_lancamento(tx_id, lancamentos, currency):
+        cur.execute(sql, params)
+    return tx_id
+
+
+def lancar_partida_dobrada(cur, debit_account, credit_account, amount_cents,
+                           desc_debito, desc_credito, currency="BRL"):
+    """Um débito e um crédito do mesmo valor; retorna o tx_id."""
+    tx_id = new_uuid()
+    return lancar(cur, tx_id, [
+        (debit_account, "DEBIT", amount_cents, desc_debito),
+        (credit_account, "CREDIT", amount_cents, desc_credito),
+    ], currency)
+
+
+async def lancar_partida_dobrada_async(cur, debit_account, credit_account, amount_cents,
+                                       desc_debito, desc_credito, currency="BRL"):
+    """lancar_partida_dobrada para cursores assíncronos (psycopg 3, async_app.py)."""
+    tx_id = new_uuid()
+    for sql, params in comandos_lancamento(tx_id, [
+        (debit_account, "DEBIT", amount_cents, desc_debito),
+        (credit_account, "CREDIT", amount_cents, desc_credito),
+    ], currency):
+        await cur.execute(sql, params)
+    return tx_id
+
+
+def saldo(cur, account_id):
+    """Retorna (balance_cents, currency) ou None se a conta não existir. O(faixas)."""
+    cur.execute("""
+        SELECT COALESCE(SUM(b.balance_cents), 0), a.currency
+        FROM accounts a
+        LEFT JOIN balances b ON b.account_id = a.account_id
+        WHERE a.account_id = %s
+        GROUP BY a.account_id, a.currency
+    """, (account_id,))
+    return cur.fetchone()
+
+
+# -------------------- Manutenção --------------------
+
+# Checkpoint das partições arquivadas (ver ledger_partitions.py) + partições anexadas
+SALDOS_DO_RAZAO = """
+    SELECT account_id, currency, SUM(balance_cents) AS balance_cents
+    FROM (
+        SELECT account_id, currency, balance_cents
+        FROM ledger_checkpoints
+        WHERE period_end = (SELECT max(period_end) FROM ledger_archive)
+        UNION ALL
+        SELECT account_id, currency,
+               CASE WHEN side='CREDIT' THEN amount_cents ELSE -amount_cents END
+        FROM ledger_entries
+    ) s
+    GROUP BY account_id, currency
+"""
+
+
+def verificar(cur):
+    """Lista as contas cujo saldo materializado diverge do razão."""
+    cur.execute(f"""
+        SELECT COALESCE(r.account_id, b.account_id),
+               COALESCE(r.balance_cents, 0) AS esperado,
+               COALESCE(b.balance_cents, 0) AS materializado
+        FROM ({SALDOS_DO_RAZAO}) r
+        FULL OUTER JOIN (
+            SELECT account_id, SUM(balance_cents) AS balance_cents FROM balances GROUP BY account_id
+        ) b ON b.account_id = r.account_id
+        WHERE COALESCE(r.balance_cents, 0) <> COALESCE(b.balance_cents, 0)
+        ORDER BY 1
+    """)
+    return [
+        {"account_id": str(a), "expected_cents": esperado, "materialized_cents": mat,
+         "drift_cents": mat - esperado}
+        for a, esperado, mat in cur.fetchall()
+    ]
+
+
+def reconstruir(cur):
+    """
+    Recalcula `balances` inteiro a partir do razão. Bloqueia novos lançamentos
+    durante a reconstrução (SHARE em ledger_entries) para não perder deltas.
+    Cada conta volta a uma única linha (faixa 0).
+    """
+    cur.execute("LOCK TABLE ledger_entries IN SHARE MODE")
+    cur.execute("DELETE FROM balances")
+    cur.execute(f"""
+        INSERT INTO balances (account_id, currency, balance_cents)
+        SELECT account_id, currency, balance_cents FROM ({SALDOS_DO_RAZAO}) r
+    """)
+    return cur.rowcount
+
+
+if __name__ == "__main__":
+    from db import pooled_connection
+
+    comando = sys.argv[1] if len(sys.argv) > 1 else "verificar"
+    if comando not in ("verificar", "reconstruir"):
+        sys.exit("uso: python ledger.py [verificar|reconstruir]")
+
+    with pooled_connection() as conn:
+        cur = conn.cursor()
+        divergencias = verificar(cur)
+        for d in divergencias:
+            print(f"⚠️ {d['account_id']}: razão={d['expected_cents']} "
+                  f"saldo={d['materialized_cents']} (desvio {d['drift_cents']})")
+        print(f"🔎 {len(divergencias)} conta(s) com divergência.")
+
+        if comando == "reconstruir":
+            n = reconstruir(cur)
+            conn.commit()
+            print(f"✅ Saldos reconstruídos para {n} conta(s).")
+        else:
+            conn.rollback()
+        cur.close()
+
+    sys.exit(1 if divergencias and comando == "verificar" else 0)
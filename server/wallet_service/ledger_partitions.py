@@ -0,0 +1,218 @@
+"""
+Manutenção das partições mensais de ledger_entries.
+
+- garantir(): cria a partição do mês corrente e as dos próximos meses
+  (função ledger_ensure_partitions do schema). Roda na subida do serviço e,
+  dentro dele, a cada LEDGER_PARTITIONS_INTERVAL segundos (cron opcional).
+  Um mês sem partição cai na partição DEFAULT em vez de falhar o lançamento;
+  garantir() move essas linhas para a partição do mês quando a cria e alerta
+  (log + métrica ledger_default_partition_rows) enquanto a DEFAULT não estiver vazia.
+- arquivar_antigas(): para cada partição fechada mais antiga que a janela
+  quente, na MESMA transação:
+    1. destaca a partição e move para ela os lançamentos anteriores ao fim do
+       período que caíram na DEFAULT (sem isso ficariam fora do arquivo e do
+       checkpoint);
+    2. grava em ledger_checkpoints o saldo acumulado de cada conta e moeda até
+       o fim da partição (checkpoint anterior + lançamentos da partição);
+    3. registra a partição em ledger_archive e a move para o schema `archive`.
+  Assim a view account_balances e ledger.verificar nunca contam nada duas vezes
+  nem deixam de contar: ou a partição está anexada, ou já está no checkpoint.
+  Partições são arquivadas em ordem, da mais antiga para a mais nova.
+
+Uso (cron diário, por exemplo):
+    python ledger_partitions.py manter
+    python ledger_partitions.py listar
+"""
+import os
+import re
+import sys
+import threading
+from datetime import date, datetime, timezone
+
+MESES_A_FRENTE = int(os.getenv("LEDGER_PARTITIONS_AHEAD", "3"))
+# Meses fechados que continuam anexados (consultas recentes / auditoria)
+MESES_QUENTES = int(os.getenv("LEDGER_HOT_MONTHS", "3"))
+# Espera máxima pelo lock do DETACH (não enfileira atrás de transações longas)
+LOCK_TIMEOUT = os.getenv("LEDGER_ARCHIVE_LOCK_TIMEOUT", "2s")
+# Intervalo da verificação periódica dentro do serviço (0 desliga)
+INTERVALO = float(os.getenv("LEDGER_PARTITIONS_INTERVAL", "21600"))
+
+PARTICAO_DEFAULT = "ledger_entries_default"
+SQL_GARANTIR = "SELECT ledger_ensure_partitions(%s)"
+SQL_LINHAS_DEFAULT = f"SELECT count(*) FROM {PARTICAO_DEFAULT}"
+
+_NOME = re.compile(r"^ledger_entries_(\d{4})_(\d{2})$")
+
+_lock = threading.Lock()
+_estado = {"ahead_months": MESES_A_FRENTE, "created": 0, "default_rows": 0, "checked_at": None}
+
+
+def _proximo_mes(d):
+    return date(d.year + d.month // 12, d.month % 12 + 1, 1)
+
+
+def _registrar(criadas, linhas_default):
+    with _lock:
+        _estado["created"] += criadas
+        _estado["default_rows"] = linhas_default
+        _estado["checked_at"] = datetime.now(timezone.utc).isoformat()
+    if linhas_default:
+        print(f"🚨 {linhas_default} lançamento(s) na partição {PARTICAO_DEFAULT}: "
+              f"meses sem partição; rode python ledger_partitions.py manter")
+
+
+def garantir(conn, meses_a_frente=MESES_A_FRENTE):
+    """Cria as partições que faltam (movendo o que caiu na DEFAULT); retorna quantas foram criadas."""
+    cur = conn.cursor()
+    try:
+        cur.execute(SQL_GARANTIR, (meses_a_frente,))
+        criadas = cur.fetchone()[0]
+        conn.commit()
+        cur.execute(SQL_LINHAS_DEFAULT)
+        linhas_default = cur.fetchone()[0]
+        conn.rollback()
+    finally:
+        cur.close()
+    _registrar(criadas, linhas_default)
+    return criadas
+
+
+async def garantir_async(conn, meses_a_frente=MESES_A_FRENTE):
+    """garantir para conexões assíncronas (psycopg 3, async_app.py)."""
+    async with conn.cursor() as cur:
+        await cur.execute(SQL_GARANTIR, (meses_a_frente,))
+        criadas = (await cur.fetchone())[0]
+        await conn.commit()
+        await cur.execute(SQL_LINHAS_DEFAULT)
+        linhas_default = (await cur.fetchone())[0]
+        await conn.rollback()
+    _registrar(criadas, linhas_default)
+    return criadas
+
+
+def partition_stats():
+    with _lock:
+        return {"interval_s": INTERVALO, **_estado}
+
+
+def executar_manutencao(parar: threading.Event, intervalo=INTERVALO):
+    """Laço da verificação periódica (a da subida já foi feita pelo serviço)."""
+    from db import pooled_connection
+
+    while not parar.wait(intervalo):
+        try:
+            with pooled_connection() as conn:
+                criadas = garantir(conn)
+            if criadas:
+                print(f"🗓️ {criadas} partição(ões) do razão criada(s).")
+        except Exception as e:
+            print(f"❌ Erro ao garantir partições do razão: {e}")
+
+
+def iniciar_manutencao_em_thread():
+    parar = threading.Event()
+    if INTERVALO > 0:
+        t = threading.Thread(target=executar_manutencao, args=(parar,), name="ledger-partitions", daemon=True)
+        t.start()
+    return parar
+
+
+def listar(cur):
+    """Partições anexadas como [(nome, inicio, fim)], em ordem cronológica."""
+    cur.execute("""
+        SELECT c.relname
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'ledger_entries'::regclass
+    """)
+    particoes = []
+    for (nome,) in cur.fetchall():
+        m = _NOME.match(nome)
+        if m:
+            inicio = date(int(m.group(1)), int(m.group(2)), 1)
+            particoes.append((nome, inicio, _proximo_mes(inicio)))
+    return sorted(particoes, key=lambda p: p[1])
+
+
+def arquivar(conn, nome, fim):
+    """Detach + checkpoint de uma partição fechada, atomicamente."""
+    cur = conn.cursor()
+    try:
+        cur.execute("SELECT set_config('lock_timeout', %s, true)", (LOCK_TIMEOUT,))
+        cur.execute(f"ALTER TABLE ledger_entries DETACH PARTITION {nome}")
+        # destacada, a tabela não tem mais a restrição do mês: recebe o que a DEFAULT tem até `fim`
+        cur.execute(f"""
+            WITH movidas AS (DELETE FROM {PARTICAO_DEFAULT} WHERE created_at < %s RETURNING *)
+            INSERT INTO {nome} SELECT * FROM movidas
+        """, (fim,))
+        cur.execute(f"""
+            INSERT INTO ledger_checkpoints (account_id, currency, period_end, balance_cents)
+            SELECT account_id, currency, %s, SUM(balance_cents)
+            FROM (
+                SELECT account_id, currency, balance_cents
+                FROM ledger_checkpoints
+                WHERE period_end = (SELECT max(period_end) FROM ledger_archive)
+                UNION ALL
+                SELECT account_id, currency,
+                       CASE WHEN side='CREDIT' THEN amount_cents ELSE -amount_cents END
+                FROM {nome}
+            ) s
+            GROUP BY account_id, currency
+        """, (fim,))
+        contas = cur.rowcount
+        cur.execute("INSERT INTO ledger_archive (period_end, partition_name) VALUES (%s, %s)",
+                    (fim, f"archive.{nome}"))
+        cur.execute(f"ALTER TABLE {nome} SET SCHEMA archive")
+        conn.commit()
+        return contas
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+
+
+def arquivar_antigas(conn, meses_quentes=MESES_QUENTES, hoje=None):
+    """Arquiva, em ordem, as partições que terminaram há mais de `meses_quentes` meses."""
+    hoje = hoje or date.today()
+    limite = date(hoje.year, hoje.month, 1)
+    for _ in range(meses_quentes):
+        limite = date(limite.year - (limite.month == 1), (limite.month - 2) % 12 + 1, 1)
+
+    cur = conn.cursor()
+    try:
+        particoes = listar(cur)
+        cur.execute("SELECT max(period_end) FROM ledger_archive")
+        arquivado_ate = cur.fetchone()[0]
+        conn.rollback()
+    finally:
+        cur.close()
+
+    arquivadas = []
+    for nome, inicio, fim in particoes:
+        if fim > limite:
+            break
+        if arquivado_ate is not None and inicio < arquivado_ate.date():
+            raise RuntimeError(f"{nome} é anterior ao último checkpoint ({arquivado_ate}); verifique ledger_archive")
+        arquivar(conn, nome, fim)
+        arquivadas.append(nome)
+    return arquivadas
+
+
+if __name__ == "__main__":
+    from db import pooled_connection
+
+    comando = sys.argv[1] if len(sys.argv) > 1 else "manter"
+    if comando not in ("manter", "listar"):
+        sys.exit("uso: python ledger_partitions.py [manter|listar]")
+
+    with pooled_connection() as conn:
+        if comando == "manter":
+            print(f"🗓️ {garantir(conn)} partição(ões) criada(s).")
+            for nome in arquivar_antigas(conn):
+                print(f"📦 {nome} arquivada em archive.{nome}.")
+        cur = conn.cursor()
+        for nome, inicio, fim in listar(cur):
+            print(f"   {nome}: [{inicio}, {fim})")
+        cur.close()
+        conn.rollback()
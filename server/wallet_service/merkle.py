@@ -0,0 +1,140 @@
+"""
+Assinatura de emissão em lote por árvore de Merkle (ISSUE_SIGNING=merkle).
+
+O emissor monta uma árvore sobre canonical_bytes(payload) de até N tokens e
+assina só a raiz. Cada token leva a assinatura da raiz (no mesmo campo
+signature_b64) e a prova de inclusão:
+
+  offset  bytes   campo
+  0       4       índice da folha (uint32 big-endian)
+  4       4       número de folhas da árvore (uint32 big-endian)
+  8       32*k    irmãos do caminho, da folha para a raiz
+
+k sai de (índice, tamanho): um nó sem par no fim de um nível sobe sem hash,
+então a prova não precisa de contador e nenhum nível duplica nós.
+
+  folha = sha256(0x00 || canonical_bytes(payload))
+  nó    = sha256(0x01 || esquerda || direita)
+  assinado = "bluepay/merkle-root/v1" || tamanho (uint32) || raiz
+
+Prefixos distintos para folha, nó e raiz impedem que um nó interno passe por
+folha ou que a assinatura de uma raiz sirva como assinatura de um token.
+
+Quem verifica guarda as raízes já verificadas (raiz_assinada, LRU): o
+primeiro token de um lote custa uma verificação Ed25519, os demais só os
+~log2(N) hashes do caminho.
+
+Cópia idêntica em simular/merkle.py (o cliente não importa o servidor).
+"""
+import base64
+import hashlib
+import struct
+from functools import lru_cache
+
+from nacl.exceptions import BadSignatureError
+from nacl.signing import VerifyKey
+
+DOMINIO_RAIZ = b"bluepay/merkle-root/v1"
+TAMANHO_HASH = 32
+
+_CABECALHO = struct.Struct(">II")
+
+
+class ProvaInvalida(ValueError):
+    """Prova de inclusão mal formada."""
+
+
+def folha(payload_bytes: bytes) -> bytes:
+    return hashlib.sha256(b"\x00" + payload_bytes).digest()
+
+
+def _no(esquerda: bytes, direita: bytes) -> bytes:
+    return hashlib.sha256(b"\x01" + esquerda + direita).digest()
+
+
+def mensagem_raiz(raiz: bytes, tamanho: int) -> bytes:
+    """Bytes efetivamente assinados pelo emissor."""
+    return DOMINIO_RAIZ + struct.pack(">I", tamanho) + raiz
+
+
+def construir(folhas):
+    """
+    Árvore sobre `folhas` (hashes de folha()). Retorna (raiz, [prova em bytes
+    para cada folha, na mesma ordem]).
+    """
+    n = len(folhas)
+    if not 0 < n < 2 ** 32:
+        raise ValueError("Árvore precisa de 1 a 2^32 - 1 folhas")
+    caminhos = [[] for _ in range(n)]
+    # posicoes[i] = índice da folha i no nível corrente
+    posicoes = list(range(n))
+    nivel = list(folhas)
+    while len(nivel) > 1:
+        m = len(nivel)
+        for i, p in enumerate(posicoes):
+            if p ^ 1 < m:
+                caminhos[i].append(nivel[p ^ 1])
+            posicoes[i] = p >> 1
+        nivel = [_no(nivel[j], nivel[j + 1]) for j in range(0, m - 1, 2)] + ([nivel[-1]] if m % 2 else [])
+    return nivel[0], [_CABECALHO.pack(i, n) + b"".join(c) for i, c in enumerate(caminhos)]
+
+
+def comprimento_caminho(indice: int, tamanho: int) -> int:
+    k = 0
+    while tamanho > 1:
+        if indice ^ 1 < tamanho:
+            k += 1
+        indice >>= 1
+        tamanho = (tamanho + 1) // 2
+    return k
+
+
+def ler_prova(dados, pos: int = 0):
+    """Lê uma prova a partir de `pos`. Retorna (índice, tamanho, [irmãos], posição após a prova)."""
+    if pos + _CABECALHO.size > len(dados):
+        raise ProvaInvalida("prova truncada")
+    indice, tamanho = _CABECALHO.unpack_from(dados, pos)
+    if indice >= tamanho:
+        raise ProvaInvalida("índice fora da árvore")
+    inicio = pos + _CABECALHO.size
+    fim = inicio + comprimento_caminho(indice, tamanho) * TAMANHO_HASH
+    if fim > len(dados):
+        raise ProvaInvalida("prova truncada")
+    caminho = [bytes(dados[i:i + TAMANHO_HASH]) for i in range(inicio, fim, TAMANHO_HASH)]
+    return indice, tamanho, caminho, fim
+
+
+def raiz_de(payload_bytes: bytes, indice: int, tamanho: int, caminho) -> bytes:
+    """Raiz implicada pela folha de `payload_bytes` e seu caminho."""
+    h = folha(payload_bytes)
+    irmaos = iter(caminho)
+    while tamanho > 1:
+        if indice ^ 1 < tamanho:
+            irmao = next(irmaos)
+            h = _no(irmao, h) if indice & 1 else _no(h, irmao)
+        indice >>= 1
+        tamanho = (tamanho + 1) // 2
+    return h
+
+
+@lru_cache(maxsize=64)
+def _chave(pubkey_b64: str) -> VerifyKey:
+    return VerifyKey(base64.b64decode(pubkey_b64))
+
+
+@lru_cache(maxsize=4096)
+def raiz_assinada(pubkey_b64: str, tamanho: int, raiz: bytes, assinatura: bytes) -> bool:
+    """Verificação Ed25519 da raiz, feita uma vez por lote (resultado em cache)."""
+    try:
+        _chave(pubkey_b64).verify(mensagem_raiz(raiz, tamanho), assinatura)
+        return True
+    except BadSignatureError:
+        return False
+
+
+def verificar(payload_bytes: bytes, prova: bytes, assinatura: bytes, pubkey_b64: str) -> bool:
+    """True se `payload_bytes` pertence a uma árvore cuja raiz o emissor assinou."""
+    indice, tamanho, caminho, fim = ler_prova(prova)
+    if fim != len(prova):
+        raise ProvaInvalida("bytes após a prova")
+    return raiz_assinada(pubkey_b64, tamanho, raiz_de(payload_bytes, indice, tamanho, caminho), bytes(assinatura))
@@ -0,0 +1,195 @@
+"""
+Métricas em memória no formato de texto do Prometheus (GET /metrics).
+
+Contadores e histogramas de buckets fixos: cada observação é um bisect + soma
+sob um lock, sem I/O no caminho da requisição. O tempo de banco por requisição
+é acumulado pelo cursor instrumentado (TimedCursor), instalado pelo pool em
+todas as conexões.
+"""
+import bisect
+import threading
+import time
+from contextvars import ContextVar
+
+import psycopg2.extensions
+
+# Buckets em segundos (latência HTTP e tempo de banco por requisição)
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escapar(valor):
+    return str(valor).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _rotulos(nomes, valores):
+    if not nomes:
+        return ""
+    return "{" + ",".join(f'{n}="{_escapar(v)}"' for n, v in zip(nomes, valores)) + "}"
+
+
+class Counter:
+    def __init__(self, nome, ajuda, labels=()):
+        self.nome, self.ajuda, self.labels = nome, ajuda, tuple(labels)
+        self._valores = {}
+        self._lock = threading.Lock()
+
+    def inc(self, valor=1, **labels):
+        chave = tuple(labels.get(n, "") for n in self.labels)
+        with self._lock:
+            self._valores[chave] = self._valores.get(chave, 0) + valor
+
+    def exportar(self):
+        linhas = [f"# HELP {self.nome} {self.ajuda}", f"# TYPE {self.nome} counter"]
+        with self._lock:
+            itens = sorted(self._valores.items())
+        linhas += [f"{self.nome}{_rotulos(self.labels, chave)} {valor}" for chave, valor in itens]
+        return linhas
+
+
+class Histogram:
+    def __init__(self, nome, ajuda, labels=(), buckets=LATENCY_BUCKETS):
+        self.nome, self.ajuda, self.labels = nome, ajuda, tuple(labels)
+        self.buckets = tuple(buckets)
+        self._series = {}  # chave -> [contagens por bucket (+Inf no fim), soma]
+        self._lock = threading.Lock()
+
+    def observe(self, valor, **labels):
+        chave = tuple(labels.get(n, "") for n in self.labels)
+        i = bisect.bisect_left(self.buckets, valor)
+        with self._lock:
+            serie = self._series.get(chave)
+            if serie is None:
+                serie = self._series[chave] = [[0] * (len(self.buckets) + 1), 0.0]
+            serie[0][i] += 1
+            serie[1] += valor
+
+    def exportar(self):
+        linhas = [f"# HELP {self.nome} {self.ajuda}", f"# TYPE {self.nome} histogram"]
+        with self._lock:
+            itens = sorted((chave, (list(c), s)) for chave, (c, s) in self._series.items())
+        for chave, (contagens, soma) in itens:
+            acumulado = 0
+            for limite, n in zip((*self.buckets, "+Inf"), contagens):
+                acumulado += n
+                rotulos = _rotulos((*self.labels, "le"), (*chave, limite))
+                linhas.append(f"{self.nome}_bucket{rotulos} {acumulado}")
+            base = _rotulos(self.labels, chave)
+            linhas.append(f"{self.nome}_sum{base} {soma:.6f}")
+            linhas.append(f"{self.nome}_count{base} {acumulado}")
+        return linhas
+
+
+_registro = []
+# funções chamadas na coleta; retornam [(nome, tipo, ajuda, [(rótulos: dict, valor)])]
+_coletores = []
+
+
+def counter(nome, ajuda, labels=()):
+    m = Counter(nome, ajuda, labels)
+    _registro.append(m)
+    return m
+
+
+def histogram(nome, ajuda, labels=(), buckets=LATENCY_BUCKETS):
+    m = Histogram(nome, ajuda, labels, buckets)
+    _registro.append(m)
+    return m
+
+
+def coletor(funcao):
+    """Registra uma função que expõe valores já mantidos em outro módulo (pool, tx...)."""
+    _coletores.append(funcao)
+    return funcao
+
+
+# ===============================================================
+# Métricas do serviço
+# ===============================================================
+HTTP_REQUESTS = counter("http_requests_total", "Requisições por rota, método e status.",
+                        ("route", "method", "status"))
+HTTP_LATENCY = histogram("http_request_duration_seconds", "Latência por rota.", ("route", "method"))
+HTTP_DB_TIME = histogram("http_request_db_seconds", "Tempo gasto no Postgres por requisição.", ("route",))
+DB_QUERIES = counter("db_queries_total", "Comandos enviados ao Postgres por rota.", ("route",))
+TOKENS_ISSUED = counter("tokens_issued_total", "Tokens emitidos e commitados.")
+TOKENS_REDEEMED = counter("tokens_redeemed_total", "Tokens resgatados e commitados.", ("mode",))
+TOKENS_EXPIRED = counter("tokens_expired_total", "Tokens vencidos passados a EXPIRED pelo varredor.")
+
+
+# ===============================================================
+# Tempo de banco por requisição
+# ===============================================================
+_db_tempo = ContextVar("db_tempo", default=None)
+
+
+def iniciar_requisicao():
+    """Zera o acumulador [segundos, comandos] do contexto atual."""
+    acumulador = [0.0, 0]
+    _db_tempo.set(acumulador)
+    return acumulador
+
+
+def acumular_tempo_de_banco(inicio):
+    """Soma o comando iniciado em `inicio` ao acumulador da requisição (se houver)."""
+    acumulador = _db_tempo.get()
+    if acumulador is not None:
+        acumulador[0] += time.perf_counter() - inicio
+        acumulador[1] += 1
+
+
+def tempo_de_banco():
+    acumulador = _db_tempo.get()
+    return (acumulador[0], acumulador[1]) if acumulador is not None else (0.0, 0)
+
+
+class TimedCursor(psycopg2.extensions.cursor):
+    """Cursor que soma o tempo de cada comando no acumulador da requisição."""
+
+    def execute(self, query, vars=None):
+        inicio = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            acumular_tempo_de_banco(inicio)
+
+    def executemany(self, query, vars_list):
+        inicio = time.perf_counter()
+        try:
+            return super().executemany(query, vars_list)
+        finally:
+            acumular_tempo_de_banco(inicio)
+
+    def copy_expert(self, sql, file, size=8192):
+        inicio = time.perf_counter()
+        try:
+            return super().copy_expert(sql, file, size)
+        finally:
+            acumular_tempo_de_banco(inicio)
+
+
+class TimedConnection(psycopg2.extensions.connection):
+    """COMMIT também conta como tempo de banco (é onde SERIALIZABLE valida)."""
+
+    def commit(self):
+        inicio = time.perf_counter()
+        try:
+            return super().commit()
+        finally:
+            acumular_tempo_de_banco(inicio)
+
+
+# ===============================================================
+# Exportação
+# ===============================================================
+def exportar():
+    linhas = []
+    for m in _registro:
+        linhas += m.exportar()
+    for funcao in _coletores:
+        try:
+            valores = funcao()
+        except Exception:
+            continue
+        for nome, tipo, ajuda, amostras in valores:
+            linhas += [f"# HELP {nome} {ajuda}", f"# TYPE {nome} {tipo}"]
+            linhas += [f"{nome}{_rotulos(tuple(r), tuple(r.values()))} {valor}" for r, valor in amostras]
+    return "\n".join(linhas) + "\n"
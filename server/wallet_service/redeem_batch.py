@@ -0,0 +1,333 @@
+import os
+import uuid
+
+import accounts
+import ledger
+import metrics
+import token_verify
+import tx
+import redeemed_filter
+
+# Limite de tokens por requisição de resgate em lote
+MAX_BATCH_TOKENS = int(os.getenv("REDEEM_BATCH_MAX", "500"))
+
+# Resultados possíveis por token
+APPLIED = "applied"
+DUPLICATE = "duplicate"
+NOT_FOUND = "not_found"
+ALREADY_REDEEMED = "already_redeemed"
+INVALID = "invalid_signature"
+EXPIRED = "expired"
+# token no lote de uma redenção ainda PENDING na fila (redeem_queue.py)
+QUEUED = "queued"
+
+
+def new_uuid(): return str(uuid.uuid4())
+
+
+def garantir_device(cur, user_id):
+    """Device do usuário (cria um provisório se ainda não houver)."""
+    cur.execute("SELECT device_id FROM devices WHERE user_id=%s LIMIT 1;", (user_id,))
+    row = cur.fetchone()
+    if row:
+        return row[0]
+    requester_device = new_uuid()
+    cur.execute("""
+        INSERT INTO devices (device_id, user_id, attested_pubkey, cert_fingerprint)
+        VALUES (%s, %s, %s, %s)
+    """, (requester_device, user_id, b"pubkey", b"fingerprint"))
+    return requester_device
+
+
+def batch_idempotency_key(token_ids) -> bytes:
+    """Chave idempotente determinística para o conjunto de tokens do lote."""
+    nome = "batch:" + ",".join(sorted(token_ids))
+    return uuid.uuid5(uuid.NAMESPACE_DNS, nome).bytes
+
+
+def ids_do_lote(itens):
+    """
+    token_id de cada item como enviado (após expandir_lote). A chave do lote sai
+    daqui, e não dos itens que sobraram de normalizar_itens: numa retentativa o
+    filtro de resgatados ou a expiração podem descartar outros tokens, e a
+    chave mudaria.
+    """
+    return [str(t.get("token_id") if isinstance(t, dict) else t) for t in itens]
+
+
+def normalizar_itens(itens):
+    """
+    Separa os itens válidos (IDs normalizados, sem repetição, prova verificada)
+    dos que já podem ser classificados sem ir ao banco.
+    Aceita objetos no mesmo formato do /redeem ou apenas os IDs.
+    Retorna (token_ids, digests, previos, cpu_s).
+    """
+    candidatos = []
+    vistos = set()
+    previos = {}
+    for posicao, item in enumerate(itens):
+        if isinstance(item, dict) and item.get("token_error"):
+            previos[posicao] = INVALID
+            continue
+        if isinstance(item, dict):
+            bruto, payload, sig = item.get("token_id"), item.get("token_payload"), item.get("token_signature_b64")
+            prova = item.get("token_merkle_proof_b64")
+        else:
+            bruto, payload, sig, prova = item, None, None, None
+        try:
+            tid = str(uuid.UUID(str(bruto)))
+        except ValueError:
+            previos[posicao] = NOT_FOUND
+            continue
+        if tid in vistos:
+            previos[posicao] = DUPLICATE
+            continue
+        vistos.add(tid)
+        if redeemed_filter.ja_resgatado(tid):
+            # repetição certa: nem verifica a prova nem vai ao banco
+            previos[posicao] = ALREADY_REDEEMED
+            continue
+        try:
+            if token_verify.expirado(payload):
+                # exp_at vencido: recusado antes da assinatura e do banco
+                previos[posicao] = EXPIRED
+                continue
+        except token_verify.TokenInvalido:
+            previos[posicao] = INVALID
+            continue
+        candidatos.append((posicao, tid, payload, sig, prova))
+
+    # verificação criptográfica de todo o lote numa passada, antes do banco
+    digests, erros, cpu = token_verify.verificar_lote([c[1:] for c in candidatos])
+    token_ids = []
+    por_id = {}
+    for i, (posicao, tid, *_) in enumerate(candidatos):
+        if i in erros:
+            previos[posicao] = INVALID
+        else:
+            token_ids.append(tid)
+            por_id[tid] = digests[i]
+    return token_ids, por_id, previos, cpu
+
+
+def _bruto(item):
+    return item.get("token_id") if isinstance(item, dict) else item
+
+
+def _resultados(itens, previos, por_token):
+    resultados = []
+    for posicao, item in enumerate(itens):
+        bruto = _bruto(item)
+        if posicao in previos:
+            resultado = previos[posicao]
+        else:
+            resultado = por_token[str(uuid.UUID(str(bruto)))]
+        resultados.append({"token_id": str(bruto) if bruto is not None else None, "result": resultado})
+    return resultados
+
+
+def resgatar_lote(get_db, user_id, itens):
+    """
+    Resgata N tokens em UMA transação:
+      - provas verificadas antes de abrir conexão (lote todo inválido não toca o banco)
+      - um único SELECT ... FOR UPDATE ordenado por token_id (evita deadlock),
+        que só trava tokens cujo payload_sha256 confere
+      - uma única partida dobrada com o valor agregado
+    Retorna (corpo_da_resposta, http_status, cpu_de_verificação_s).
+    """
+    itens = token_verify.expandir_lote(itens)
+    validos, digests, previos, verify_cpu = normalizar_itens(itens)
+    # gerados fora do corpo: retentativas reaproveitam a mesma chave idempotente
+    redemption_id = new_uuid()
+    idempotency_key = batch_idempotency_key(ids_do_lote(itens))
+    if not validos:
+        resposta = None
+        if ALREADY_REDEEMED in previos.values():
+            # todos barrados pelo filtro de resgatados: pode ser a repetição de um lote aplicado
+            db = get_db()
+            resposta = tx.executar(db, lambda: _repeticao(db, user_id, itens, validos, digests, previos,
+                                                          idempotency_key),
+                                   nome="redeem_batch_replay")
+        if resposta is None:
+            return {
+                "status": "rejected",
+                "redemption_id": None,
+                "applied": 0,
+                "total_cents": 0,
+                "results": _resultados(itens, previos, {}),
+            }, 200, verify_cpu
+        return resposta[0], resposta[1], verify_cpu
+
+    db = get_db()
+    body, status = tx.executar(
+        db, lambda: _aplicar_lote(db, user_id, itens, validos, digests, previos, redemption_id, idempotency_key),
+        nome="redeem_batch")
+    return body, status, verify_cpu
+
+
+def _repeticao(db, user_id, itens, validos, digests, previos, idempotency_key, cur=None):
+    """
+    Resposta de um lote repetido (a chave idempotente já tem redenção), ou None se
+    não houver. Cada token recebe o resultado da primeira chamada: só é DUPLICATE
+    (aplicado) o token com item na redenção existente, ela APPLIED e pedida pelo
+    mesmo usuário; com ela PENDING, QUEUED. Os demais voltam com o motivo de
+    recusa pelo estado do token (inexistente, vencido ou resgatado/vinculado a
+    outra redenção) — inclusive para outro usuário que reapresente o mesmo lote,
+    que é duplo gasto. Tokens que o filtro de resgatados barrou entram na
+    consulta, pois podem ser justamente os aplicados na primeira chamada.
+    """
+    cursor_proprio = cur is None
+    cur = cur or db.cursor()
+    try:
+        cur.execute("SELECT redemption_id, status, requester_user FROM redemptions WHERE idempotency_key=%s;",
+                    (idempotency_key,))
+        existing = cur.fetchone()
+        if existing is None:
+            return None
+        redemption_id, estado = str(existing[0]), existing[1]
+        # outro usuário reapresentando o lote não vê a redenção como sua
+        if str(existing[2]) != str(user_id):
+            redemption_id, estado = None, None
+
+        filtrados = {posicao: str(uuid.UUID(str(_bruto(itens[posicao]))))
+                     for posicao, r in previos.items() if r == ALREADY_REDEEMED}
+        consultados = validos + list(filtrados.values())
+        cur.execute("""
+            SELECT v.token_id,
+                   CASE WHEN t.state = 'ISSUED' AND t.exp_at <= now() THEN 'EXPIRED' ELSE t.state::text END,
+                   ri.token_id IS NOT NULL
+            FROM unnest(%s::uuid[], %s::bytea[]) AS v(token_id, payload_sha256)
+            LEFT JOIN tokens t
+              ON t.token_id = v.token_id
+             AND (v.payload_sha256 IS NULL OR t.payload_sha256 = v.payload_sha256)
+            LEFT JOIN redemption_items ri ON ri.redemption_id = %s::uuid AND ri.token_id = v.token_id
+        """, (consultados, [digests.get(t) for t in consultados], redemption_id))
+        por_token = {}
+        for tid, state, na_redencao in cur.fetchall():
+            if na_redencao and estado == "APPLIED":
+                resultado = DUPLICATE
+            elif na_redencao and estado == "PENDING":
+                resultado = QUEUED
+            elif state is None:
+                resultado = NOT_FOUND
+            elif state == "EXPIRED":
+                resultado = EXPIRED
+            else:
+                resultado = ALREADY_REDEEMED
+            por_token[str(tid)] = resultado
+        db.rollback()
+
+        previos = {posicao: r for posicao, r in previos.items() if posicao not in filtrados}
+        status = {"APPLIED": "duplicate", "PENDING": "pending"}.get(estado, "rejected")
+        return {
+            "status": status,
+            "redemption_id": redemption_id,
+            "applied": 0,
+            "total_cents": 0,
+            "results": _resultados(itens, previos, por_token),
+        }, 202 if status == "pending" else 200
+    finally:
+        if cursor_proprio:
+            cur.close()
+
+
+def _aplicar_lote(db, user_id, itens, validos, digests, previos, redemption_id, idempotency_key):
+    """Corpo transacional do resgate em lote (pode ser reexecutado por tx.executar)."""
+    cur = db.cursor()
+    try:
+        requester_device = garantir_device(cur, user_id)
+
+        # cria redenção (idempotente pelo conjunto de tokens)
+        cur.execute("""
+            INSERT INTO redemptions (redemption_id, requester_user, requester_device, idempotency_key)
+            VALUES (%s, %s, %s, %s)
+            ON CONFLICT (idempotency_key) DO NOTHING
+        """, (redemption_id, user_id, requester_device, idempotency_key))
+
+        if cur.rowcount == 0:
+            # lote repetido: responde o que a primeira chamada respondeu
+            return _repeticao(db, user_id, itens, validos, digests, previos, idempotency_key, cur)
+
+        # lock de todos os tokens numa única ida ao banco, em ordem estável
+        # (tokens com hash divergente não casam no JOIN e nunca são travados)
+        cur.execute("""
+            SELECT t.token_id, t.denom_cents,
+                   CASE WHEN t.state = 'ISSUED' AND t.exp_at <= now() THEN 'EXPIRED' ELSE t.state::text END
+            FROM tokens t
+            JOIN unnest(%s::uuid[], %s::bytea[]) AS v(token_id, payload_sha256)
+              ON t.token_id = v.token_id
+             AND (v.payload_sha256 IS NULL OR t.payload_sha256 = v.payload_sha256)
+            ORDER BY t.token_id
+            FOR UPDATE OF t
+        """, (validos, [digests[t] for t in validos]))
+        encontrados = {str(tid): (denom, state) for tid, denom, state in cur.fetchall()}
+
+        por_token = {}
+        aplicar = []
+        ja_resgatados = []
+        total = 0
+        for tid in validos:
+            if tid not in encontrados:
+                por_token[tid] = NOT_FOUND
+            elif encontrados[tid][1] == "EXPIRED":
+                por_token[tid] = EXPIRED
+            elif encontrados[tid][1] != "ISSUED":
+                por_token[tid] = ALREADY_REDEEMED
+                if encontrados[tid][1] == "REDEEMED":
+                    ja_resgatados.append(tid)
+            else:
+                por_token[tid] = APPLIED
+                aplicar.append(tid)
+                total += encontrados[tid][0]
+
+        if aplicar:
+            # tokens já vinculados a outra redenção (ex.: pendente na fila) ficam de fora
+            cur.execute("""
+                INSERT INTO redemption_items (redemption_id, token_id)
+                SELECT %s, unnest(%s::uuid[])
+                ON CONFLICT DO NOTHING
+                RETURNING token_id
+            """, (redemption_id, aplicar))
+            inseridos = {str(r[0]) for r in cur.fetchall()}
+            for tid in aplicar:
+                if tid not in inseridos:
+                    por_token[tid] = ALREADY_REDEEMED
+                    total -= encontrados[tid][0]
+            aplicar = [tid for tid in aplicar if tid in inseridos]
+
+        if aplicar:
+            cur.execute("""
+                UPDATE tokens SET state='REDEEMED', owner_hint=%s
+                WHERE token_id = ANY(%s::uuid[])
+            """, (user_id, aplicar))
+
+            # contas (resolvidas via cache em memória)
+            issuer_account = accounts.get_issuer_account(cur)
+            receiver_account = accounts.get_user_wallet(cur, user_id)
+            if issuer_account is None or receiver_account is None:
+                db.rollback()
+                return {"error": "Conta de reserva ou carteira do usuário não encontrada"}, 404
+
+            # uma única partida dobrada com o valor agregado do lote
+            ledger.lancar_partida_dobrada(cur, issuer_account, receiver_account, total,
+                                          "Resgate de tokens em lote via API",
+                                          "Recebimento de tokens em lote via API")
+
+            cur.execute("UPDATE redemptions SET status='APPLIED' WHERE redemption_id=%s;", (redemption_id,))
+            db.commit()
+            metrics.TOKENS_REDEEMED.inc(len(aplicar), mode="batch")
+            redeemed_filter.registrar(aplicar)
+        else:
+            # nada a aplicar: não deixa redenção órfã
+            db.rollback()
+        redeemed_filter.registrar(ja_resgatados)
+
+        return {
+            "status": "success" if aplicar else "rejected",
+            "redemption_id": redemption_id if aplicar else None,
+            "applied": len(aplicar),
+            "total_cents": total,
+            "results": _resultados(itens, previos, por_token),
+        }, 200
+    finally:
+        cur.close()
@@ -0,0 +1,302 @@
+"""
+Resgate assíncrono: fila durável + worker com group commit.
+
+A fila é a própria tabela `redemptions` (status PENDING) com seus
+`redemption_items`. O endpoint só valida as provas, grava a redenção PENDING e
+responde 202; o worker drena várias redenções por transação (uma única partida
+dobrada agregada por grupo) e as marca APPLIED ou REJECTED.
+
+Uma redenção REJECTED (carteira inexistente, nenhum token ainda ISSUED) solta
+os tokens e também a chave idempotente, que é trocada por uma derivada do
+redemption_id: a chave de /redeem é determinística por token, então sem isso
+um token ainda ISSUED nunca mais poderia ser resgatado (ex.: o usuário cria a
+carteira e tenta de novo). A redenção rejeitada continua consultável.
+
+Worker dedicado:
+    python redeem_queue.py
+ou dentro do próprio serviço com REDEEM_WORKER_INLINE=1.
+"""
+import os
+import threading
+from collections import defaultdict
+
+import accounts
+import ledger
+import metrics
+import tx
+import redeemed_filter
+import token_verify
+from redeem_batch import (normalizar_itens, _resultados, garantir_device, new_uuid,
+                          NOT_FOUND, ALREADY_REDEEMED, EXPIRED, QUEUED)
+
+# prefixo da chave de uma redenção rejeitada (nunca colide com as chaves de 16 bytes)
+CHAVE_REJEITADA = b"rejected:"
+
+# Redenções aplicadas por transação do worker e espera quando a fila esvazia
+GROUP_SIZE = int(os.getenv("REDEEM_WORKER_GROUP", "200"))
+IDLE_INTERVAL = float(os.getenv("REDEEM_WORKER_IDLE", "0.5"))
+
+
+def corpo_redencao_existente(existing):
+    """
+    Outra requisição já criou a redenção com esta chave idempotente.
+    Retorna (corpo, status) conforme o estado dela, ou None se ainda puder prosseguir.
+    """
+    redemption_id, status = str(existing[0]), existing[1]
+    if status == "APPLIED":
+        return {"status": "duplicate", "message": "Redenção já aplicada", "redemption_id": redemption_id}, 200
+    if status == "PENDING":
+        return {"status": "pending", "message": "Redenção pendente na fila", "redemption_id": redemption_id,
+                "status_url": f"/redemptions/{redemption_id}"}, 202
+    if status == "REJECTED":
+        # só redenções rejeitadas antes da troca de chave (ver docstring do módulo)
+        return {"error": "Redenção rejeitada anteriormente", "redemption_id": redemption_id}, 409
+    return None
+
+
+def resposta_redencao_existente(db, existing):
+    """Como corpo_redencao_existente, desfazendo a transação quando há resposta."""
+    resposta = corpo_redencao_existente(existing)
+    if resposta is not None:
+        db.rollback()
+    return resposta
+
+
+# ===============================================================
+# Enfileiramento
+# ===============================================================
+def enfileirar(get_db, user_id, itens, idempotency_key):
+    """
+    Valida as provas (sem banco), grava a redenção PENDING com seus itens e
+    retorna (corpo, http_status, cpu_de_verificação_s).
+    """
+    itens = token_verify.expandir_lote(itens)
+    validos, digests, previos, verify_cpu = normalizar_itens(itens)
+    if not validos:
+        return {"status": "rejected", "redemption_id": None, "queued": 0,
+                "results": _resultados(itens, previos, {})}, 422, verify_cpu
+
+    db = get_db()
+    redemption_id = new_uuid()
+    body, status = tx.executar(
+        db, lambda: _enfileirar(db, user_id, itens, validos, digests, previos, redemption_id, idempotency_key),
+        nome="redeem_enqueue")
+    return body, status, verify_cpu
+
+
+def _enfileirar(db, user_id, itens, validos, digests, previos, redemption_id, idempotency_key):
+    cur = db.cursor()
+    try:
+        requester_device = garantir_device(cur, user_id)
+
+        cur.execute("""
+            INSERT INTO redemptions (redemption_id, requester_user, requester_device, idempotency_key, status)
+            VALUES (%s, %s, %s, %s, 'PENDING')
+            ON CONFLICT (idempotency_key) DO NOTHING
+        """, (redemption_id, user_id, requester_device, idempotency_key))
+        cur.execute("SELECT redemption_id, status FROM redemptions WHERE idempotency_key=%s;",
+                    (idempotency_key,))
+        existing = cur.fetchone()
+        if existing and str(existing[0]) != redemption_id:
+            return resposta_redencao_existente(db, existing)
+
+        # pré-checagem sem lock; o worker revalida tudo sob FOR UPDATE.
+        # Um token enfileirado a tempo é honrado mesmo se vencer na fila
+        # (o varredor de expiração não toca tokens com redemption_items).
+        cur.execute("""
+            SELECT t.token_id,
+                   CASE WHEN t.state = 'ISSUED' AND t.exp_at <= now() THEN 'EXPIRED' ELSE t.state::text END
+            FROM tokens t
+            JOIN unnest(%s::uuid[], %s::bytea[]) AS v(token_id, payload_sha256)
+              ON t.token_id = v.token_id
+             AND (v.payload_sha256 IS NULL OR t.payload_sha256 = v.payload_sha256)
+        """, (validos, [digests[t] for t in validos]))
+        estados = {str(tid): state for tid, state in cur.fetchall()}
+
+        por_token = {}
+        candidatos = []
+        for tid in validos:
+            if tid not in estados:
+                por_token[tid] = NOT_FOUND
+            elif estados[tid] == "EXPIRED":
+                por_token[tid] = EXPIRED
+            elif estados[tid] != "ISSUED":
+                por_token[tid] = ALREADY_REDEEMED
+            else:
+                candidatos.append(tid)
+
+        inseridos = set()
+        if candidatos:
+            cur.execute("""
+                INSERT INTO redemption_items (redemption_id, token_id)
+                SELECT %s, unnest(%s::uuid[])
+                ON CONFLICT DO NOTHING
+                RETURNING token_id
+            """, (redemption_id, candidatos))
+            inseridos = {str(r[0]) for r in cur.fetchall()}
+        for tid in candidatos:
+            por_token[tid] = QUEUED if tid in inseridos else ALREADY_REDEEMED
+
+        resultados = _resultados(itens, previos, por_token)
+        if not inseridos:
+            db.rollback()
+            return {"status": "rejected", "redemption_id": None, "queued": 0, "results": resultados}, 409
+
+        db.commit()
+        return {
+            "status": "queued",
+            "redemption_id": redemption_id,
+            "queued": len(inseridos),
+            "status_url": f"/redemptions/{redemption_id}",
+            "results": resultados,
+        }, 202
+    finally:
+        cur.close()
+
+
+# ===============================================================
+# Consulta
+# ===============================================================
+def consultar(cur, redemption_id):
+    cur.execute("""
+        SELECT r.status, r.requested_at, r.requester_user,
+               COALESCE(array_agg(t.token_id::text ORDER BY t.token_id) FILTER (WHERE t.token_id IS NOT NULL), '{}'),
+               COALESCE(SUM(t.denom_cents), 0)::bigint
+        FROM redemptions r
+        LEFT JOIN redemption_items ri ON ri.redemption_id = r.redemption_id
+        LEFT JOIN tokens t ON t.token_id = ri.token_id
+        WHERE r.redemption_id = %s
+        GROUP BY r.redemption_id
+    """, (redemption_id,))
+    row = cur.fetchone()
+    if row is None:
+        return None
+    status, requested_at, user_id, token_ids, total = row
+    return {
+        "redemption_id": redemption_id,
+        "status": status,
+        "requested_at": requested_at.isoformat(),
+        "user_id": str(user_id),
+        "token_ids": token_ids,
+        "total_cents": total,
+    }
+
+
+# ===============================================================
+# Worker (group commit)
+# ===============================================================
+def processar_fila(conn, limite=GROUP_SIZE):
+    """Aplica até `limite` redenções PENDING numa única transação. Retorna quantas processou."""
+    return tx.executar(conn, lambda: _processar_grupo(conn, limite), nome="redeem_worker")
+
+
+def _processar_grupo(conn, limite):
+    cur = conn.cursor()
+    try:
+        # SKIP LOCKED: vários workers drenam a fila sem se bloquear
+        cur.execute("""
+            SELECT redemption_id, requester_user FROM redemptions
+            WHERE status='PENDING'
+            ORDER BY requested_at
+            LIMIT %s
+            FOR UPDATE SKIP LOCKED
+        """, (limite,))
+        redencoes = {str(rid): str(user) for rid, user in cur.fetchall()}
+        if not redencoes:
+            conn.rollback()
+            return 0
+
+        cur.execute("""
+            SELECT ri.redemption_id, t.token_id, t.denom_cents, t.state
+            FROM redemption_items ri
+            JOIN tokens t ON t.token_id = ri.token_id
+            WHERE ri.redemption_id = ANY(%s::uuid[])
+            ORDER BY t.token_id
+            FOR UPDATE OF t
+        """, (list(redencoes),))
+        itens = defaultdict(list)
+        for rid, tid, denom, state in cur.fetchall():
+            itens[str(rid)].append((str(tid), denom, state))
+
+        issuer_account = accounts.get_issuer_account(cur)
+        status = {}
+        descartados = []
+        aplicados = []  # (token_id, user_id)
+        creditos = defaultdict(int)
+        for rid, user_id in redencoes.items():
+            wallet = accounts.get_user_wallet(cur, user_id)
+            validos = [(tid, denom) for tid, denom, state in itens[rid] if state == "ISSUED"]
+            descartados += [tid for tid, _, state in itens[rid] if state != "ISSUED"]
+            if not validos or wallet is None or issuer_account is None:
+                status[rid] = "REJECTED"
+                descartados += [tid for tid, _ in validos]
+                continue
+            status[rid] = "APPLIED"
+            aplicados += [(tid, user_id) for tid, _ in validos]
+            creditos[wallet] += sum(denom for _, denom in validos)
+
+        # itens não aplicados deixam de prender o token a esta redenção
+        if descartados:
+            cur.execute("DELETE FROM redemption_items WHERE token_id = ANY(%s::uuid[])", (descartados,))
+
+        if aplicados:
+            cur.execute("""
+                UPDATE tokens SET state='REDEEMED', owner_hint=v.user_id
+                FROM unnest(%s::uuid[], %s::uuid[]) AS v(token_id, user_id)
+                WHERE tokens.token_id = v.token_id
+            """, ([t for t, _ in aplicados], [u for _, u in aplicados]))
+
+            # uma única transação contábil para o grupo inteiro
+            total = sum(creditos.values())
+            ledger.lancar(cur, new_uuid(), [
+                (issuer_account, "DEBIT", total, "Resgate assíncrono em lote"),
+                *[(wallet, "CREDIT", valor, "Recebimento de resgate assíncrono")
+                  for wallet, valor in sorted(creditos.items())],
+            ])
+
+        cur.execute("""
+            UPDATE redemptions SET status=v.status,
+                idempotency_key = CASE WHEN v.status = 'REJECTED'
+                                       THEN %s::bytea || uuid_send(redemptions.redemption_id)
+                                       ELSE idempotency_key END
+            FROM unnest(%s::uuid[], %s::text[]) AS v(redemption_id, status)
+            WHERE redemptions.redemption_id = v.redemption_id
+        """, (CHAVE_REJEITADA, list(status), list(status.values())))
+        conn.commit()
+        metrics.TOKENS_REDEEMED.inc(len(aplicados), mode="async")
+        redeemed_filter.registrar([t for t, _ in aplicados])
+        return len(redencoes)
+    finally:
+        cur.close()
+
+
+def executar_worker(parar: threading.Event, limite=GROUP_SIZE, intervalo=IDLE_INTERVAL):
+    """Laço do worker: drena a fila e dorme quando ela esvazia."""
+    from db import pooled_connection
+
+    while not parar.is_set():
+        try:
+            with pooled_connection() as conn:
+                n = processar_fila(conn, limite)
+            if n:
+                print(f"📦 {n} redenção(ões) processada(s) pelo worker.")
+            if n < limite:
+                parar.wait(intervalo)
+        except Exception as e:
+            print(f"❌ Erro no worker de resgate: {e}")
+            parar.wait(intervalo)
+
+
+def iniciar_worker_em_thread():
+    parar = threading.Event()
+    t = threading.Thread(target=executar_worker, args=(parar,), name="redeem-worker", daemon=True)
+    t.start()
+    return parar
+
+
+if __name__ == "__main__":
+    print("🚚 Worker de resgate assíncrono iniciado.")
+    try:
+        executar_worker(threading.Event())
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,151 @@
+"""
+Conjunto em memória dos token_id já resgatados.
+
+Serve só para rejeitar cedo repetições CERTAS (replays, duplo gasto) com 409,
+sem nenhuma escrita ou lock no Postgres. Um token ausente do conjunto não diz
+nada: segue para o caminho autoritativo no banco. Por isso o conjunto só recebe
+IDs depois do COMMIT que os marcou como REDEEMED, e pode ser parcial (processo
+recém-iniciado, outro processo resgatou, limite de memória atingido).
+
+Memória: os IDs ficam numa tabela hash de endereçamento aberto num único
+bytearray, 16 bytes (o UUID) por posição, com no máximo 3/4 das posições
+ocupadas. A tabela é alocada uma vez para REDEEMED_FILTER_MAX IDs: com o padrão
+(1M) são 32 MiB por processo; cada worker mantém (e aquece) a sua. Um set de
+ints do Python custaria ~60-90 bytes por ID. Exato, sem falso positivo (um
+filtro de Bloom rejeitaria tokens nunca resgatados).
+"""
+import os
+import threading
+import uuid
+
+# Máximo de IDs mantidos; acima disso novos IDs não entram
+MAX_SIZE = int(os.getenv("REDEEMED_FILTER_MAX", "1000000"))
+ENABLED = os.getenv("REDEEMED_FILTER", "1") == "1"
+
+_TAM = 16
+_VAZIO = bytes(_TAM)  # UUID nulo: marca posição livre (nunca é um token_id)
+
+
+class RedeemedSet:
+    def __init__(self, max_size=MAX_SIZE):
+        self.max_size = max_size
+        posicoes = 1
+        while posicoes * 3 < max_size * 4:
+            posicoes *= 2
+        self._mascara = posicoes - 1
+        self._tabela = bytearray(posicoes * _TAM)
+        self._tamanho = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.warmed = False
+
+    @staticmethod
+    def _chave(token_id):
+        if isinstance(token_id, uuid.UUID):
+            return token_id.bytes
+        return uuid.UUID(str(token_id)).bytes
+
+    def _procurar(self, chave):
+        """Offset da chave ou da posição livre onde ela entraria; (offset, encontrada)."""
+        # token_id é aleatório: os primeiros bytes já servem de hash
+        i = int.from_bytes(chave[:8], "little") & self._mascara
+        while True:
+            o = i * _TAM
+            atual = self._tabela[o:o + _TAM]
+            if atual == chave:
+                return o, True
+            if atual == _VAZIO:
+                return o, False
+            i = (i + 1) & self._mascara
+
+    def contains(self, token_id):
+        try:
+            chave = self._chave(token_id)
+        except ValueError:
+            return False
+        if chave == _VAZIO:
+            return False
+        with self._lock:
+            if self._procurar(chave)[1]:
+                self.hits += 1
+                return True
+        return False
+
+    def add_many(self, token_ids):
+        chaves = [self._chave(t) for t in token_ids]
+        with self._lock:
+            for chave in chaves:
+                if self._tamanho >= self.max_size:
+                    break
+                if chave == _VAZIO:
+                    continue
+                o, encontrada = self._procurar(chave)
+                if not encontrada:
+                    self._tabela[o:o + _TAM] = chave
+                    self._tamanho += 1
+
+    def warm(self, conn):
+        """Carrega os REDEEMED existentes via cursor no servidor (memória do cliente limitada)."""
+        cur = conn.cursor(name="redeemed_filter_warm")
+        cur.itersize = 50_000
+        try:
+            cur.execute("SELECT token_id FROM tokens WHERE state='REDEEMED'")
+            lote = []
+            for (token_id,) in cur:
+                lote.append(token_id)
+                if len(lote) >= cur.itersize:
+                    self.add_many(lote)
+                    lote = []
+            self.add_many(lote)
+        finally:
+            cur.close()
+            conn.rollback()
+        self.warmed = True
+
+    async def warm_async(self, aconn):
+        """warm() para conexões assíncronas do psycopg 3 (async_app.py)."""
+        cur = aconn.cursor(name="redeemed_filter_warm")
+        try:
+            await cur.execute("SELECT token_id FROM tokens WHERE state='REDEEMED'")
+            while True:
+                lote = await cur.fetchmany(50_000)
+                if not lote:
+                    break
+                self.add_many([token_id for (token_id,) in lote])
+        finally:
+            await cur.close()
+            await aconn.rollback()
+        self.warmed = True
+
+    def stats(self):
+        with self._lock:
+            return {"enabled": ENABLED, "warmed": self.warmed, "size": self._tamanho,
+                    "max_size": self.max_size, "memory_bytes": len(self._tabela), "hits": self.hits}
+
+
+_filtro = RedeemedSet()
+
+
+def ja_resgatado(token_id):
+    """True apenas quando o token COM CERTEZA já foi resgatado."""
+    return ENABLED and _filtro.contains(token_id)
+
+
+def registrar(token_ids):
+    """Chamar somente após o COMMIT que marcou os tokens como REDEEMED."""
+    if ENABLED and token_ids:
+        _filtro.add_many(token_ids)
+
+
+def warm(conn):
+    if ENABLED:
+        _filtro.warm(conn)
+
+
+async def warm_async(aconn):
+    if ENABLED:
+        await _filtro.warm_async(aconn)
+
+
+def filter_stats():
+    return _filtro.stats()
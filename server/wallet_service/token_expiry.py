@@ -0,0 +1,145 @@
+"""
+Varredor de expiração: tokens ISSUED com exp_at vencido passam a EXPIRED.
+
+Cada lote é uma transação curta (READ COMMITTED, lock_timeout):
+  - trava até SWEEP_BATCH tokens vencidos, na ordem de exp_at, via
+    FOR UPDATE SKIP LOCKED sobre idx_tokens_state_exp (state, exp_at) — nunca
+    espera um resgate em andamento nem disputa linhas com outro varredor;
+  - tokens já presos a uma redenção (redemption_items, inclusive pendente na
+    fila assíncrona) ficam de fora: o pedido chegou a tempo e será honrado;
+  - tokens ainda no estoque pré-assinado, nunca entregues, saem de token_stock
+    e não geram lançamento;
+  - o valor dos demais sai da reserva de emissão para EXPIRY_BREAKAGE numa
+    única partida dobrada (o mesmo débito da reserva que um resgate faria).
+
+O conjunto ISSUED deixa de crescer sem limite, e os índices quentes com ele.
+
+Varredor dedicado:
+    python token_expiry.py
+ou dentro do serviço com TOKEN_EXPIRY_SWEEPER_INLINE=1.
+"""
+import os
+import threading
+
+import accounts
+import ledger
+import metrics
+
+SWEEP_BATCH = int(os.getenv("TOKEN_EXPIRY_BATCH", "1000"))
+SWEEP_INTERVAL = float(os.getenv("TOKEN_EXPIRY_INTERVAL", "60"))
+# Lotes por rodada: limita quanto o varredor ocupa o banco de uma vez
+SWEEP_MAX_BATCHES = int(os.getenv("TOKEN_EXPIRY_MAX_BATCHES", "100"))
+LOCK_TIMEOUT = os.getenv("TOKEN_EXPIRY_LOCK_TIMEOUT", "2s")
+
+_lock = threading.Lock()
+_stats = {"expired": 0, "expired_in_stock": 0, "breakage_cents": 0, "batches": 0}
+
+
+def _contar(**incrementos):
+    with _lock:
+        for chave, valor in incrementos.items():
+            _stats[chave] += valor
+
+
+def expirar_lote(conn, limite=SWEEP_BATCH):
+    """
+    Expira até `limite` tokens vencidos numa transação. Faz o próprio commit.
+    Retorna (tokens expirados, centavos lançados como breakage).
+    """
+    cur = conn.cursor()
+    try:
+        cur.execute("SET TRANSACTION ISOLATION LEVEL READ COMMITTED")
+        cur.execute("SET LOCAL lock_timeout = %s", (LOCK_TIMEOUT,))
+        cur.execute("""
+            WITH vencidos AS (
+                SELECT t.token_id FROM tokens t
+                WHERE t.state = 'ISSUED' AND t.exp_at <= now()
+                  AND NOT EXISTS (SELECT 1 FROM redemption_items ri WHERE ri.token_id = t.token_id)
+                ORDER BY t.exp_at
+                LIMIT %s
+                FOR UPDATE SKIP LOCKED
+            )
+            UPDATE tokens t SET state = 'EXPIRED'
+            FROM vencidos v
+            WHERE t.token_id = v.token_id
+            RETURNING t.token_id, t.denom_cents
+        """, (limite,))
+        expirados = {str(tid): denom for tid, denom in cur.fetchall()}
+        if not expirados:
+            conn.rollback()
+            return 0, 0
+
+        cur.execute("""
+            DELETE FROM token_stock
+            WHERE token_id = ANY(%s::uuid[]) AND claim_id IS NULL
+            RETURNING token_id
+        """, (list(expirados),))
+        no_estoque = {str(r[0]) for r in cur.fetchall()}
+        breakage = sum(d for tid, d in expirados.items() if tid not in no_estoque)
+
+        if breakage:
+            issuer_account = accounts.get_issuer_account(cur)
+            breakage_account = accounts.get_breakage_account(cur)
+            if issuer_account is None or breakage_account is None:
+                conn.rollback()
+                raise RuntimeError("Conta de reserva ou de breakage (EXPIRY_BREAKAGE) não encontrada")
+            ledger.lancar_partida_dobrada(cur, issuer_account, breakage_account, breakage,
+                                          "Expiração de tokens não resgatados",
+                                          "Breakage de tokens expirados")
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+
+    metrics.TOKENS_EXPIRED.inc(len(expirados))
+    _contar(expired=len(expirados), expired_in_stock=len(no_estoque), breakage_cents=breakage, batches=1)
+    return len(expirados), breakage
+
+
+def varrer(conn, limite=SWEEP_BATCH, max_lotes=SWEEP_MAX_BATCHES):
+    """Expira lotes até acabar o que venceu (ou `max_lotes`). Retorna (tokens, centavos)."""
+    total = centavos = 0
+    for _ in range(max_lotes):
+        n, valor = expirar_lote(conn, limite)
+        total += n
+        centavos += valor
+        if n < limite:
+            break
+    return total, centavos
+
+
+def expiry_stats():
+    with _lock:
+        return {"batch": SWEEP_BATCH, "interval_s": SWEEP_INTERVAL, **_stats}
+
+
+def executar_varredor(parar: threading.Event, intervalo=SWEEP_INTERVAL):
+    """Laço do varredor: uma rodada de lotes por intervalo."""
+    from db import pooled_connection
+
+    while not parar.is_set():
+        try:
+            with pooled_connection() as conn:
+                n, valor = varrer(conn)
+            if n:
+                print(f"⌛ {n} token(s) expirado(s); {valor / 100:.2f} lançado(s) como breakage.")
+        except Exception as e:
+            print(f"❌ Erro no varredor de expiração: {e}")
+        parar.wait(intervalo)
+
+
+def iniciar_varredor_em_thread():
+    parar = threading.Event()
+    t = threading.Thread(target=executar_varredor, args=(parar,), name="token-expiry-sweeper", daemon=True)
+    t.start()
+    return parar
+
+
+if __name__ == "__main__":
+    print("⌛ Varredor de expiração de tokens iniciado.")
+    try:
+        executar_varredor(threading.Event())
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,83 @@
+"""
+GET /tokens/<user_id>: parâmetros, SQL e cursor da paginação por keyset.
+
+Compartilhado pelo app síncrono (app.py) e pelo modo asyncio (async_app.py),
+para que as duas formas de servir tenham exatamente o mesmo contrato.
+"""
+import base64
+import uuid
+from datetime import datetime
+
+TOKEN_STATES = ("ISSUED", "REDEEMED", "REVOKED", "EXPIRED")
+LIST_DEFAULT_LIMIT = 100
+LIST_MAX_LIMIT = 1000
+
+
+def parametros(user_id, args):
+    """Valida user_id e ?limit/state/after; lança ValueError se algo for inválido."""
+    user_id = str(uuid.UUID(user_id))
+    limit = min(int(args.get("limit", LIST_DEFAULT_LIMIT)), LIST_MAX_LIMIT)
+    if limit <= 0:
+        raise ValueError("limit")
+    state = args.get("state")
+    if state is not None and state not in TOKEN_STATES:
+        raise ValueError("state")
+    after = args.get("after")
+    after_ts = after_id = None
+    if after:
+        after_ts, after_id = decodificar_cursor(after)
+    return {"user_id": user_id, "state": state, "after_ts": after_ts, "after_id": after_id, "limit": limit}
+
+
+def consulta(params):
+    """
+    Cada ramo do UNION ALL é uma varredura de faixa em idx_tokens_owner_issued,
+    então o custo é O(página) independente do tamanho da tabela. O ramo sem
+    dono pula o estoque pré-assinado ainda não reservado (token_stock.py), que
+    não pertence a ninguém; isso custa no máximo TOKEN_STOCK_HIGH sondas por
+    denominação.
+    """
+    filtros = ""
+    if params["state"] is not None:
+        filtros += " AND state = %(state)s"
+    if params["after_ts"] is not None:
+        filtros += " AND (issued_at, token_id) < (%(after_ts)s, %(after_id)s::uuid)"
+    return f"""
+        SELECT token_id, denom_cents, state, issued_at FROM (
+          (SELECT token_id, denom_cents, state, issued_at FROM tokens
+           WHERE owner_hint IS NULL{filtros}
+             AND NOT EXISTS (SELECT 1 FROM token_stock s
+                             WHERE s.token_id = tokens.token_id AND s.claim_id IS NULL)
+           ORDER BY issued_at DESC, token_id DESC LIMIT %(limit)s)
+          UNION ALL
+          (SELECT token_id, denom_cents, state, issued_at FROM tokens
+           WHERE owner_hint = %(user_id)s::uuid{filtros}
+           ORDER BY issued_at DESC, token_id DESC LIMIT %(limit)s)
+        ) t
+        ORDER BY issued_at DESC, token_id DESC
+        LIMIT %(limit)s
+    """
+
+
+def codificar_cursor(issued_at, token_id):
+    """
+    Cursor opaco: base64url sem padding de "<issued_at ISO>,<token_id>". Seguro
+    em query string sem escape (o "+" do fuso no ISO viraria espaço na URL).
+    """
+    return base64.urlsafe_b64encode(f"{issued_at.isoformat()},{token_id}".encode()).rstrip(b"=").decode()
+
+
+def decodificar_cursor(cursor):
+    """Inverso de codificar_cursor: (issued_at, token_id); ValueError se mal formado."""
+    bruto = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+    issued_at, token_id = bruto.rsplit(",", 1)
+    return datetime.fromisoformat(issued_at), str(uuid.UUID(token_id))
+
+
+def pagina(rows, limit):
+    """Retorna (tokens, cursor da próxima página ou None)."""
+    tokens = [{"token_id": str(tid), "denom": denom, "state": state} for tid, denom, state, _ in rows]
+    proximo = None
+    if len(rows) == limit:
+        proximo = codificar_cursor(rows[-1][3], rows[-1][0])
+    return tokens, proximo
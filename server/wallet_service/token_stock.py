@@ -0,0 +1,362 @@
+"""
+Estoque de tokens pré-assinados: /tokens/issue só entrega o que já está pronto.
+
+Reabastecedor (fora do caminho da requisição):
+  para cada denominação, quando os disponíveis caem abaixo de LOW_WATERMARK,
+  assina e grava (tokens + token_stock) até HIGH_WATERMARK, em blocos commitados.
+  Só um reabastecedor trabalha por vez, entre todos os processos/workers
+  (pg_try_advisory_lock); os demais pulam a rodada. Cada token do estoque é um
+  título ao portador já assinado: os níveis padrão são baixos de propósito, e
+  tokens não reservados não aparecem em GET /tokens (token_listing.py).
+
+Entrega (reservar_mix):
+  numa transação READ COMMITTED, marca, para cada denominação do mix (ver
+  denominations.py), até a quantidade pedida de linhas disponíveis com um
+  claim_id via FOR UPDATE SKIP LOCKED (emissões concorrentes nunca disputam as
+  mesmas linhas) e devolve payload + assinatura. Se o estoque não bastar, o que
+  falta é assinado na hora e gravado já reservado para o mesmo claim.
+
+Reservado e não entregue (resposta perdida, cliente caiu):
+  o claim_id vem do header Idempotency-Key; repetir a requisição com a mesma
+  chave devolve exatamente os mesmos tokens (e completa o que faltar), nunca
+  tokens novos. O pedido da primeira requisição fica em token_claims: a mesma
+  chave com outro mix é recusada (PedidoDivergente). Um token reservado nunca volta ao estoque nem vai para outro
+  claim. Claims mais antigos que CLAIM_RETENTION são expurgados (a assinatura
+  deixa de existir no servidor; o token segue ISSUED em `tokens`).
+  Com o estoque desligado, requisições com Idempotency-Key continuam passando
+  por reservar_mix (tudo assinado sob demanda), para que a retentativa da
+  carteira (simular/transport.py) nunca emita em dobro.
+
+Desligado por padrão (TOKEN_STOCK=1 liga). Reabastecedor dedicado:
+    python token_stock.py
+ou dentro do serviço com TOKEN_STOCK_REFILLER_INLINE=1.
+"""
+import base64
+import os
+import threading
+import uuid
+from datetime import datetime, timezone
+
+from psycopg2.extras import Json, execute_values
+
+import metrics
+from denominations import DENOMS as ISSUE_DENOMS, prefixo
+from issue_tokens import assinar_tokens, gravar_tokens, STREAM_CHUNK
+
+ENABLED = os.getenv("TOKEN_STOCK", "0") == "1"
+DENOMS = [int(d) for d in os.getenv("TOKEN_STOCK_DENOMS", ",".join(map(str, ISSUE_DENOMS))).split(",") if d.strip()]
+# Por denominação: com os padrões, no máximo ~R$ 33 mil em tokens assinados parados no banco
+LOW_WATERMARK = int(os.getenv("TOKEN_STOCK_LOW", "50"))
+HIGH_WATERMARK = int(os.getenv("TOKEN_STOCK_HIGH", "200"))
+REFILL_CHUNK = int(os.getenv("TOKEN_STOCK_CHUNK", "1000"))
+REFILL_INTERVAL = float(os.getenv("TOKEN_STOCK_INTERVAL", "1.0"))
+CLAIM_RETENTION = os.getenv("TOKEN_STOCK_CLAIM_RETENTION", "24 hours")
+# Tokens com menos validade que isso ficam no estoque até o varredor de expiração (token_expiry.py) retirá-los
+MIN_VALIDITY = os.getenv("TOKEN_STOCK_MIN_VALIDITY", "7 days")
+
+_NAMESPACE_CLAIM = uuid.uuid5(uuid.NAMESPACE_URL, "bluepay:tokens/issue")
+_LOCK_REABASTECEDOR = "bluepay:token_stock/refiller"
+
+
+def claim_id_de(idempotency_key):
+    """
+    claim_id determinístico para a chave do cliente (ou um novo, sem chave).
+    None quando a emissão não passa pelo estoque (desligado e sem chave).
+    """
+    if idempotency_key:
+        return str(uuid.uuid5(_NAMESPACE_CLAIM, idempotency_key))
+    if ENABLED:
+        return str(uuid.uuid4())
+    return None
+
+
+class PedidoDivergente(ValueError):
+    """Idempotency-Key já usada com outro mix."""
+
+
+def registrar_pedido(db, claim_id, mix):
+    """
+    Associa o mix ao claim na primeira requisição com a chave; nas seguintes,
+    lança PedidoDivergente se o mix for outro. Faz o próprio commit.
+    """
+    cur = db.cursor()
+    try:
+        cur.execute("""
+            INSERT INTO token_claims (claim_id, mix) VALUES (%s, %s)
+            ON CONFLICT (claim_id) DO NOTHING
+        """, (claim_id, Json({str(d): n for d, n in mix.items() if n})))
+        cur.execute("SELECT mix FROM token_claims WHERE claim_id=%s", (claim_id,))
+        registrado = {int(d): n for d, n in cur.fetchone()[0].items()}
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        cur.close()
+    if registrado != {d: n for d, n in mix.items() if n}:
+        raise PedidoDivergente("Idempotency-Key já usada com outro pedido de emissão")
+
+
+def _pacote(token_id, denom_cents, issued_at, exp_at, issuer_pubkey, signature, digest, merkle_proof):
+    """Mesmo formato devolvido por assinar_tokens()."""
+    pacote = {
+        "payload": {
+            "token_id": str(token_id),
+            "denom_cents": denom_cents,
+            "issuer_pubkey": issuer_pubkey,
+            "issued_at": issued_at,
+        },
+        "signature_b64": base64.b64encode(bytes(signature)).decode(),
+        "payload_sha256_b64": base64.b64encode(bytes(digest)).decode(),
+    }
+    if exp_at is not None:
+        pacote["payload"]["exp_at"] = exp_at
+    if merkle_proof is not None:
+        pacote["merkle_proof_b64"] = base64.b64encode(bytes(merkle_proof)).decode()
+    return pacote
+
+
+def _gravar_estoque(cur, emitidos, claim_id=None, pos_inicial=0):
+    claimed_at = datetime.now(timezone.utc) if claim_id else None
+    execute_values(cur, """
+        INSERT INTO token_stock (token_id, denom_cents, issued_at, exp_at, issuer_pubkey, signature,
+                                 payload_sha256, merkle_proof, claim_id, claim_pos, claimed_at)
+        VALUES %s
+    """, [
+        (t["payload"]["token_id"], t["payload"]["denom_cents"], t["payload"]["issued_at"],
+         t["payload"].get("exp_at"), t["payload"]["issuer_pubkey"], base64.b64decode(t["signature_b64"]),
+         base64.b64decode(t["payload_sha256_b64"]),
+         base64.b64decode(t["merkle_proof_b64"]) if "merkle_proof_b64" in t else None,
+         claim_id, pos_inicial + i if claim_id else None, claimed_at)
+        for i, t in enumerate(emitidos)
+    ], page_size=REFILL_CHUNK)
+
+
+# ===============================================================
+# Entrega
+# ===============================================================
+def reservar_mix(db, mix, claim_id, inicio=0):
+    """
+    Garante que o claim tenha os tokens de `mix` ({denominação: quantidade}) e
+    devolve os de posição `inicio` em diante, na ordem de entrega. Idempotente
+    por claim_id; faz o próprio commit.
+
+    O claim é sempre um prefixo da ordem de entrega do mix (claim_pos contínuo a
+    partir de 0), então o que já está reservado sai de max(claim_pos) pelo
+    índice, sem reler os tokens: no streaming cada bloco custa O(bloco).
+    """
+    cur = db.cursor()
+    try:
+        # fila com SKIP LOCKED: READ COMMITTED basta (exclusividade vem do lock de linha)
+        cur.execute("SET TRANSACTION ISOLATION LEVEL READ COMMITTED")
+        # requisições repetidas com a mesma chave não reservam em dobro
+        cur.execute("SELECT pg_advisory_xact_lock(hashtextextended(%s, 0))", (claim_id,))
+
+        cur.execute("SELECT COALESCE(max(claim_pos) + 1, 0) FROM token_stock WHERE claim_id=%s", (claim_id,))
+        pos = cur.fetchone()[0]
+        ja_reservados = prefixo(mix, pos)
+
+        do_estoque = sob_demanda = 0
+        for denom_cents, qtd in mix.items():
+            falta = qtd - ja_reservados.get(denom_cents, 0)
+            if falta <= 0:
+                continue
+
+            cur.execute("""
+                WITH livres AS (
+                    SELECT token_id FROM token_stock
+                    WHERE claim_id IS NULL AND denom_cents=%s
+                      AND (exp_at IS NULL OR exp_at::timestamptz > now() + %s::interval)
+                    ORDER BY created_at
+                    LIMIT %s
+                    FOR UPDATE SKIP LOCKED
+                ), ordenados AS (
+                    SELECT token_id, row_number() OVER (ORDER BY token_id) - 1 AS i FROM livres
+                )
+                UPDATE token_stock s
+                SET claim_id=%s, claim_pos=%s + o.i, claimed_at=now()
+                FROM ordenados o
+                WHERE s.token_id = o.token_id
+            """, (denom_cents, MIN_VALIDITY, falta, claim_id, pos))
+            reservados = cur.rowcount
+            pos += reservados
+            do_estoque += reservados
+            falta -= reservados
+
+            if falta > 0:
+                # estoque insuficiente: assina o resto na hora, já reservado para este claim
+                linhas, emitidos = assinar_tokens(falta, denom_cents)
+                gravar_tokens(cur, linhas)
+                _gravar_estoque(cur, emitidos, claim_id, pos)
+                pos += len(emitidos)
+                sob_demanda += len(emitidos)
+
+        # só a faixa pedida volta para a aplicação
+        cur.execute("""
+            SELECT token_id, denom_cents, issued_at, exp_at, issuer_pubkey, signature, payload_sha256, merkle_proof
+            FROM token_stock WHERE claim_id=%s AND claim_pos >= %s AND claim_pos < %s ORDER BY claim_pos
+        """, (claim_id, inicio, sum(mix.values())))
+        pacotes = [_pacote(*row) for row in cur.fetchall()]
+        db.commit()
+        if do_estoque or sob_demanda:
+            metrics.TOKENS_ISSUED.inc(do_estoque + sob_demanda)
+            _contar(claimed=do_estoque, signed_on_demand=sob_demanda)
+        return pacotes
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        cur.close()
+
+
+def reservar_tokens(db, qtd, claim_id, denom_cents=100):
+    """`qtd` tokens de uma única denominação (ver reservar_mix)."""
+    return reservar_mix(db, {denom_cents: qtd}, claim_id)
+
+
+def reservar_em_blocos(mix, db, claim_id, bloco=STREAM_CHUNK):
+    """
+    Versão incremental (NDJSON): cada bloco é reservado e commitado antes de ser
+    entregue, e só os tokens do bloco são lidos e devolvidos (memória constante).
+    """
+    total = sum(mix.values())
+    entregues = 0
+    while entregues < total:
+        fim = min(entregues + bloco, total)
+        yield reservar_mix(db, prefixo(mix, fim), claim_id, inicio=entregues)
+        entregues = fim
+
+
+# ===============================================================
+# Reabastecimento
+# ===============================================================
+_lock = threading.Lock()
+_stats = {"refilled": 0, "claimed": 0, "signed_on_demand": 0, "purged": 0}
+
+
+def _contar(**incrementos):
+    with _lock:
+        for chave, valor in incrementos.items():
+            _stats[chave] += valor
+
+
+def disponiveis(cur):
+    cur.execute("""
+        SELECT denom_cents, count(*) FROM token_stock
+        WHERE claim_id IS NULL AND (exp_at IS NULL OR exp_at::timestamptz > now() + %s::interval)
+        GROUP BY denom_cents
+    """, (MIN_VALIDITY,))
+    contagem = dict(cur.fetchall())
+    return {d: contagem.get(d, 0) for d in DENOMS}
+
+
+def reabastecer(conn, low=LOW_WATERMARK, high=HIGH_WATERMARK, bloco=REFILL_CHUNK):
+    """Completa até `high` as denominações abaixo de `low`. Retorna quantos tokens criou."""
+    cur = conn.cursor()
+    try:
+        niveis = disponiveis(cur)
+        conn.rollback()
+        criados = 0
+        for denom, atual in niveis.items():
+            if atual >= low:
+                continue
+            restantes = high - atual
+            while restantes > 0:
+                n = min(bloco, restantes)
+                linhas, emitidos = assinar_tokens(n, denom)
+                gravar_tokens(cur, linhas)
+                _gravar_estoque(cur, emitidos)
+                conn.commit()
+                restantes -= n
+                criados += n
+        _contar(refilled=criados)
+        return criados
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+
+
+def expurgar(conn, retencao=CLAIM_RETENTION):
+    """Remove claims antigos (a assinatura sai do servidor; o token continua ISSUED)."""
+    cur = conn.cursor()
+    try:
+        cur.execute("""
+            DELETE FROM token_stock
+            WHERE claim_id IS NOT NULL AND claimed_at < now() - %s::interval
+        """, (retencao,))
+        removidos = cur.rowcount
+        cur.execute("DELETE FROM token_claims WHERE created_at < now() - %s::interval", (retencao,))
+        conn.commit()
+        _contar(purged=removidos)
+        return removidos
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+
+
+def stock_stats(cur=None):
+    with _lock:
+        stats = {"enabled": ENABLED, "low": LOW_WATERMARK, "high": HIGH_WATERMARK, **_stats}
+    if cur is not None:
+        stats["available"] = disponiveis(cur)
+    return stats
+
+
+def rodada(conn):
+    """
+    Uma rodada de reabastecimento + expurgo, só se este processo conseguir o
+    advisory lock do reabastecedor. Retorna quantos tokens criou, ou None se
+    outro reabastecedor estiver ativo.
+    """
+    cur = conn.cursor()
+    try:
+        cur.execute("SELECT pg_try_advisory_lock(hashtextextended(%s, 0))", (_LOCK_REABASTECEDOR,))
+        lider = cur.fetchone()[0]
+        conn.rollback()
+        if not lider:
+            return None
+        try:
+            # desligado, o estoque só guarda claims de Idempotency-Key: apenas expurga
+            criados = reabastecer(conn) if ENABLED else 0
+            expurgar(conn)
+            return criados
+        finally:
+            # lock de sessão: liberado antes de a conexão voltar ao pool
+            cur.execute("SELECT pg_advisory_unlock(hashtextextended(%s, 0))", (_LOCK_REABASTECEDOR,))
+            conn.rollback()
+    finally:
+        cur.close()
+
+
+def executar_reabastecedor(parar: threading.Event, intervalo=REFILL_INTERVAL):
+    """Laço do reabastecedor: mantém os níveis e expurga claims antigos."""
+    from db import pooled_connection
+
+    while not parar.is_set():
+        try:
+            with pooled_connection() as conn:
+                criados = rodada(conn)
+            if criados:
+                print(f"🏭 {criados} token(s) pré-assinado(s) no estoque.")
+        except Exception as e:
+            print(f"❌ Erro no reabastecedor de tokens: {e}")
+        parar.wait(intervalo)
+
+
+def iniciar_reabastecedor_em_thread():
+    parar = threading.Event()
+    t = threading.Thread(target=executar_reabastecedor, args=(parar,), name="token-stock-refiller", daemon=True)
+    t.start()
+    return parar
+
+
+if __name__ == "__main__":
+    print("🏭 Reabastecedor de tokens pré-assinados iniciado.")
+    try:
+        executar_reabastecedor(threading.Event())
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,193 @@
+"""
+Verificação da prova criptográfica dos tokens no resgate.
+
+Tudo aqui roda ANTES de tocar no Postgres: assinatura Ed25519 inválida, emissor
+desconhecido ou payload incoerente são rejeitados sem nenhuma escrita ou lock.
+O hash retornado é comparado com tokens.payload_sha256 na própria consulta de
+lock (tokens cujo hash não bate nunca chegam a ser travados).
+
+Tokens emitidos com ISSUE_SIGNING=merkle trazem token_merkle_proof_b64: a
+assinatura é da raiz do lote e vale para todos os tokens dele, então só o
+primeiro token de cada lote paga a verificação Ed25519 (merkle.raiz_assinada).
+
+Token com exp_at (assinado) vencido é recusado antes até da assinatura: é o
+teste mais barato, e um exp_at adulterado derrubaria a assinatura de qualquer forma.
+"""
+import base64
+import os
+import threading
+import time
+from datetime import datetime, timezone
+from functools import lru_cache
+
+from nacl.exceptions import BadSignatureError
+from nacl.signing import VerifyKey
+
+import merkle
+import token_wire
+from issue_tokens import canonical_bytes, sha256, SERVER_PK_B64
+
+# Exige token_payload + token_signature_b64 em todo resgate (padrão: sim)
+REQUIRE_PROOF = os.getenv("REDEEM_REQUIRE_PROOF", "1") == "1"
+
+# Emissores aceitos: a chave do próprio servidor + extras separados por vírgula
+TRUSTED_ISSUERS = {k.strip() for k in [SERVER_PK_B64, *os.getenv("TRUSTED_ISSUER_PKS", "").split(",")] if k and k.strip()}
+
+PAYLOAD_FIELDS = ("token_id", "denom_cents", "issuer_pubkey", "issued_at")
+
+# key id do formato binário -> chave do emissor
+WIRE_KEYS = token_wire.indice_de_chaves(TRUSTED_ISSUERS)
+
+
+class TokenInvalido(Exception):
+    """Prova criptográfica ausente ou inválida."""
+
+
+class TokenExpirado(TokenInvalido):
+    """exp_at do payload já passou."""
+
+
+def expirado(payload, agora=None) -> bool:
+    """True se o payload traz exp_at e ele já passou (sem exp_at, o token não expira)."""
+    exp_at = payload.get("exp_at") if isinstance(payload, dict) else None
+    if not exp_at:
+        return False
+    try:
+        vencimento = datetime.fromisoformat(exp_at[:-1] if exp_at.endswith("Z") else exp_at)
+    except (TypeError, ValueError, AttributeError):
+        raise TokenInvalido("exp_at mal formado")
+    if vencimento.tzinfo is not None:
+        vencimento = vencimento.astimezone(timezone.utc).replace(tzinfo=None)
+    return vencimento <= (agora or datetime.utcnow())
+
+
+@lru_cache(maxsize=64)
+def get_verify_key(pubkey_b64: str) -> VerifyKey:
+    """Um VerifyKey por chave de emissor, construído uma única vez."""
+    return VerifyKey(base64.b64decode(pubkey_b64))
+
+
+_lock = threading.Lock()
+_stats = {"verified": 0, "rejected": 0, "cpu_s_total": 0.0}
+
+
+def _verificar(token_id, payload, signature_b64, merkle_proof_b64=None):
+    if not isinstance(payload, dict) or any(f not in payload for f in PAYLOAD_FIELDS):
+        raise TokenInvalido("token_payload incompleto")
+    if str(payload["token_id"]) != str(token_id):
+        raise TokenInvalido("token_id não confere com o payload")
+    if payload["issuer_pubkey"] not in TRUSTED_ISSUERS:
+        raise TokenInvalido("Emissor desconhecido")
+    if expirado(payload):
+        raise TokenExpirado("Token expirado")
+    try:
+        signature = base64.b64decode(signature_b64, validate=True)
+    except (TypeError, ValueError):
+        raise TokenInvalido("Assinatura mal formada")
+    if len(signature) != 64:
+        raise TokenInvalido("Assinatura mal formada")
+
+    pb = canonical_bytes(payload)
+    if merkle_proof_b64:
+        try:
+            prova = base64.b64decode(merkle_proof_b64, validate=True)
+            valido = merkle.verificar(pb, prova, signature, payload["issuer_pubkey"])
+        except (TypeError, ValueError):
+            raise TokenInvalido("Prova de Merkle mal formada")
+        if not valido:
+            raise TokenInvalido("Assinatura inválida")
+        return sha256(pb)
+    try:
+        get_verify_key(payload["issuer_pubkey"]).verify(pb, signature)
+    except BadSignatureError:
+        raise TokenInvalido("Assinatura inválida")
+    return sha256(pb)
+
+
+def expandir_binario(item):
+    """
+    Aceita o token no formato binário (token_wire.py, base64 em "token_b64") no
+    lugar de token_id + token_payload + token_signature_b64; devolve o item no
+    formato JSON. Lança TokenInvalido se os bytes não formam um token.
+    """
+    if not isinstance(item, dict) or not item.get("token_b64"):
+        return item
+    try:
+        dados = base64.b64decode(item["token_b64"], validate=True)
+        token, fim = token_wire.decodificar(dados, WIRE_KEYS)
+    except (TypeError, ValueError) as e:
+        raise TokenInvalido(f"token_b64 inválido: {e}")
+    if fim != len(dados):
+        raise TokenInvalido("token_b64 inválido: bytes após o token")
+    item = {k: v for k, v in item.items() if k != "token_b64"}
+    item.update(token_id=token["payload"]["token_id"], token_payload=token["payload"],
+                token_signature_b64=token["signature_b64"], token_merkle_proof_b64=token.get("merkle_proof_b64"))
+    return item
+
+
+def expandir_lote(itens):
+    """expandir_binario() item a item; itens ilegíveis viram {"token_id": None, "token_error": ...}."""
+    expandidos = []
+    for item in itens:
+        try:
+            expandidos.append(expandir_binario(item))
+        except TokenInvalido as e:
+            expandidos.append({"token_id": None, "token_error": str(e)})
+    return expandidos
+
+
+def verificar_lote(itens):
+    """
+    Verifica uma lista de (token_id, payload, signature_b64, merkle_proof_b64 ou
+    None) numa única passada, reaproveitando o VerifyKey em cache de cada emissor
+    e as raízes de Merkle já verificadas.
+    Itens sem prova retornam digest None quando a prova não é obrigatória.
+
+    Retorna (digests, erros, cpu_s): digests[i] é o sha256 do payload canônico
+    do item i; erros[i] é a mensagem de rejeição.
+    """
+    inicio = time.thread_time()
+    digests = {}
+    erros = {}
+    for i, (token_id, payload, signature_b64, merkle_proof_b64) in enumerate(itens):
+        if payload is None and signature_b64 is None and not REQUIRE_PROOF:
+            digests[i] = None
+            continue
+        try:
+            digests[i] = _verificar(token_id, payload, signature_b64, merkle_proof_b64)
+        except TokenInvalido as e:
+            erros[i] = str(e)
+        except Exception:
+            erros[i] = "Prova do token inválida"
+    cpu = time.thread_time() - inicio
+
+    with _lock:
+        _stats["verified"] += len(digests)
+        _stats["rejected"] += len(erros)
+        _stats["cpu_s_total"] += cpu
+    return digests, erros, cpu
+
+
+def verificar_token(token_id, payload, signature_b64, merkle_proof_b64=None):
+    """Verifica um único token; retorna (digest, cpu_s) ou lança TokenInvalido (TokenExpirado se vencido)."""
+    if expirado(payload):
+        raise TokenExpirado("Token expirado")
+    digests, erros, cpu = verificar_lote([(token_id, payload, signature_b64, merkle_proof_b64)])
+    if erros:
+        raise TokenInvalido(erros[0])
+    return digests[0], cpu
+
+
+def verify_stats():
+    with _lock:
+        total = _stats["verified"] + _stats["rejected"]
+        return {
+            **_stats,
+            "cpu_us_per_token": round(_stats["cpu_s_total"] * 1e6 / total, 1) if total else 0.0,
+            "merkle_roots": merkle.raiz_assinada.cache_info()._asdict(),
+        }
+
+
+def server_timing(cpu_s):
+    """Valor do header Server-Timing com o custo de CPU da verificação."""
+    return f"verify;desc=\"ed25519+sha256 cpu\";dur={cpu_s * 1000:.3f}"
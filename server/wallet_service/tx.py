@@ -0,0 +1,152 @@
+"""
+Execução de transações SERIALIZABLE com retentativa automática.
+
+Só falhas que o Postgres garante serem seguras de repetir são retentadas:
+  40001 serialization_failure
+  40P01 deadlock_detected
+O corpo da transação é reexecutado do zero (com o mesmo redemption_id /
+idempotency_key, que são gerados fora dele), com backoff exponencial com
+jitter e um orçamento global de retentativas para não amplificar contenção.
+"""
+import asyncio
+import os
+import random
+import threading
+import time
+from collections import defaultdict
+
+import psycopg2
+
+RETRYABLE_SQLSTATES = {"40001": "serialization_failures", "40P01": "deadlocks"}
+
+MAX_ATTEMPTS = int(os.getenv("TX_MAX_ATTEMPTS", "8"))
+BACKOFF_BASE = float(os.getenv("TX_BACKOFF_BASE", "0.005"))
+BACKOFF_MAX = float(os.getenv("TX_BACKOFF_MAX", "0.2"))
+# Cada transação deposita RETRY_BUDGET_RATIO fichas; cada retentativa gasta uma.
+RETRY_BUDGET_RATIO = float(os.getenv("TX_RETRY_BUDGET_RATIO", "1.0"))
+RETRY_BUDGET_MAX = float(os.getenv("TX_RETRY_BUDGET_MAX", "100"))
+
+
+class RetryBudget:
+    """Limita retentativas a uma fração das transações (token bucket)."""
+
+    def __init__(self, ratio=RETRY_BUDGET_RATIO, maximo=RETRY_BUDGET_MAX):
+        self.ratio = ratio
+        self.maximo = maximo
+        self._fichas = maximo
+        self._lock = threading.Lock()
+
+    def depositar(self):
+        with self._lock:
+            self._fichas = min(self.maximo, self._fichas + self.ratio)
+
+    def retirar(self):
+        with self._lock:
+            if self._fichas >= 1:
+                self._fichas -= 1
+                return True
+            return False
+
+    def saldo(self):
+        with self._lock:
+            return self._fichas
+
+
+class TransacaoEsgotada(Exception):
+    """Falha retentável que esgotou tentativas ou orçamento."""
+
+    def __init__(self, erro, tentativas):
+        super().__init__(f"{_sqlstate(erro)} após {tentativas} tentativa(s): {erro}")
+        self.erro = erro
+        self.tentativas = tentativas
+
+
+def _sqlstate(erro):
+    """SQLSTATE do erro em psycopg2 (pgcode) ou psycopg 3 (sqlstate)."""
+    return getattr(erro, "pgcode", None) or getattr(erro, "sqlstate", None)
+
+
+_budget = RetryBudget()
+_lock = threading.Lock()
+_stats = defaultdict(lambda: defaultdict(int))
+
+
+def _contar(nome, **incrementos):
+    with _lock:
+        for chave, valor in incrementos.items():
+            _stats[nome][chave] += valor
+
+
+def backoff(tentativa):
+    """Full jitter: uniforme em [0, min(max, base * 2^(n-1))]."""
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * (2 ** (tentativa - 1))))
+
+
+def executar(db, corpo, nome="tx", max_attempts=None):
+    """
+    Executa `corpo()` (que faz seus próprios commit/rollback) retentando apenas
+    SQLSTATEs retentáveis. Outras exceções sobem intactas.
+    """
+    max_attempts = max_attempts or MAX_ATTEMPTS
+    _budget.depositar()
+    tentativa = 0
+    while True:
+        tentativa += 1
+        _contar(nome, attempts=1)
+        try:
+            resultado = corpo()
+            _contar(nome, transactions=1)
+            return resultado
+        except psycopg2.Error as e:
+            db.rollback()
+            motivo = RETRYABLE_SQLSTATES.get(e.pgcode)
+            if motivo is None:
+                raise
+            _contar(nome, **{motivo: 1})
+            if tentativa >= max_attempts:
+                _contar(nome, giveups=1, transactions=1)
+                raise TransacaoEsgotada(e, tentativa)
+            if not _budget.retirar():
+                _contar(nome, budget_exhausted=1, giveups=1, transactions=1)
+                raise TransacaoEsgotada(e, tentativa)
+            _contar(nome, retries=1)
+            time.sleep(backoff(tentativa))
+
+
+async def executar_async(db, corpo, nome="tx", max_attempts=None):
+    """
+    executar() para conexões assíncronas do psycopg 3 (async_app.py): mesma
+    política de retentativa, backoff e orçamento, sem bloquear o event loop.
+    """
+    import psycopg
+
+    max_attempts = max_attempts or MAX_ATTEMPTS
+    _budget.depositar()
+    tentativa = 0
+    while True:
+        tentativa += 1
+        _contar(nome, attempts=1)
+        try:
+            resultado = await corpo()
+            _contar(nome, transactions=1)
+            return resultado
+        except psycopg.Error as e:
+            await db.rollback()
+            motivo = RETRYABLE_SQLSTATES.get(e.sqlstate)
+            if motivo is None:
+                raise
+            _contar(nome, **{motivo: 1})
+            if tentativa >= max_attempts:
+                _contar(nome, giveups=1, transactions=1)
+                raise TransacaoEsgotada(e, tentativa)
+            if not _budget.retirar():
+                _contar(nome, budget_exhausted=1, giveups=1, transactions=1)
+                raise TransacaoEsgotada(e, tentativa)
+            _contar(nome, retries=1)
+            await asyncio.sleep(backoff(tentativa))
+
+
+def tx_stats():
+    with _lock:
+        por_nome = {nome: dict(c) for nome, c in _stats.items()}
+    return {"retry_budget": round(_budget.saldo(), 2), "by_name": por_nome}
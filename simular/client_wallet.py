@@ -1,46 +1,76 @@
 # client_wallet.py
 import requests
-import sqlite3
 import json
 import os
 import uuid # Necessário para a função canonical_bytes (se estiver usando)
+import time
+from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from nacl.signing import SigningKey, VerifyKey
 from nacl.encoding import Base64Encoder
 from nacl.secret import SecretBox
 from nacl.utils import random
 
-if os.path.exists("wallet.db"):
-    os.remove("wallet.db")  # Remove DB antigo para começar do zero (apenas para demonstração)
+import merkle
+import token_wire
+from transport import Transport
+from wallet_store import WalletStore, SaldoInsuficiente, AVAILABLE, PENDING, REDEEMED, TRANSFERRED
+
+for _db in ("wallet.db", "wallet_client2.db"):
+    for _arquivo in (_db, f"{_db}-wal", f"{_db}-shm"):
+        if os.path.exists(_arquivo):
+            os.remove(_arquivo)  # Remove DB antigo (e o WAL) para começar do zero (apenas para demonstração)
 
 
 # --- CHAVE PÚBLICA DO SERVIDOR (PARA FINS DIDÁTICOS) ---
 # Substitua pelo valor real da sua chave pública do servidor.
 # O cliente usa esta chave para verificar a autenticidade dos tokens.
 SERVER_PK_B64 = "tIv5wPAmF2uiuDwqWKdWXGdbFRtG2d4I0sYUs8IlvfA=" 
+# Emissores conhecidos pelo key id do formato binário (token_wire)
+WIRE_KEYS = token_wire.indice_de_chaves([SERVER_PK_B64])
 
 # --- 1. CONFIGURAÇÕES GLOBAIS ---
 FLASK_HOST = "http://localhost:5000"
+# Session keep-alive, timeouts por endpoint, retentativas seguras e gzip (transport.py)
+HTTP = Transport(FLASK_HOST)
 ISSUE_ENDPOINT = "/tokens/issue"
 REDEEM_ENDPOINT = "/redeem"
-QTD_TOKENS = 1
+REDEEM_BATCH_ENDPOINT = "/redeem/batch"
+REDEMPTION_ENDPOINT = "/redemptions/{}"
+QTD_TOKENS = 10
+ISSUE_AMOUNT_CENTS = 4000
+PAYMENT_CENTS = 3700
 WALLET_DB = "wallet.db"
+CLIENT2_WALLET_DB = "wallet_client2.db"
+# Outbox de resgates: tokens por lote enviado a /redeem/batch (servidor aceita até REDEEM_BATCH_MAX)
+OUTBOX_BATCH = int(os.getenv("WALLET_OUTBOX_BATCH", "200"))
+# Recebimento em massa: tokens por bloco de verificação e threads de verificação (0 = sem pool)
+INGEST_CHUNK = 1000
+INGEST_WORKERS = int(os.getenv("WALLET_INGEST_WORKERS", "0"))
 
 # --- FUNÇÕES DE CRIPTOGRAFIA AUXILIARES (IDÊNTICAS AO BACKEND) ---
 
 def canonical_bytes(payload: dict) -> bytes:
     """Serialização canônica estável e determinística (DEVE ser idêntica ao servidor)"""
+    exp_at = f'"exp_at":"{payload["exp_at"]}",' if payload.get("exp_at") else ""
     s = (
         f'{{"denom_cents":{payload["denom_cents"]},'
+        f'{exp_at}'
         f'"issued_at":"{payload["issued_at"]}",'
         f'"issuer_pubkey":"{payload["issuer_pubkey"]}",'
         f'"token_id":"{payload["token_id"]}"}}'
     )
     return s.encode("utf-8")
 
+@lru_cache(maxsize=8)
+def _verify_key(pk_b64: str) -> VerifyKey:
+    return VerifyKey(pk_b64, encoder=Base64Encoder)
+
 def verify_signature(payload_bytes: bytes, signature_b64: str, pk_b64: str) -> bool:
     """Verifica a assinatura usando a chave pública do emissor."""
     try:
-        vk = VerifyKey(pk_b64, encoder=Base64Encoder)
+        vk = _verify_key(pk_b64)
         signature = Base64Encoder.decode(signature_b64)
         vk.verify(payload_bytes, signature)
         return True
@@ -74,7 +104,7 @@ CLIENT2_DEVICE_ID = "bbbbbbb2-bbbb-bbbb-bbbb-bbbbbbbbbbbb"
 
 
 # --- 3. FUNÇÕES DE BANCO DE DADOS (CARTEIRA) ---
-# (As funções setup_db, store_token, get_first_available_token e mark_token_redeemed permanecem as mesmas)
+# Carteira em wallet_store.py: uma conexão por processo, WAL, migrações versionadas e saldo O(1)
 
 NEW_USER_ENDPOINT = "/new_user"
 
@@ -88,7 +118,7 @@ def ensure_user_exists(user_id: str, kyc_level: str = "basic", status: str = "ac
 
     try:
         print(f"👤 Verificando/criando usuário {user_id} no backend...")
-        response = requests.post(f"{FLASK_HOST}{NEW_USER_ENDPOINT}", json=payload)
+        response = HTTP.post(NEW_USER_ENDPOINT, json=payload)
         if response.status_code in (200, 201):
             print(f"✅ Usuário {user_id} disponível no servidor.")
         elif response.status_code == 409:
@@ -111,7 +141,7 @@ def ensure_device_exists(user_id: str, device_id: str, pubkey_b64: str):
 
     try:
         print(f"📱 Verificando/criando device {device_id} para user {user_id}...")
-        response = requests.post(f"{FLASK_HOST}{NEW_DEVICE_ENDPOINT}", json=payload)
+        response = HTTP.post(NEW_DEVICE_ENDPOINT, json=payload)
         if response.status_code in (200, 201):
             print(f"✅ Device {device_id} registrado no backend.")
         else:
@@ -119,93 +149,134 @@ def ensure_device_exists(user_id: str, device_id: str, pubkey_b64: str):
     except requests.exceptions.RequestException as e:
         print(f"❌ Falha ao criar device: {e}")
 
-def setup_db(db_name):
-    """Cria/abre a carteira SQLite e garante colunas necessárias."""
-
-    conn = sqlite3.connect(db_name)
-    cursor = conn.cursor()
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS tokens (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            token_id TEXT NOT NULL UNIQUE,
-            token_data_json TEXT NOT NULL,
-            status TEXT NOT NULL DEFAULT 'AVAILABLE'
-        )
-    """)
-    # --- MIGRAÇÃO: adicionar coluna transferred se não existir ---
-    cursor.execute("PRAGMA table_info(tokens)")
-    cols = [row[1] for row in cursor.fetchall()]
-    if "transferred" not in cols:
-        cursor.execute("ALTER TABLE tokens ADD COLUMN transferred INTEGER NOT NULL DEFAULT 0")
-        conn.commit()
-    return conn, cursor
-
-
-def store_token(conn, cursor, token_id, token_data):
-    """Armazena o token completo como JSON na carteira."""
-    try:
-        cursor.execute("""
-            INSERT INTO tokens (token_id, token_data_json)
-            VALUES (?, ?)
-        """, (token_id, json.dumps(token_data)))
-        conn.commit()
-        return True
-    except sqlite3.IntegrityError:
-        print(f"⚠️ Token ID {token_id} já existe na carteira. Ignorando.")
-        return False
+_stores = {}
+
+def get_store(db_name: str = WALLET_DB) -> WalletStore:
+    """Abre cada carteira uma única vez por processo (as migrações rodam só nessa abertura)."""
+    if db_name not in _stores:
+        _stores[db_name] = WalletStore(db_name, WIRE_KEYS)
+    return _stores[db_name]
+
+def mark_tokens_redeemed(store, token_ids):
+    """Marca os tokens como RESGATADOS após o sucesso do servidor (uma transação)."""
+    store.marcar_varios(token_ids, REDEEMED)
+    print(f"   -> {len(token_ids)} token(s) marcado(s) como REDEEMED na carteira local.")
 
-def get_first_available_token(cursor):
-    """Pega o primeiro token disponível e ainda não transferido; marca como PENDING."""
-    cursor.execute("""
-        SELECT token_id, token_data_json
-        FROM tokens
-        WHERE status='AVAILABLE' AND transferred=0
-        LIMIT 1
-    """)
-    row = cursor.fetchone()
-    if row:
-        token_id, token_data_json = row
-        token_data = json.loads(token_data_json)
-        cursor.execute("UPDATE tokens SET status='PENDING' WHERE token_id=?", (token_id,))
-        return token_id, token_data
-    return None, None
-
-def mark_token_redeemed(conn, cursor, token_id):
-    """Marca o token como RESGATADO após o sucesso do servidor."""
-    cursor.execute("UPDATE tokens SET status='REDEEMED' WHERE token_id=?", (token_id,))
-    conn.commit()
-    print(f"   -> Token {token_id[:8]}... marcado como REDEEMED na carteira local.")
+
+def _instante_utc(iso: str) -> datetime:
+    """
+    exp_at do emissor ("...Z", isoformat() omite a fração quando os microssegundos
+    são 0) como datetime UTC ingênuo: comparar as strings erra na virada do segundo.
+    """
+    instante = datetime.fromisoformat(iso[:-1] if iso.endswith("Z") else iso)
+    if instante.tzinfo is not None:
+        instante = instante.astimezone(timezone.utc).replace(tzinfo=None)
+    return instante
+
+def _verify_chunk(tokens: list):
+    """
+    Verifica um bloco de tokens com a chave do emissor decodificada uma única vez.
+    Tokens com prova de Merkle: uma verificação Ed25519 por raiz (em cache), o resto são hashes.
+    """
+    vk = _verify_key(SERVER_PK_B64)
+    agora = datetime.utcnow()
+    aceitos, rejeitados = [], []
+    for token_data in tokens:
+        try:
+            payload = token_data['payload']
+            if payload['issuer_pubkey'] != SERVER_PK_B64:
+                raise ValueError("emissor desconhecido")
+            if payload.get('exp_at') and _instante_utc(payload['exp_at']) <= agora:
+                raise ValueError("token expirado")
+            assinatura = Base64Encoder.decode(token_data['signature_b64'])
+            if token_data.get('merkle_proof_b64'):
+                prova = Base64Encoder.decode(token_data['merkle_proof_b64'])
+                if not merkle.verificar(canonical_bytes(payload), prova, assinatura, SERVER_PK_B64):
+                    raise ValueError("assinatura da raiz de Merkle inválida")
+            else:
+                vk.verify(canonical_bytes(payload), assinatura)
+            aceitos.append(token_data)
+        except (KeyError, TypeError, AttributeError):
+            rejeitados.append({"token_id": None, "motivo": "token mal formado"})
+        except Exception as e:
+            rejeitados.append({"token_id": token_data['payload'].get('token_id'), "motivo": str(e) or type(e).__name__})
+    return aceitos, rejeitados
+
+def ingest_tokens(store: WalletStore, tokens: list, workers: int = INGEST_WORKERS, chunk: int = INGEST_CHUNK,
+                  resgatar: bool = False):
+    """
+    Recebimento em massa: verifica todos os tokens (em blocos, opcionalmente num
+    pool de threads — a verificação Ed25519 da libsodium roda fora do GIL) e grava
+    os aceitos na carteira numa ÚNICA transação (com `resgatar`, já no outbox).
+    Retorna (aceitos, relatório).
+    """
+    inicio = time.perf_counter()
+    blocos = [tokens[i:i + chunk] for i in range(0, len(tokens), chunk)]
+    if workers > 1 and len(blocos) > 1:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            resultados = list(pool.map(_verify_chunk, blocos))
+    else:
+        resultados = [_verify_chunk(bloco) for bloco in blocos]
+    aceitos = [t for bloco, _ in resultados for t in bloco]
+    rejeitados = [r for _, bloco in resultados for r in bloco]
+    verificado = time.perf_counter()
+
+    novos = store.adicionar(aceitos, resgatar=resgatar) if aceitos else 0
+    fim = time.perf_counter()
+    return aceitos, {
+        "received": len(tokens),
+        "accepted": len(aceitos),
+        "stored": novos,
+        "duplicates": len(aceitos) - novos,
+        "rejected": rejeitados,
+        "verify_s": round(verificado - inicio, 4),
+        "store_s": round(fim - verificado, 4),
+        "tokens_per_s": round(len(tokens) / (fim - inicio), 1) if tokens and fim > inicio else None,
+    }
+
+def somar_relatorios(total, relatorio: dict) -> dict:
+    """Acumula o relatório de um bloco de `ingest_tokens` no total do recebimento."""
+    if total is None:
+        return relatorio
+    soma = {k: total[k] + relatorio[k] for k in
+            ("received", "accepted", "stored", "duplicates", "rejected", "verify_s", "store_s")}
+    soma["verify_s"], soma["store_s"] = round(soma["verify_s"], 4), round(soma["store_s"], 4)
+    duracao = soma["verify_s"] + soma["store_s"]
+    soma["tokens_per_s"] = round(soma["received"] / duracao, 1) if soma["received"] and duracao > 0 else None
+    return soma
+
+def print_ingest_report(relatorio: dict, carteira: str):
+    for r in relatorio["rejected"][:10]:
+        print(f"❌ Token {str(r['token_id'])[:8]}... rejeitado: {r['motivo']}")
+    if len(relatorio["rejected"]) > 10:
+        print(f"❌ ... e mais {len(relatorio['rejected']) - 10} token(s) rejeitado(s).")
+    print(f"✅ {relatorio['stored']} token(s) válido(s) armazenado(s) na carteira de {carteira} "
+          f"({relatorio['accepted']} aceito(s), {len(relatorio['rejected'])} rejeitado(s), "
+          f"{relatorio['duplicates']} repetido(s); {relatorio['tokens_per_s']} tokens/s: "
+          f"verificação {relatorio['verify_s']}s, gravação {relatorio['store_s']}s).")
 
 
 # --- 4. FUNÇÕES DE CRIPTOGRAFIA E TRANSFÊNCIA ---
-# (As funções encrypt_token e decrypt_token permanecem as mesmas)
+# Um pagamento = um pacote cifrado com todos os tokens no formato binário (token_wire)
 
-def encrypt_token(token_data: dict, recipient_pubkey_b64: str) -> str:
-    """Simula a criptografia para transferência P2P (Simétrica simples para demonstração)."""
+def encrypt_bundle(tokens: list, recipient_pubkey_b64: str) -> bytes:
+    """
+    Simula a criptografia para transferência P2P (Simétrica simples para demonstração).
+    Todos os tokens do pagamento numa única cifragem:
+    chave (32) | nonce (24) | tokens token_wire concatenados, cifrados + MAC (16).
+    """
     transfer_key = random(SecretBox.KEY_SIZE) 
     secret_box = SecretBox(transfer_key)
-    token_bytes = json.dumps(token_data).encode('utf-8')
     nonce = random(SecretBox.NONCE_SIZE)
-    encrypted_token = secret_box.encrypt(token_bytes, nonce).ciphertext
-    
-    transfer_data = {
-        "encrypted_token_b64": Base64Encoder.encode(encrypted_token).decode(),
-        "transfer_key_b64": Base64Encoder.encode(transfer_key).decode(), 
-        "nonce_b64": Base64Encoder.encode(nonce).decode()
-    }
-    return json.dumps(transfer_data)
-
-def decrypt_token(transfer_data_json: str) -> dict:
-    """Cliente 2 descriptografa o token recebido."""
-    data = json.loads(transfer_data_json)
-    encrypted_token = Base64Encoder.decode(data['encrypted_token_b64'])
-    transfer_key = Base64Encoder.decode(data['transfer_key_b64'])
-    nonce = Base64Encoder.decode(data['nonce_b64'])
+    encrypted = secret_box.encrypt(token_wire.codificar_todos(tokens), nonce)
+    return transfer_key + bytes(encrypted)
 
+def decrypt_bundle(bundle: bytes) -> list:
+    """Cliente 2 descriptografa o pacote recebido (uma única operação para todos os tokens)."""
+    transfer_key, encrypted = bundle[:SecretBox.KEY_SIZE], bundle[SecretBox.KEY_SIZE:]
     secret_box = SecretBox(transfer_key)
-    decrypted_bytes = secret_box.decrypt(encrypted_token, nonce)
-    
-    return json.loads(decrypted_bytes.decode('utf-8'))
+    decrypted_bytes = secret_box.decrypt(encrypted)
+    return token_wire.decodificar_todos(decrypted_bytes, WIRE_KEYS)
 
 NEW_ACCOUNT_ENDPOINT = "/new_account"
 
@@ -215,7 +286,7 @@ def ensure_account_exists(user_id: str):
 
     try:
         print(f"🏦 Verificando/criando conta para user {user_id}...")
-        response = requests.post(f"{FLASK_HOST}{NEW_ACCOUNT_ENDPOINT}", json=payload)
+        response = HTTP.post(NEW_ACCOUNT_ENDPOINT, json=payload)
         if response.status_code == 201:
             data = response.json()
             print(f"✅ Conta criada com sucesso: {data.get('account_id')}")
@@ -229,147 +300,247 @@ def ensure_account_exists(user_id: str):
 
 # --- 5. LÓGICA DO FLUXO PRINCIPAL ---
 
-def flow_1_issue_tokens(qtd: int):
+def flow_1_issue_tokens(qtd: int = 1, amount_cents: int = None, denoms: list = None):
     """
     Chama o endpoint de emissão, ARMAZENA e VALIDA a assinatura do servidor.
+    Com `amount_cents`, o servidor escolhe o menor conjunto de tokens (em `denoms`).
     """
-    conn, cursor = setup_db(WALLET_DB)
+    store = get_store()
     
-    print(f"\n🚀 [FLUXO 1: EMISSÃO] Solicitando {qtd} tokens ao Servidor Flask...")
+    pedido = {"amount_cents": amount_cents, "denoms": denoms} if amount_cents else {"qtd": qtd}
+    print(f"\n🚀 [FLUXO 1: EMISSÃO] Solicitando {pedido} ao Servidor Flask...")
     
     try:
-        response = requests.post(
-            f"{FLASK_HOST}{ISSUE_ENDPOINT}",
-            json={"qtd": qtd},
-            headers={"Content-Type": "application/json"}
+        # streaming NDJSON: tokens verificados e gravados em blocos de INGEST_CHUNK durante o stream
+        # (memória limitada a um bloco; o que já chegou fica na carteira mesmo se a conexão cair).
+        # Idempotency-Key por recarga: uma retentativa devolve os mesmos tokens, não emite de novo.
+        response = HTTP.post(
+            ISSUE_ENDPOINT,
+            params={"stream": "1"},
+            json=pedido,
+            headers={"Accept": "application/x-ndjson"},
+            idempotency_key=str(uuid.uuid4()),
+            stream=True
         )
         response.raise_for_status()
-        tokens_list = response.json().get("tokens", [])
-        tokens_validos = 0
+        recebidos = []
+        resumo = None
+        relatorio = None
 
-        for token_data in tokens_list:
-            payload = token_data['payload']
-            signature_b64 = token_data['signature_b64']
-            
-            # --- VALIDAÇÃO CRÍTICA DO CLIENTE ---
-            payload_bytes = canonical_bytes(payload)
-            if not verify_signature(payload_bytes, signature_b64, SERVER_PK_B64):
-                print(f"❌ Token {payload['token_id'][:8]}... falhou na verificação do Servidor! IGNORADO.")
+        # --- VALIDAÇÃO CRÍTICA DO CLIENTE (em massa) + gravação a cada INGEST_CHUNK tokens ---
+        for linha in response.iter_lines():
+            if not linha:
                 continue
-            # --- FIM DA VALIDAÇÃO ---
-            
-            store_token(conn, cursor, payload['token_id'], token_data)
-            tokens_validos += 1
+            token_data = json.loads(linha)
+            if "summary" in token_data:
+                resumo = token_data["summary"]
+                break
+            recebidos.append(token_data)
+            if len(recebidos) >= INGEST_CHUNK:
+                relatorio = somar_relatorios(relatorio, ingest_tokens(store, recebidos)[1])
+                recebidos = []
+        if recebidos or relatorio is None:
+            relatorio = somar_relatorios(relatorio, ingest_tokens(store, recebidos)[1])
+
+        if resumo is None:
+            print("⚠️ Stream de emissão terminou sem registro de resumo (conexão interrompida?).")
+        elif resumo.get("status") != "success":
+            print(f"⚠️ Emissão parcial no servidor: {resumo}")
         
-        print(f"✅ {tokens_validos} token(s) emitido(s) e válidos armazenado(s) na carteira de Client 1.")
+        print_ingest_report(relatorio, "Client 1")
+        print(f"💰 Saldo disponível: {store.saldo()['available_cents'] / 100:.2f}")
 
     except requests.exceptions.RequestException as e:
         print(f"❌ Erro ao conectar/emitir tokens: {e}")
-    finally:
-        conn.close()
-
-def flow_2_offline_transfer():
-    """Simula a transferência offline (criptografia) de Client 1 para Client 2."""
-    conn, cursor = setup_db(WALLET_DB)
-
-    # Começa uma transação para evitar condições de corrida
-    conn.execute("BEGIN IMMEDIATE")
-    token_id, token_data = get_first_available_token(cursor)
-    if not token_id:
-        conn.commit()
-        conn.close()
-        print("\n⚠️ [FLUXO 2: TRANSFERÊNCIA] Nenhum token disponível/legítimo para transferência.")
-        return None
-
-    # Tenta marcar como transferido (idempotente e atômico)
-    cursor.execute("UPDATE tokens SET transferred=1 WHERE token_id=? AND transferred=0", (token_id,))
-    if cursor.rowcount == 0:
-        # Outro fluxo já marcou; aborta esta tentativa
-        conn.rollback()
-        conn.close()
-        print(f"⚠️ Token {token_id[:8]}... já foi marcado como transferido. Abortando.")
-        return None
-
-    # Confirma a marcação antes de gerar o payload P2P
-    conn.commit()
-    conn.close()
-
-    print(f"\n🤝 [FLUXO 2: TRANSFERÊNCIA] Transferindo token {token_id[:8]}... para Client 2")
-    encrypted_data_p2p = encrypt_token(token_data, CLIENT2_PK_B64)
-    print(f"   -> Token criptografado. Client 1 envia este JSON para Client 2.")
-    return encrypted_data_p2p, token_id
-
-def revert_transfer_flag(conn, cursor, token_id):
-    cursor.execute("UPDATE tokens SET transferred=0, status='AVAILABLE' WHERE token_id=?", (token_id,))
-    conn.commit()
-    print(f"↩️  Transfer flag revertido para token {token_id[:8]}...")
-
-def flow_3_redeem_token(encrypted_data_p2p, original_token_id):
+
+def flow_2_offline_transfer(valor_cents: int):
     """
-    Client 2 descriptografa, verifica e envia o token para resgate no servidor, 
-    incluindo a prova criptográfica para o backend.
+    Simula a transferência offline (criptografia) de Client 1 para Client 2:
+    escolhe os tokens que pagam `valor_cents`, reserva-os atomicamente e envia
+    todos num único pacote cifrado.
     """
-    if not encrypted_data_p2p:
-        return
+    store = get_store()
+    print(f"\n🤝 [FLUXO 2: TRANSFERÊNCIA] Pagando {valor_cents / 100:.2f} para Client 2")
+
+    # Escolha + reserva na mesma transação (dois fluxos nunca pegam o mesmo token)
+    try:
+        selecionados, excedente = store.reservar_valor(valor_cents)
+    except SaldoInsuficiente as e:
+        print(f"⚠️ {e} (disponível: {store.saldo()['available_cents'] / 100:.2f}).")
+        return None, None
+    token_ids = [token_id for token_id, _ in selecionados]
 
-    print(f"\n💸 [FLUXO 3: RESGATE] Client 2 recebeu o token. Descriptografando...")
-    
-    # 1. Descriptografia e Validação (pode incluir validação da assinatura aqui)
     try:
-        token_data = decrypt_token(encrypted_data_p2p)
-        print("   -> Token descriptografado com sucesso.")
+        bundle = encrypt_bundle([token for _, token in selecionados], CLIENT2_PK_B64)
     except Exception as e:
-        print(f"❌ Erro ao descriptografar token: {e}")
-        return
-    
-    print(token_data)
+        store.marcar_varios(token_ids, AVAILABLE, de=PENDING)
+        print(f"❌ Erro ao montar o pacote de transferência: {e}")
+        return None, None
+    store.marcar_varios(token_ids, TRANSFERRED, de=PENDING)
 
-    payload = token_data['payload']
-    signature_b64 = token_data['signature_b64']
-    
-    # 2. Criação da Requisição de Resgate (COM PROVA CRIPTOGRÁFICA)
-    redeem_request = {
-        "token_id": payload['token_id'],
-        "user_id": CLIENT2_USER_ID,
-        "requester_device": CLIENT2_DEVICE_ID, # Adicionado o Device ID
-        
-        # PROVAS CRÍTICAS PARA O BACKEND VALIDAR A AUTENTICIDADE:
-        "token_payload": payload,
-        "token_signature_b64": signature_b64
-    }
+    print(f"   -> {len(token_ids)} token(s) num pacote de {len(bundle)} bytes"
+          + (f" (excedente de {excedente / 100:.2f}, sem troco exato)" if excedente else "") + ".")
+    return bundle, token_ids
 
-    print(f"   -> Enviando requisição de resgate para o servidor...")
-    conn, cursor = setup_db(WALLET_DB) 
+def revert_transfer_flag(store, token_ids):
+    revertidos = store.marcar_varios(token_ids, AVAILABLE, de=TRANSFERRED)
+    print(f"↩️  Transfer flag revertido para {revertidos} token(s).")
+
+def receive_bundle(bundle: bytes) -> list:
+    """
+    Client 2: descriptografa o pacote, verifica todas as assinaturas e grava os
+    válidos na sua carteira, já na fila de resgate (outbox), numa única
+    transação. Retorna os tokens válidos.
+    """
+    tokens = decrypt_bundle(bundle)
+    validos, relatorio = ingest_tokens(get_store(CLIENT2_WALLET_DB), tokens, resgatar=True)
+    print_ingest_report(relatorio, "Client 2")
+    return validos
 
+def server_reachable() -> bool:
     try:
-        response = requests.post(f"{FLASK_HOST}{REDEEM_ENDPOINT}", json=redeem_request)
-        response.raise_for_status()
-        data = response.json()
-        if data.get("status") == "success":
-            print(f"🎉 SUCESSO! Token {payload['token_id'][:8]}... RESGATADO pelo Servidor.")
-            mark_token_redeemed(conn, cursor, original_token_id)
-        else:
-            print(f"❌ Resgate falhou no servidor: {data.get('message') or data}")
-            revert_transfer_flag(conn, cursor, original_token_id)
-    except requests.exceptions.RequestException as e:
-        print(f"❌ Erro ao resgatar token: {e}")
-        revert_transfer_flag(conn, cursor, original_token_id)
-    finally:
-        conn.close()
+        return HTTP.get("/ping", max_tentativas=1).ok
+    except requests.exceptions.RequestException:
+        return False
+
+def conferir_redencao(redemption_id, user_id: str) -> set:
+    """
+    token_ids que a redenção `redemption_id` aplicou para `user_id` (vazio se ela
+    não existir, não estiver APPLIED ou for de outro usuário). Lança
+    requests.RequestException se o servidor não responder.
+    """
+    if not redemption_id:
+        return set()
+    response = HTTP.get(REDEMPTION_ENDPOINT.format(redemption_id))
+    if response.status_code == 404:
+        return set()
+    response.raise_for_status()
+    redencao = response.json()
+    if redencao.get("status") != "APPLIED" or redencao.get("user_id") != str(uuid.UUID(user_id)):
+        return set()
+    return set(redencao.get("token_ids", []))
+
+def sync_outbox(store: WalletStore, user_id: str, lote: int = OUTBOX_BATCH) -> dict:
+    """
+    Esvazia o outbox de resgates em lotes de até `lote` tokens, um /redeem/batch
+    por lote, enquanto o servidor responder. Cada lote é gravado antes do envio;
+    se a conexão cair, ele fica aberto e é reenviado igual na próxima
+    sincronização (mesma chave idempotente no servidor). O lote vai numa única
+    tentativa HTTP (max_tentativas=1): quem reenvia é o outbox. Resultado por token:
+      - applied: resgatado agora
+      - duplicate: o servidor já tinha a redenção deste lote; só conta como
+        resgatado se GET /redemptions/<id> confirmar que ela está APPLIED, é
+        desta carteira e contém o token
+      - already_redeemed, not_found, expired, invalid_signature: recusado
+        (already_redeemed é sempre de outra redenção: gasto por outra pessoa)
+    Retorna {"batches", "redeemed", "failed", "redeemed_cents", "online", "outbox"}.
+    """
+    relatorio = {"batches": 0, "redeemed": [], "failed": {}, "redeemed_cents": 0, "online": server_reachable()}
+    while relatorio["online"]:
+        lote_id, _, membros = store.proximo_lote(lote)
+        if lote_id is None:
+            break
+        store.registrar_envio(lote_id)
+        try:
+            response = HTTP.post(REDEEM_BATCH_ENDPOINT, json={
+                "user_id": user_id,
+                "tokens": [{"token_b64": Base64Encoder.encode(token_wire.codificar(t)).decode()}
+                           for _, t in membros],
+            }, max_tentativas=1)
+            response.raise_for_status()
+        except requests.exceptions.RequestException as e:
+            # lote continua aberto com a mesma composição
+            print(f"⚠️ Sincronização interrompida no lote {lote_id}: {e}")
+            relatorio["online"] = False
+            break
+
+        corpo = response.json()
+        resultados = [r for r in corpo.get("results", []) if r["token_id"] is not None]
+        resgatados = [r["token_id"] for r in resultados if r["result"] == "applied"]
+        recusados = {r["token_id"]: r["result"] for r in resultados if r["result"] not in ("applied", "duplicate")}
+        repetidos = [r["token_id"] for r in resultados if r["result"] == "duplicate"]
+        if repetidos:
+            try:
+                confirmados = conferir_redencao(corpo.get("redemption_id"), user_id)
+            except requests.exceptions.RequestException as e:
+                # sem confirmação o lote continua aberto e é reenviado igual depois
+                print(f"⚠️ Não foi possível conferir a redenção do lote {lote_id}: {e}")
+                relatorio["online"] = False
+                break
+            for tid in repetidos:
+                if tid in confirmados:
+                    resgatados.append(tid)
+                else:
+                    recusados[tid] = "duplicate"
+        store.concluir_lote(lote_id, resgatados, recusados)
+
+        valores = {tid: t["payload"]["denom_cents"] for tid, t in membros}
+        relatorio["batches"] += 1
+        relatorio["redeemed"] += resgatados
+        relatorio["failed"].update(recusados)
+        relatorio["redeemed_cents"] += sum(valores.get(tid, 0) for tid in resgatados)
+
+    relatorio["outbox"] = store.outbox()
+    return relatorio
+
+def flow_3_redeem_bundle(bundle, original_token_ids):
+    """
+    Client 2 recebe o pacote: os tokens válidos entram no outbox de resgate na
+    mesma transação em que são guardados, e o outbox é sincronizado com o
+    servidor em lotes (/redeem/batch, prova criptográfica = token binário).
+    Sem conexão, os tokens ficam na fila para a próxima sincronização.
+    """
+    if not bundle:
+        return
+
+    print(f"\n💸 [FLUXO 3: RESGATE] Client 2 recebeu o pacote. Descriptografando...")
+    sender = get_store()
+
+    # 1. Descriptografia, validação e armazenamento (na fila de resgate) numa passada
+    try:
+        tokens = receive_bundle(bundle)
+        print(f"   -> {len(tokens)} token(s) descriptografado(s), verificado(s) e na fila de resgate de Client 2.")
+    except Exception as e:
+        print(f"❌ Erro ao descriptografar pacote: {e}")
+        revert_transfer_flag(sender, original_token_ids)
+        return
+    if not tokens:
+        revert_transfer_flag(sender, original_token_ids)
+        return
+
+    # 2. Sincronização do outbox (todos os resgates pendentes, não só este pacote)
+    print(f"   -> Sincronizando a fila de resgate com o servidor...")
+    relatorio = sync_outbox(get_store(CLIENT2_WALLET_DB), CLIENT2_USER_ID)
+    if not relatorio["online"] and not relatorio["batches"]:
+        na_fila = relatorio["outbox"].get("QUEUED", 0) + relatorio["outbox"].get("SENDING", 0)
+        print(f"📴 Servidor indisponível: {na_fila} token(s) aguardam a próxima sincronização.")
+        return
+
+    if relatorio["redeemed"]:
+        print(f"🎉 SUCESSO! {len(relatorio['redeemed'])} token(s), {relatorio['redeemed_cents'] / 100:.2f}, "
+              f"RESGATADO(s) pelo Servidor em {relatorio['batches']} lote(s).")
+        mark_tokens_redeemed(sender, relatorio["redeemed"])
+    if relatorio["failed"]:
+        print(f"❌ {len(relatorio['failed'])} token(s) recusado(s) pelo servidor: {relatorio['failed']}")
+    print(f"   -> Outbox: {relatorio['outbox']}")
 
 # --- EXECUÇÃO ---
 if __name__ == "__main__":
     print("\n🚀 Inicializando fluxo da carteira...")
 
 
-    # 1️⃣ Client 1 (Carteira) solicita emissão de tokens
+    # 1️⃣ Client 1 (Carteira) solicita emissão de tokens: moedas de R$ 1 e notas de R$ 10
     flow_1_issue_tokens(QTD_TOKENS)
+    flow_1_issue_tokens(amount_cents=ISSUE_AMOUNT_CENTS, denoms=[1000])
 
-    # 2️⃣ Client 1 (Emissor) transfere o token para Client 2
-    transfer_data, token_id_original = flow_2_offline_transfer()
+    # 2️⃣ Client 1 (Emissor) paga um valor a Client 2 com um único pacote
+    transfer_data, token_ids_originais = flow_2_offline_transfer(PAYMENT_CENTS)
 
 
 
-    # 3️⃣ Client 2 (Recebedor) descriptografa e resgata o token
+    # 3️⃣ Client 2 (Recebedor) descriptografa e resgata os tokens
     if transfer_data:
-        flow_3_redeem_token(transfer_data, token_id_original)
+        flow_3_redeem_bundle(transfer_data, token_ids_originais)
+
+    print(f"\n🌐 HTTP: {HTTP.stats}")
+    HTTP.close()
@@ -0,0 +1,180 @@
+"""
+Formato binário compacto de um token (QR/NFC/BLE e armazenamento na carteira).
+
+  offset  bytes  campo
+  0       1      versão (4 bits altos) | flags (4 bits baixos; 0x1 = prova de Merkle, 0x2 = exp_at)
+  1       16     token_id (UUID)
+  17      1-5    denom_cents (varint LEB128)
+  +0      8      issued_at em microssegundos desde 1970-01-01 UTC (uint64 big-endian)
+  +8      4      key id do emissor: sha256(chave pública)[:4]
+  +12     64     assinatura Ed25519 sobre canonical_bytes(payload)
+                 (com a flag 0x1: assinatura da raiz da árvore de emissão)
+  +76     8      só com a flag 0x2: exp_at em microssegundos desde 1970-01-01 UTC
+  +0      8+32k  só com a flag 0x1: prova de inclusão (merkle.py)
+
+Um token de R$ 1,00 ocupa 94 bytes, 102 com exp_at (o mesmo token em JSON, 373). O
+payload_sha256 não trafega: é sha256(canonical_bytes(payload)), recalculado por
+quem decodifica. Registros são autodelimitados, então vários tokens são apenas
+concatenados.
+
+issued_at e exp_at voltam como datetime.isoformat() + "Z", o formato de
+issue_tokens; codificar() recusa um valor que não volte idêntico, garantindo que
+canonical_bytes(payload decodificado) == canonical_bytes(payload original).
+
+Cópia idêntica de server/wallet_service/token_wire.py (o cliente não importa o servidor).
+"""
+import base64
+import hashlib
+import struct
+import uuid
+from datetime import datetime, timedelta
+
+import merkle
+
+VERSAO = 1
+MIME = "application/x-bluepay-token"
+TAMANHO_ASSINATURA = 64
+FLAG_MERKLE = 0x1
+FLAG_EXPIRA = 0x2
+
+_EPOCA = datetime(1970, 1, 1)
+_MICRO = timedelta(microseconds=1)
+_TS_E_CHAVE = struct.Struct(">Q4s")
+_TS = struct.Struct(">Q")
+
+
+class FormatoInvalido(ValueError):
+    """Bytes que não formam um token válido neste formato."""
+
+
+def key_id(pubkey_b64: str) -> bytes:
+    return hashlib.sha256(base64.b64decode(pubkey_b64)).digest()[:4]
+
+
+def indice_de_chaves(pubkeys) -> dict:
+    """{key id: chave pública base64} para os emissores conhecidos."""
+    return {key_id(pk): pk for pk in pubkeys}
+
+
+def _varint(n: int) -> bytes:
+    if n < 0:
+        raise FormatoInvalido("denom_cents negativo")
+    saida = bytearray()
+    while True:
+        byte = n & 0x7F
+        n >>= 7
+        if n:
+            saida.append(byte | 0x80)
+        else:
+            saida.append(byte)
+            return bytes(saida)
+
+
+def _ler_varint(dados, pos):
+    n = deslocamento = 0
+    while True:
+        if pos >= len(dados) or deslocamento > 28:
+            raise FormatoInvalido("varint truncado")
+        byte = dados[pos]
+        pos += 1
+        n |= (byte & 0x7F) << deslocamento
+        deslocamento += 7
+        if not byte & 0x80:
+            return n, pos
+
+
+def _iso(micros: int) -> str:
+    return (_EPOCA + micros * _MICRO).isoformat() + "Z"
+
+
+def _micros(data: str) -> int:
+    try:
+        dt = datetime.fromisoformat(data[:-1]) if data.endswith("Z") else None
+    except ValueError:
+        dt = None
+    if dt is None or dt.tzinfo is not None or dt < _EPOCA:
+        raise FormatoInvalido(f"data fora do formato do emissor: {data!r}")
+    micros = (dt - _EPOCA) // _MICRO
+    if _iso(micros) != data:
+        raise FormatoInvalido(f"data sem representação exata: {data!r}")
+    return micros
+
+
+def codificar(token: dict) -> bytes:
+    """{"payload": {..., ["exp_at"]}, "signature_b64": ..., ["merkle_proof_b64": ...]} -> bytes."""
+    payload = token["payload"]
+    assinatura = base64.b64decode(token["signature_b64"])
+    if len(assinatura) != TAMANHO_ASSINATURA:
+        raise FormatoInvalido("Assinatura deve ter 64 bytes")
+    prova = base64.b64decode(token["merkle_proof_b64"]) if token.get("merkle_proof_b64") else b""
+    if prova and merkle.ler_prova(prova)[3] != len(prova):
+        raise FormatoInvalido("bytes após a prova de Merkle")
+    exp_at = payload.get("exp_at")
+    flags = (FLAG_MERKLE if prova else 0) | (FLAG_EXPIRA if exp_at else 0)
+    return b"".join((
+        bytes([VERSAO << 4 | flags]),
+        uuid.UUID(str(payload["token_id"])).bytes,
+        _varint(int(payload["denom_cents"])),
+        _TS_E_CHAVE.pack(_micros(payload["issued_at"]), key_id(payload["issuer_pubkey"])),
+        assinatura,
+        _TS.pack(_micros(exp_at)) if exp_at else b"",
+        prova,
+    ))
+
+
+def decodificar(dados, chaves: dict, pos: int = 0):
+    """
+    Lê um token a partir de `pos`; `chaves` vem de indice_de_chaves().
+    Retorna ({"payload": {...}, "signature_b64": ..., ["merkle_proof_b64": ...]}, posição após o token).
+    """
+    dados = memoryview(dados)
+    if pos >= len(dados):
+        raise FormatoInvalido("token truncado")
+    cabecalho = dados[pos]
+    if cabecalho >> 4 != VERSAO or cabecalho & 0x0F & ~(FLAG_MERKLE | FLAG_EXPIRA):
+        raise FormatoInvalido(f"versão/flags não suportados: 0x{cabecalho:02x}")
+    if pos + 17 > len(dados):
+        raise FormatoInvalido("token truncado")
+    token_id = uuid.UUID(bytes=bytes(dados[pos + 1:pos + 17]))
+    denom_cents, pos = _ler_varint(dados, pos + 17)
+    fim = pos + _TS_E_CHAVE.size + TAMANHO_ASSINATURA
+    if fim > len(dados):
+        raise FormatoInvalido("token truncado")
+    micros, kid = _TS_E_CHAVE.unpack_from(dados, pos)
+    pubkey = chaves.get(kid)
+    if pubkey is None:
+        raise FormatoInvalido("Emissor desconhecido")
+    assinatura = bytes(dados[pos + _TS_E_CHAVE.size:fim])
+    token = {
+        "payload": {
+            "token_id": str(token_id),
+            "denom_cents": denom_cents,
+            "issuer_pubkey": pubkey,
+            "issued_at": _iso(micros),
+        },
+        "signature_b64": base64.b64encode(assinatura).decode(),
+    }
+    if cabecalho & FLAG_EXPIRA:
+        if fim + _TS.size > len(dados):
+            raise FormatoInvalido("token truncado")
+        token["payload"]["exp_at"] = _iso(_TS.unpack_from(dados, fim)[0])
+        fim += _TS.size
+    if cabecalho & FLAG_MERKLE:
+        try:
+            inicio, fim = fim, merkle.ler_prova(dados, fim)[3]
+        except merkle.ProvaInvalida as e:
+            raise FormatoInvalido(str(e))
+        token["merkle_proof_b64"] = base64.b64encode(dados[inicio:fim]).decode()
+    return token, fim
+
+
+def codificar_todos(tokens) -> bytes:
+    return b"".join(codificar(t) for t in tokens)
+
+
+def decodificar_todos(dados, chaves: dict) -> list:
+    tokens, pos = [], 0
+    while pos < len(dados):
+        token, pos = decodificar(dados, chaves, pos)
+        tokens.append(token)
+    return tokens
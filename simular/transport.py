@@ -0,0 +1,151 @@
+"""
+Transporte HTTP da carteira: uma Session compartilhada para todas as chamadas.
+
+- Keep-alive: conexões reaproveitadas pelo pool do HTTPAdapter (sem um
+  handshake TCP por chamada).
+- Timeouts por endpoint (conexão, leitura): um servidor travado nunca prende a
+  carteira indefinidamente.
+- Retentativas com backoff exponencial + jitter, só quando repetir é seguro:
+    * a conexão nem abriu (a requisição não chegou ao servidor): sempre;
+    * timeout de leitura, 429/502/503/504: só em endpoints idempotentes ou em
+      requisições com Idempotency-Key. Retry-After do servidor é respeitado.
+- gzip: respostas comprimidas são aceitas e descomprimidas pelo requests;
+  corpos de requisição acima de GZIP_MIN_BYTES vão com Content-Encoding: gzip.
+"""
+import gzip
+import json
+import random
+import time
+from dataclasses import dataclass
+
+import requests
+from requests.adapters import HTTPAdapter
+
+GZIP_MIN_BYTES = 1024
+RETRY_STATUS = (429, 502, 503, 504)
+
+
+@dataclass(frozen=True)
+class Politica:
+    connect_timeout: float = 3.0
+    read_timeout: float = 10.0
+    # repetir a mesma requisição não tem efeito duplicado no servidor
+    idempotente: bool = False
+
+
+# Endpoints do wallet_service (prefixo do caminho, por segmento inteiro -> política)
+POLITICAS = {
+    "/ping": Politica(connect_timeout=1.0, read_timeout=2.0, idempotente=True),  # sonda de conectividade
+    "/new_user": Politica(idempotente=True),            # repetição responde 409
+    "/new_device": Politica(idempotente=True),
+    "/new_account": Politica(idempotente=True),         # repetição responde 200 com a conta existente
+    "/tokens/issue": Politica(read_timeout=30.0),       # idempotente só com Idempotency-Key
+    "/redeem/batch": Politica(read_timeout=15.0, idempotente=True),  # chave idempotente do lote
+    "/redeem": Politica(idempotente=True),              # chave idempotente por token
+    "/redemptions": Politica(idempotente=True),         # consulta de status, só leitura
+}
+PADRAO = Politica()
+
+
+def politica_de(endpoint):
+    """Política do caminho: igual ao prefixo ou abaixo dele ("/redeem" não casa "/redemptions/...")."""
+    caminho = endpoint.split("?", 1)[0]
+    for prefixo, politica in POLITICAS.items():
+        if caminho == prefixo or caminho.startswith(prefixo + "/"):
+            return politica
+    return PADRAO
+
+
+class Transport:
+    def __init__(self, base_url, max_tentativas=4, backoff=0.25, backoff_max=4.0,
+                 gzip_requisicoes=True, pool=4):
+        self.base_url = base_url.rstrip("/")
+        self.max_tentativas = max_tentativas
+        self.backoff = backoff
+        self.backoff_max = backoff_max
+        self.gzip_requisicoes = gzip_requisicoes
+        self.session = requests.Session()
+        adaptador = HTTPAdapter(pool_connections=pool, pool_maxsize=pool, max_retries=0)
+        self.session.mount("http://", adaptador)
+        self.session.mount("https://", adaptador)
+        self.session.headers["Accept-Encoding"] = "gzip"
+        self.stats = {"requests": 0, "retries": 0, "gzip_bytes_saved": 0}
+
+    def close(self):
+        self.session.close()
+
+    def _espera(self, tentativa, resposta=None):
+        if resposta is not None and resposta.headers.get("Retry-After", "").isdigit():
+            return min(float(resposta.headers["Retry-After"]), self.backoff_max)
+        return random.uniform(0, min(self.backoff_max, self.backoff * 2 ** tentativa))
+
+    def _corpo(self, json_body, headers):
+        if json_body is None:
+            return None
+        corpo = json.dumps(json_body, separators=(",", ":")).encode()
+        headers["Content-Type"] = "application/json"
+        if self.gzip_requisicoes and len(corpo) >= GZIP_MIN_BYTES:
+            comprimido = gzip.compress(corpo, compresslevel=6)
+            self.stats["gzip_bytes_saved"] += len(corpo) - len(comprimido)
+            headers["Content-Encoding"] = "gzip"
+            return comprimido
+        return corpo
+
+    def request(self, method, endpoint, json=None, params=None, headers=None,
+                idempotency_key=None, stream=False, max_tentativas=None):
+        """
+        Envia a requisição com a política do endpoint. Devolve a resposta final
+        (inclusive 4xx/5xx não repetíveis); lança requests.RequestException se
+        todas as tentativas falharem na rede. `max_tentativas` sobrepõe o padrão da instância.
+        """
+        politica = politica_de(endpoint)
+        headers = dict(headers or {})
+        if idempotency_key:
+            headers["Idempotency-Key"] = idempotency_key
+        corpo = self._corpo(json, headers)
+        limite = max_tentativas or self.max_tentativas
+        repetivel = method in ("GET", "HEAD") or politica.idempotente or bool(idempotency_key)
+
+        tentativa = 0
+        while True:
+            self.stats["requests"] += 1
+            try:
+                resposta = self.session.request(
+                    method, self.base_url + endpoint, data=corpo, params=params, headers=headers,
+                    timeout=(politica.connect_timeout, politica.read_timeout), stream=stream)
+            except requests.exceptions.ConnectionError as e:
+                # ConnectTimeout/erro de conexão: nada chegou ao servidor; ReadTimeout herda de Timeout
+                chegou = not isinstance(e, requests.exceptions.ConnectTimeout) and _talvez_entregue(e)
+                if tentativa + 1 >= limite or (chegou and not repetivel):
+                    raise
+                espera = self._espera(tentativa)
+            except requests.exceptions.Timeout:
+                if tentativa + 1 >= limite or not repetivel:
+                    raise
+                espera = self._espera(tentativa)
+            else:
+                if resposta.status_code not in RETRY_STATUS or not repetivel \
+                        or tentativa + 1 >= limite:
+                    return resposta
+                espera = self._espera(tentativa, resposta)
+                resposta.close()
+
+            tentativa += 1
+            self.stats["retries"] += 1
+            time.sleep(espera)
+
+    def post(self, endpoint, json=None, **kwargs):
+        return self.request("POST", endpoint, json=json, **kwargs)
+
+    def get(self, endpoint, **kwargs):
+        return self.request("GET", endpoint, **kwargs)
+
+
+def _talvez_entregue(erro):
+    """
+    Conexão caída depois de enviada (reset, resposta incompleta) pode ter sido
+    processada; recusa de conexão/DNS com certeza não foi.
+    """
+    texto = repr(erro)
+    return not any(marca in texto for marca in (
+        "NewConnectionError", "ConnectionRefused", "NameResolutionError", "Failed to establish"))
@@ -0,0 +1,415 @@
+"""
+Armazenamento da carteira do cliente (SQLite).
+
+- Uma conexão por processo (WalletStore), em WAL com synchronous=NORMAL:
+  leituras não bloqueiam a escrita e cada commit é um append no WAL.
+- Colunas reais (token_id, denom_cents, issued_at, state) + o token no formato
+  binário (token_wire); o índice (state, denom_cents, issued_at) cobre a
+  escolha do próximo token disponível.
+- Migrações versionadas por PRAGMA user_version, aplicadas uma única vez ao abrir.
+- Inserções em lote numa transação (um commit por lote, não por token).
+- Saldo O(1): a tabela saldo_por_estado (estado x denominação) é mantida por
+  triggers, então o saldo lê no máximo um punhado de linhas, qualquer que seja
+  o número de tokens.
+- Pagamento por valor (reservar_valor): escolhe o conjunto de tokens disponíveis
+  (troco exato com o menor número de tokens; sem troco exato, o menor excedente)
+  e o reserva na mesma transação.
+- Outbox de resgates (migração v2): tokens recebidos entram na fila na mesma
+  transação em que são gravados e saem em lotes de tamanho limitado quando há
+  conexão. A composição de cada lote é gravada antes do envio, então um crash
+  no meio do envio reenvia exatamente o mesmo lote (mesma chave idempotente
+  no servidor): nada é resgatado em dobro nem esquecido.
+"""
+import json
+import sqlite3
+import time
+from contextlib import contextmanager
+from functools import reduce
+from math import gcd
+
+import token_wire
+
+WALLET_DB = "wallet.db"
+
+AVAILABLE = "AVAILABLE"
+PENDING = "PENDING"          # reservado para uma operação em andamento
+TRANSFERRED = "TRANSFERRED"  # enviado P2P para outra carteira
+REDEEMED = "REDEEMED"
+ESTADOS = (AVAILABLE, PENDING, TRANSFERRED, REDEEMED)
+
+# Estados de um token no outbox (o token fica PENDING na carteira enquanto estiver na fila)
+NA_FILA = "QUEUED"
+ENVIANDO = "SENDING"    # membro de um lote aberto; pode já ter chegado ao servidor
+CONCLUIDO = "DONE"      # resgatado no servidor
+FALHOU = "FAILED"       # recusado pelo servidor (motivo em `result`)
+ESTADOS_OUTBOX = (NA_FILA, ENVIANDO, CONCLUIDO, FALHOU)
+
+
+def _v1_esquema(conn, chaves):
+    # carteiras anteriores ao versionamento: tokens(token_id, token_data_json | token_wire, status, transferred)
+    legado = conn.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='tokens'").fetchone()
+    if legado:
+        conn.execute("ALTER TABLE tokens RENAME TO tokens_legado")
+
+    # um execute por comando: executescript() faria COMMIT no meio da migração
+    for comando in (
+        f"""CREATE TABLE tokens (
+            id          INTEGER PRIMARY KEY,
+            token_id    TEXT NOT NULL UNIQUE,
+            denom_cents INTEGER NOT NULL,
+            issued_at   TEXT NOT NULL,
+            state       TEXT NOT NULL DEFAULT 'AVAILABLE' CHECK (state IN {ESTADOS}),
+            token_wire  BLOB NOT NULL
+        )""",
+        "CREATE INDEX idx_tokens_state ON tokens (state, denom_cents, issued_at)",
+        """CREATE TABLE saldo_por_estado (
+            state       TEXT NOT NULL,
+            denom_cents INTEGER NOT NULL,
+            qtd         INTEGER NOT NULL,
+            PRIMARY KEY (state, denom_cents)
+        ) WITHOUT ROWID""",
+        """CREATE TRIGGER tokens_saldo_insert AFTER INSERT ON tokens BEGIN
+            INSERT INTO saldo_por_estado (state, denom_cents, qtd) VALUES (NEW.state, NEW.denom_cents, 1)
+            ON CONFLICT (state, denom_cents) DO UPDATE SET qtd = qtd + 1;
+        END""",
+        """CREATE TRIGGER tokens_saldo_update AFTER UPDATE OF state ON tokens WHEN OLD.state <> NEW.state BEGIN
+            UPDATE saldo_por_estado SET qtd = qtd - 1 WHERE state = OLD.state AND denom_cents = OLD.denom_cents;
+            INSERT INTO saldo_por_estado (state, denom_cents, qtd) VALUES (NEW.state, NEW.denom_cents, 1)
+            ON CONFLICT (state, denom_cents) DO UPDATE SET qtd = qtd + 1;
+        END""",
+        """CREATE TRIGGER tokens_saldo_delete AFTER DELETE ON tokens BEGIN
+            UPDATE saldo_por_estado SET qtd = qtd - 1 WHERE state = OLD.state AND denom_cents = OLD.denom_cents;
+        END""",
+    ):
+        conn.execute(comando)
+
+    if legado:
+        cur = conn.execute("SELECT * FROM tokens_legado")
+        colunas = [c[0] for c in cur.description]
+        linhas = []
+        for row in cur.fetchall():
+            antigo = dict(zip(colunas, row))
+            if antigo.get("token_wire"):
+                dados = antigo["token_wire"]
+                payload = token_wire.decodificar(dados, chaves)[0]["payload"]
+            else:
+                token = json.loads(antigo["token_data_json"])
+                dados, payload = token_wire.codificar(token), token["payload"]
+            estado = antigo.get("status", AVAILABLE)
+            if antigo.get("transferred") and estado != REDEEMED:
+                estado = TRANSFERRED
+            linhas.append((payload["token_id"], payload["denom_cents"], payload["issued_at"],
+                           estado if estado in ESTADOS else AVAILABLE, dados))
+        conn.executemany("""
+            INSERT INTO tokens (token_id, denom_cents, issued_at, state, token_wire) VALUES (?, ?, ?, ?, ?)
+        """, linhas)
+        conn.execute("DROP TABLE tokens_legado")
+
+
+def _v2_outbox(conn, chaves):
+    for comando in (
+        """CREATE TABLE outbox_lotes (
+            id          INTEGER PRIMARY KEY,
+            criado_em   REAL NOT NULL,
+            tentativas  INTEGER NOT NULL DEFAULT 0,
+            concluido   INTEGER NOT NULL DEFAULT 0
+        )""",
+        f"""CREATE TABLE outbox (
+            id           INTEGER PRIMARY KEY,
+            token_id     TEXT NOT NULL UNIQUE REFERENCES tokens (token_id),
+            state        TEXT NOT NULL DEFAULT 'QUEUED' CHECK (state IN {ESTADOS_OUTBOX}),
+            lote_id      INTEGER REFERENCES outbox_lotes (id),
+            result       TEXT,
+            atualizado_em REAL NOT NULL
+        )""",
+        "CREATE INDEX idx_outbox_state ON outbox (state, id)",
+        "CREATE INDEX idx_outbox_lote ON outbox (lote_id)",
+    ):
+        conn.execute(comando)
+
+
+class SaldoInsuficiente(ValueError):
+    """Os tokens disponíveis não somam o valor pedido."""
+
+
+def escolher_tokens(valor_cents, disponiveis):
+    """
+    Escolhe quantos tokens de cada denominação usar para pagar `valor_cents`,
+    com `disponiveis` = {denominação: quantidade}. Prioridades:
+      1. troco exato; senão o menor excedente
+      2. o menor número de tokens
+    Retorna ({denominação: quantidade}, excedente_cents).
+    """
+    disponiveis = {d: n for d, n in disponiveis.items() if n > 0}
+    if sum(d * n for d, n in disponiveis.items()) < valor_cents:
+        raise SaldoInsuficiente(f"Saldo insuficiente para {valor_cents} centavos")
+    if valor_cents <= 0:
+        return {}, 0
+
+    mdc = reduce(gcd, disponiveis)
+    limites = {d // mdc: n for d, n in disponiveis.items()}
+    valor = -(-valor_cents // mdc)
+    escolha = {}
+
+    # Tokens forçados da maior denominação: se o resto da carteira não cobre o
+    # valor, qualquer solução usa pelo menos esses. Limita o vetor da DP abaixo.
+    maior = max(limites)
+    resto = sum(d * n for d, n in limites.items() if d != maior)
+    if valor > resto:
+        forcados = -(-(valor - resto) // maior)
+        escolha[maior] = forcados
+        limites[maior] -= forcados
+        valor -= forcados * maior
+
+    # DP 0/1 sobre os limites quebrados em potências de 2; um conjunto mínimo
+    # que cobre o valor nunca passa de valor + maior - 1
+    teto = max(valor, 0) + maior - 1
+    itens = []
+    for d, n in sorted(limites.items(), reverse=True):
+        k = 1
+        while n > 0:
+            itens.append((d, min(k, n)))
+            n -= min(k, n)
+            k *= 2
+    infinito = float("inf")
+    melhor = [0] + [infinito] * teto
+    usou = []
+    for d, n in itens:
+        peso = d * n
+        marcado = bytearray(teto + 1)
+        for v in range(teto, peso - 1, -1):
+            if melhor[v - peso] + n < melhor[v]:
+                melhor[v] = melhor[v - peso] + n
+                marcado[v] = 1
+        usou.append(marcado)
+
+    alvo = next(v for v in range(max(valor, 0), teto + 1) if melhor[v] < infinito)
+    v = alvo
+    for (d, n), marcado in zip(reversed(itens), reversed(usou)):
+        if marcado[v]:
+            escolha[d] = escolha.get(d, 0) + n
+            v -= d * n
+
+    mix = {d * mdc: n for d, n in sorted(escolha.items(), reverse=True) if n}
+    return mix, sum(d * n for d, n in mix.items()) - valor_cents
+
+
+# user_version N = MIGRACOES[:N] já aplicadas; migrações novas entram no fim da lista
+MIGRACOES = [_v1_esquema, _v2_outbox]
+
+
+class WalletStore:
+    def __init__(self, caminho=WALLET_DB, chaves=None):
+        """`chaves`: {key id: chave pública} para decodificar token_wire (token_wire.indice_de_chaves)."""
+        self.chaves = chaves or {}
+        self.conn = sqlite3.connect(caminho, isolation_level=None, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("PRAGMA busy_timeout=5000")
+        self._migrar()
+
+    def _migrar(self):
+        versao = self.conn.execute("PRAGMA user_version").fetchone()[0]
+        if versao >= len(MIGRACOES):
+            return
+        with self.transacao():
+            for numero, migracao in enumerate(MIGRACOES[versao:], start=versao + 1):
+                migracao(self.conn, self.chaves)
+                self.conn.execute(f"PRAGMA user_version={numero}")
+
+    @contextmanager
+    def transacao(self):
+        """BEGIN IMMEDIATE: a trava de escrita é pega no início (sem upgrade de leitura para escrita)."""
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield self.conn
+            self.conn.execute("COMMIT")
+        except BaseException:
+            self.conn.execute("ROLLBACK")
+            raise
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # -----------------------------------------------------------
+    # Escrita
+    # -----------------------------------------------------------
+    def adicionar(self, tokens, resgatar=False):
+        """
+        Grava uma lista de tokens ({payload, signature_b64}) em UMA transação. Retorna quantos eram novos.
+        Com `resgatar`, os novos entram no outbox na mesma transação (recebido => na fila).
+        """
+        linhas = [(t["payload"]["token_id"], t["payload"]["denom_cents"], t["payload"]["issued_at"],
+                   token_wire.codificar(t)) for t in tokens]
+        with self.transacao() as conn:
+            cur = conn.executemany("""
+                INSERT INTO tokens (token_id, denom_cents, issued_at, token_wire) VALUES (?, ?, ?, ?)
+                ON CONFLICT (token_id) DO NOTHING
+            """, linhas)
+            novos = cur.rowcount
+            if resgatar:
+                self._enfileirar(conn, [linha[0] for linha in linhas])
+            return novos
+
+    def _enfileirar(self, conn, token_ids):
+        agora, fila = time.time(), 0
+        for tid in token_ids:
+            # só tokens disponíveis: um token já reservado/transferido/resgatado não vai para a fila
+            if conn.execute("UPDATE tokens SET state = 'PENDING' WHERE token_id = ? AND state = 'AVAILABLE'",
+                            (tid,)).rowcount:
+                conn.execute("""
+                    INSERT INTO outbox (token_id, atualizado_em) VALUES (?, ?)
+                    ON CONFLICT (token_id) DO UPDATE SET state = 'QUEUED', lote_id = NULL, result = NULL,
+                                                         atualizado_em = excluded.atualizado_em
+                """, (tid, agora))
+                fila += 1
+        return fila
+
+    def enfileirar_resgate(self, token_ids):
+        """Põe tokens disponíveis no outbox (e os tira do saldo). Retorna quantos entraram."""
+        with self.transacao() as conn:
+            return self._enfileirar(conn, token_ids)
+
+    # -----------------------------------------------------------
+    # Outbox de resgates
+    # -----------------------------------------------------------
+    def proximo_lote(self, max_tokens):
+        """
+        Lote a enviar: o lote aberto que sobrou de um envio interrompido (mesma
+        composição) ou, se não houver, um novo com até `max_tokens` tokens da fila,
+        gravado antes de retornar. Retorna (lote_id, tentativas, [(token_id, token)])
+        ou (None, 0, []) com a fila vazia.
+        """
+        with self.transacao() as conn:
+            row = conn.execute(
+                "SELECT id, tentativas FROM outbox_lotes WHERE NOT concluido ORDER BY id LIMIT 1").fetchone()
+            if row is None:
+                if not conn.execute("SELECT 1 FROM outbox WHERE state = 'QUEUED' LIMIT 1").fetchone():
+                    return None, 0, []
+                agora = time.time()
+                lote_id = conn.execute("INSERT INTO outbox_lotes (criado_em) VALUES (?)", (agora,)).lastrowid
+                conn.execute("""
+                    UPDATE outbox SET state = 'SENDING', lote_id = ?, atualizado_em = ?
+                    WHERE id IN (SELECT id FROM outbox WHERE state = 'QUEUED' ORDER BY id LIMIT ?)
+                """, (lote_id, agora, max_tokens))
+                row = (lote_id, 0)
+            membros = conn.execute("""
+                SELECT o.token_id, t.token_wire FROM outbox o JOIN tokens t USING (token_id)
+                WHERE o.lote_id = ? AND o.state = 'SENDING' ORDER BY o.id
+            """, (row[0],)).fetchall()
+        return row[0], row[1], [(tid, token_wire.decodificar(dados, self.chaves)[0]) for tid, dados in membros]
+
+    def registrar_envio(self, lote_id):
+        """Conta a tentativa ANTES do envio: tentativas > 0 = o lote pode já ter chegado ao servidor."""
+        with self.transacao() as conn:
+            conn.execute("UPDATE outbox_lotes SET tentativas = tentativas + 1 WHERE id = ?", (lote_id,))
+
+    def concluir_lote(self, lote_id, resgatados, recusados):
+        """
+        Reconciliação por token numa transação: `resgatados` (token_ids) viram
+        REDEEMED, `recusados` ({token_id: motivo}) ficam FAILED no outbox, e
+        membros sem resposta voltam para a fila. Fecha o lote.
+        """
+        agora = time.time()
+        with self.transacao() as conn:
+            conn.executemany("""
+                UPDATE outbox SET state = 'DONE', result = 'redeemed', atualizado_em = ?
+                WHERE token_id = ? AND lote_id = ?
+            """, [(agora, tid, lote_id) for tid in resgatados])
+            conn.executemany("UPDATE tokens SET state = 'REDEEMED' WHERE token_id = ?",
+                             [(tid,) for tid in resgatados])
+            conn.executemany("""
+                UPDATE outbox SET state = 'FAILED', result = ?, atualizado_em = ?
+                WHERE token_id = ? AND lote_id = ?
+            """, [(motivo, agora, tid, lote_id) for tid, motivo in recusados.items()])
+            conn.execute("""
+                UPDATE outbox SET state = 'QUEUED', lote_id = NULL, atualizado_em = ?
+                WHERE lote_id = ? AND state = 'SENDING'
+            """, (agora, lote_id))
+            conn.execute("UPDATE outbox_lotes SET concluido = 1 WHERE id = ?", (lote_id,))
+
+    def retirar(self, estado_destino=TRANSFERRED):
+        """
+        Tira atomicamente o próximo token disponível (menor denominação, mais antigo)
+        e o move para `estado_destino`. Retorna (token_id, token) ou (None, None).
+        """
+        with self.transacao() as conn:
+            row = conn.execute("""
+                UPDATE tokens SET state = ?
+                WHERE id = (SELECT id FROM tokens WHERE state = 'AVAILABLE'
+                            ORDER BY denom_cents, issued_at LIMIT 1)
+                RETURNING token_id, token_wire
+            """, (estado_destino,)).fetchone()
+        if row is None:
+            return None, None
+        return row[0], token_wire.decodificar(row[1], self.chaves)[0]
+
+    def reservar_valor(self, valor_cents, estado_destino=PENDING):
+        """
+        Escolhe (escolher_tokens) e move para `estado_destino`, numa única
+        transação, os tokens que pagam `valor_cents`.
+        Retorna ([(token_id, token), ...], excedente_cents); lança SaldoInsuficiente.
+        """
+        with self.transacao() as conn:
+            disponiveis = dict(conn.execute(
+                "SELECT denom_cents, qtd FROM saldo_por_estado WHERE state = 'AVAILABLE'").fetchall())
+            mix, excedente = escolher_tokens(valor_cents, disponiveis)
+            linhas = []
+            for denom, qtd in mix.items():
+                linhas += conn.execute("""
+                    UPDATE tokens SET state = ?
+                    WHERE id IN (SELECT id FROM tokens WHERE state = 'AVAILABLE' AND denom_cents = ?
+                                 ORDER BY issued_at LIMIT ?)
+                    RETURNING token_id, token_wire
+                """, (estado_destino, denom, qtd)).fetchall()
+        return [(tid, token_wire.decodificar(dados, self.chaves)[0]) for tid, dados in linhas], excedente
+
+    def marcar_varios(self, token_ids, estado, de=None):
+        """marcar() para vários tokens numa transação. Retorna quantos mudaram."""
+        with self.transacao() as conn:
+            if de is None:
+                cur = conn.executemany("UPDATE tokens SET state = ? WHERE token_id = ?",
+                                       [(estado, tid) for tid in token_ids])
+            else:
+                cur = conn.executemany("UPDATE tokens SET state = ? WHERE token_id = ? AND state = ?",
+                                       [(estado, tid, de) for tid in token_ids])
+            return cur.rowcount
+
+    def marcar(self, token_id, estado, de=None):
+        """Muda o estado de um token (só se estiver em `de`, quando informado). Retorna True se mudou."""
+        with self.transacao() as conn:
+            if de is None:
+                cur = conn.execute("UPDATE tokens SET state = ? WHERE token_id = ?", (estado, token_id))
+            else:
+                cur = conn.execute("UPDATE tokens SET state = ? WHERE token_id = ? AND state = ?",
+                                   (estado, token_id, de))
+            return cur.rowcount == 1
+
+    # -----------------------------------------------------------
+    # Leitura
+    # -----------------------------------------------------------
+    def token(self, token_id):
+        row = self.conn.execute("SELECT token_wire FROM tokens WHERE token_id = ?", (token_id,)).fetchone()
+        return token_wire.decodificar(row[0], self.chaves)[0] if row else None
+
+    def outbox(self):
+        """{estado do outbox: quantidade de tokens}."""
+        return dict(self.conn.execute("SELECT state, count(*) FROM outbox GROUP BY state").fetchall())
+
+    def saldo(self):
+        """{"available_cents": ..., "tokens": {estado: {denominação: qtd}}} lido de saldo_por_estado."""
+        por_estado = {}
+        for estado, denom, qtd in self.conn.execute(
+                "SELECT state, denom_cents, qtd FROM saldo_por_estado WHERE qtd > 0"):
+            por_estado.setdefault(estado, {})[denom] = qtd
+        disponiveis = por_estado.get(AVAILABLE, {})
+        return {
+            "available_cents": sum(d * n for d, n in disponiveis.items()),
+            "tokens": por_estado,
+        }